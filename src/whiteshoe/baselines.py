@@ -0,0 +1,53 @@
+import collections
+
+import constants
+
+class VisionHistory(object):
+    """The vision updates recently sent to one player, as (sequence,
+    coords changed), so each update can carry every change since the last
+    one the client acknowledged, its baseline.
+
+    The updates themselves aren't kept: the current known world is sent
+    for the changed coords, which brings a client at the baseline, or at
+    any later update, right up to date."""
+    def __init__(self, length=constants.VISION_HISTORY):
+        self.sequence = 0
+        self.updates = collections.deque(maxlen=length)
+        # None until the client acknowledges anything; until then every
+        # update is assumed to arrive, as it does over TCP.
+        self.acked = None
+
+    @property
+    def baseline(self):
+        if self.acked is None:
+            return self.sequence
+        return self.acked
+
+    def ack(self, sequence):
+        if sequence > self.sequence:
+            # Not one of ours
+            return
+        if self.acked is None or sequence > self.acked:
+            self.acked = sequence
+
+    def outstanding(self):
+        """The coords changed since the baseline, or None if that's too far
+        back to know."""
+        baseline = self.baseline
+        if baseline == self.sequence:
+            return set()
+
+        if not self.updates or self.updates[0][0] > baseline + 1:
+            return None
+
+        coords = set()
+        for sequence, changed in self.updates:
+            if sequence > baseline:
+                coords.update(changed)
+        return coords
+
+    def record(self, changed):
+        """Numbers a new update, with the coords that changed in it"""
+        self.sequence += 1
+        self.updates.append((self.sequence, frozenset(changed)))
+        return self.sequence
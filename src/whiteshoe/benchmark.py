@@ -0,0 +1,77 @@
+from __future__ import print_function
+
+import argparse
+import time
+
+import client
+import game
+import maps
+import packet_pb2
+import utility
+
+def resync_packets(map_generator='depth_first', players=8):
+    """Serialized VISION_UPDATE packets for a clear_all resync of a player
+    who knows the whole world, as the server would send them."""
+    g = game.modes['ffa'](map_generator=map_generator, vision='cone')
+    for player_id in range(players):
+        g.player_join(player_id, 'bench{0}'.format(player_id))
+
+    player_id = 0
+    g.known_worlds[player_id] = dict(
+        (coord, [obj.snapshot() for obj in cell])
+        for coord, cell in g.world.items())
+
+    packets = g._send_player_vision(player_id, list(g.world), all=True)
+    return [packet.SerializeToString() for player_id, packet in packets]
+
+def bench_vision_decode(data, repeat):
+    packets = [packet_pb2.Packet.FromString(d) for d in data]
+    objects = sum(len(packet.objects) // 4 for packet in packets)
+
+    network = client.ClientNetwork()
+
+    start = time.time()
+    for i in range(repeat):
+        for packet in packets:
+            network._vision_update(packet)
+    elapsed = time.time() - start
+
+    return {
+        'packets': len(packets) * repeat,
+        'objects': objects * repeat,
+        'seconds': elapsed,
+        'cells': len(network.known_world),
+    }
+
+def compressed_size(data, repeat):
+    """Bytes on a compressed TCP stream for the resync sent repeat times,
+    as it would be for a player who keeps dying"""
+    compressor = utility.StreamCompressor()
+    return sum(len(utility.stream_wrap(d, compressor))
+               for i in range(repeat) for d in data)
+
+def benchmark_main(args=None):
+    p = argparse.ArgumentParser(
+        description="Time the client decoding full vision resyncs")
+    p.add_argument('--map',default='depth_first',
+                   choices=sorted(maps.generators))
+    p.add_argument('--players',type=int,default=8)
+    p.add_argument('--repeat',type=int,default=200)
+    ns = p.parse_args(args)
+
+    data = resync_packets(ns.map, ns.players)
+    print("{0} packets, {1} bytes per resync".format(
+        len(data), sum(len(d) for d in data)))
+    print("compressed: {0} bytes for the first, {1} for each after".format(
+        compressed_size(data, 1),
+        (compressed_size(data, 10) - compressed_size(data, 1)) // 9))
+
+    result = bench_vision_decode(data, ns.repeat)
+    seconds = result['seconds']
+    print("{0} resyncs of {1} cells in {2:.3f}s".format(
+        ns.repeat, result['cells'], seconds))
+    print("{0:.3f} ms per resync, {1:.0f} objects/s".format(
+        seconds * 1000 / ns.repeat, result['objects'] / seconds))
+
+if __name__=='__main__':
+    benchmark_main()
@@ -1,4 +1,5 @@
 import time
+import random
 import socket
 import select
 import datetime
@@ -10,6 +11,13 @@ import constants
 import packet_pb2
 import client
 import utility
+import navigation
+
+behaviours = {}
+
+def behaviour(fn):
+    behaviours[fn.__name__] = fn
+    return fn
 
 def cmd_main():
     # parser here
@@ -20,19 +28,38 @@ def main(addr=('127.0.0.1',constants.DEFAULT_PORT), game_id=0):
     b.go()
 
 class Bot(object):
-    def __init__(self, addr, game_id):
+    def __init__(self, addr, game_id, socket_type='tcp', behaviour='hunter',
+                 name='Bot', rng=None):
         self.addr = addr
         self.game_id = game_id
+        self.socket_type = socket_type
+        self.name = name
+
+        # This *will* throw an exception if the behaviour doesn't exist
+        self.behaviour = behaviours[behaviour]
+
+        if rng is None:
+            rng = random.Random()
+        self.random = rng
 
         self.period = 0.2
 
         self.thought_timer = utility.RecurringTimer(self.period)
 
+        self.network = None
+
+    def start(self):
+        self.network = client.ClientNetwork(self.socket_type)
+        self.network.connect(self.addr)
+
+        self.navigation = navigation.NavigationGrid()
+        self.network.add_vision_listener(self.navigation.update)
+
+        self.network.join_game(autojoin=True,player_name=self.name)
+
     def go(self):
         try:
-            self.network = client.ClientNetwork()
-            self.network.connect(self.addr)
-            self.network.join_game(autojoin=True,player_name='Bot')
+            self.start()
 
             while True:
                     self.network.update()
@@ -53,42 +80,82 @@ class Bot(object):
         except client.PlayerNotFound:
             pass
         else:
-            obj, attr = player
-            visible = self.network.get_visible()
-            cmd = None
+            cmd = self.behaviour(self, coord, player)
 
-            # Look ahead.
-            direction = attr['direction']
+            if cmd is not None:
+                self.network.send_command(*cmd)
 
-            diff = constants.DIFFS[direction]
+    def find_enemies(self):
+        enemies = []
+        for coord, objects in self.network.get_visible().items():
+            for obj, attr in objects:
+                if (obj == constants.OBJ_PLAYER and
+                    attr['player_id'] != self.network.player_id):
+                    enemies.append(coord)
+        return enemies
 
-            ahead = coord[0] + diff[0], coord[1] + diff[1]
+def _rotate(direction):
+    # Rotate
+    index = constants.DIRECTIONS.index(direction)
+    index += 1
+    index %= len(constants.DIRECTIONS)
 
-            if ahead in visible:
-                if any(object[0] in constants.SOLID_OBJECTS
-                       for object in visible[ahead]):
+    # That's what makes you beautiful etc.
+    new_direction = constants.DIRECTIONS[index]
+    # Wait no, that's one_direction
+    return (constants.CMD_LOOK, new_direction)
 
-                    cmd = self._rotate(direction)
+@behaviour
+def wander(bot, coord, player):
+    obj, attr = player
+    visible = bot.network.get_visible()
 
-                else:
-                    # Move forward
-                    cmd = (constants.CMD_MOVE, direction)
-            else:
-                cmd = self._rotate(direction)
+    # Look ahead.
+    direction = attr['direction']
 
-            if cmd is not None:
-                self.network.send_command(*cmd)
+    diff = constants.DIFFS[direction]
 
-    def _rotate(self, direction):
-        # Rotate
-        index = constants.DIRECTIONS.index(direction)
-        index += 1
-        index %= len(constants.DIRECTIONS)
+    ahead = coord[0] + diff[0], coord[1] + diff[1]
 
-        # That's what makes you beautiful etc.
-        new_direction = constants.DIRECTIONS[index]
-        # Wait no, that's one_direction
-        return (constants.CMD_LOOK, new_direction)
+    if ahead in visible:
+        if any(object[0] in constants.SOLID_OBJECTS
+               for object in visible[ahead]):
+
+            return _rotate(direction)
+
+        else:
+            # Move forward
+            return (constants.CMD_MOVE, direction)
+    else:
+        return _rotate(direction)
+
+@behaviour
+def hunter(bot, coord, player):
+    # Go after anyone we can remember seeing
+    enemies = bot.find_enemies()
+    if enemies:
+        direction = bot.navigation.next_step(coord, enemies, key='enemies')
+        if direction is not None:
+            return (constants.CMD_MOVE, direction)
+
+    return wander(bot, coord, player)
+
+@behaviour
+def chaos(bot, coord, player):
+    # Mash buttons, including all the expensive ones
+    cmd = bot.random.choice((constants.CMD_MOVE, constants.CMD_LOOK,
+                             constants.CMD_FIRE))
+    if cmd == constants.CMD_FIRE:
+        arg = bot.random.choice((constants.N1, constants.N2, constants.N3,
+                                 constants.N9, constants.SMALL_SLIME,
+                                 constants.BIG_SLIME))
+    else:
+        arg = bot.random.choice(constants.DIRECTIONS)
+    return (cmd, arg)
+
+@behaviour
+def idle(bot, coord, player):
+    return None
 
 if __name__=='__main__':
     cmd_main()
@@ -9,15 +9,20 @@ import time
 import readline
 import code
 import random
+import sys
 import logging
 import threading
 import collections
+import itertools
 import operator
 import json
+import zlib
 
 import constants
 import packet_pb2
-from utility import get_id, grouper
+import scoreboard
+import reliable
+from utility import get_id
 import utility
 
 logger = logging.getLogger(__name__)
@@ -29,6 +34,10 @@ def client_main(args=None):
     p.add_argument('-n','--name')
     p.add_argument('-t','--team',type=int)
     p.add_argument('--socket-type',default='tcp')
+    p.add_argument('--predict',action='store_true',default=False,
+                   help="show moves and looks before the server confirms them")
+    p.add_argument('--compression',action='store_true',default=False,
+                   help="ask the server to compress large packets (TCP only)")
     p.add_argument('-o',dest='option_strings',action='append',default=[])
 
     ns = p.parse_args(args)
@@ -46,7 +55,8 @@ def client_main(args=None):
     ns.options = options
 
     #logging.basicConfig(filename='client.log',level=logging.DEBUG)
-    network = ClientNetwork(ns.socket_type)
+    network = ClientNetwork(ns.socket_type, predict=ns.predict,
+                            compression=ns.compression)
     network.connect((ns.ipaddr, None))
 
     #network.join_game((ns.connect, None), autojoin=True)
@@ -119,7 +129,9 @@ class SetupScene(object):
         team = self.namespace.team
 
         scene = GameScene(self.namespace, self.network)
-        self.network.join_game(autojoin=True,player_name=name,player_team=team)
+        with self.network_lock:
+            self.network.join_game(autojoin=True,player_name=name,
+                                   player_team=team)
         raise NewScene(scene)
 
     def cleanup(self):
@@ -129,7 +141,7 @@ class SetupScene(object):
         pass
 
     def _start_thread(self):
-        self.thread_running = True
+        self.stopping = threading.Event()
 
         self.network_thread = threading.Thread(name='NetworkThread',
                                                target=self._thread_run)
@@ -138,8 +150,7 @@ class SetupScene(object):
         self.network_thread.start()
 
     def _stop_thread(self):
-        with self.network_lock:
-            self.thread_running = False
+        self.stopping.set()
 
         self.network_thread.join(timeout=0.4)
 
@@ -150,13 +161,12 @@ class SetupScene(object):
 
     def _thread_run(self):
         # I am sorry for my use of threads in Python, I am a horrible person.
-        while True:
-            # Allows the main thread to obtain this lock
-            time.sleep(0.01)
+        # The thread sleeps in select until the server sends something,
+        # without the lock, so the main thread can have it at any time.
+        while not self.stopping.is_set():
+            select.select((self.network,), (), (), 0.1)
             with self.network_lock:
-                if not self.thread_running:
-                    break
-                self.network.update()
+                self.network.wait(timeout=0)
 
 class ConsoleScene(object):
     def __init__(self, namespace, network):
@@ -193,36 +203,35 @@ class ScoreScene(object):
     def _real_interact(self, stdscr):
         curses_setup(stdscr)
 
-        # FIXME since scores comes from namespace, it doesn't update if
-        # network gets new information. This should be fixed, probably
-        # by scores being stored in the network object?
+        scoreboard = self.network.scoreboard
 
-        if 'scores' in self.namespace:
+        while True:
             stdscr.clear()
 
-            scores = self.namespace.scores
-
             y = 0
             stdscr.addstr(y, 0, "Scores")
             y += 1
 
-            grouped_scores = list(utility.grouper(2, scores))
-            grouped_scores.sort(key=operator.itemgetter(1),reversed=True)
-
-            for player_id, score in grouped_scores:
-                name = self.network.players[player_id]
+            # The scoreboard is kept up to date by the network, and is
+            # already in order
+            for player_id, score in scoreboard.top():
+                name = self.network.players.get(player_id)
+                if name is None:
+                    continue
 
                 stdscr.addstr(y, 0, "{} : {}".format(name, score))
                 y += 1
 
-            while True:
-                self.network.update()
+            stdscr.refresh()
 
-                # non-blocking
-                c = stdscr.getch()
-                if c != curses.ERR:
-                    # Any key quits ScoreScene
-                    break
+            # Redraw when the scores change, or a key is pressed
+            self.network.wait((sys.stdin,))
+
+            # non-blocking
+            c = stdscr.getch()
+            if c != curses.ERR:
+                # Any key quits ScoreScene
+                break
 
         scene = GameScene(self.namespace, self.network)
         raise NewScene(scene)
@@ -242,6 +251,17 @@ class GameScene(object):
         self.data = self.namespace.local_data = {}
         self.unused_events = self.namespace.unused_events = []
 
+        # Only the parts of the screen that have changed since the last
+        # frame are redrawn. Cells of the known_world are marked dirty
+        # by the network as vision updates arrive.
+        self.dirty = set()
+        self.redraw_all = True
+        # Animated cells are marked dirty every ANIMATION_PERIOD
+        self.frame_timer = utility.RecurringTimer(constants.ANIMATION_PERIOD)
+        self.drawn_topleft = None
+        self.drawn_cursor = None
+        self.infobar_lines = None
+
     def interact(self):
         curses.wrapper(self._real_interact)
 
@@ -250,21 +270,19 @@ class GameScene(object):
 
         self.first_tick(stdscr)
 
-        while True:
-            # Calling .tick will make the client network update,
-            # which will use select to check the socket, meaning we sleep
-            # for a small amount of time
-            # So no 100% CPU usage
-            self.tick(stdscr)
+        self.network.add_vision_listener(self._vision_changed)
+        try:
+            while True:
+                # .tick sleeps until there's something from the server
+                # or a key has been pressed, so commands are sent as soon
+                # as the key is pressed, and there's no busy waiting.
+                if self.tick(stdscr):
+                    self.read_keys(stdscr)
+        finally:
+            self.network.remove_vision_listener(self._vision_changed)
 
-            # non-blocking
-            c = stdscr.getch()
-            if c != curses.ERR:
-                # 27 is the <ESC> key
-                if c == 27:
-                    raise CloseProgram
-                else:
-                    self.input(stdscr, c)
+    def _vision_changed(self, known_world, coords):
+        self.dirty.update(coords)
 
 
     def cleanup(self):
@@ -331,19 +349,30 @@ class GameScene(object):
 
         return viewport, infobar
 
-    def tick(self, stdscr):
-        self.network.update()
+    def read_keys(self, stdscr):
+        while True:
+            # non-blocking
+            c = stdscr.getch()
+            if c == curses.ERR:
+                break
+            # 27 is the <ESC> key
+            elif c == 27:
+                raise CloseProgram
+            else:
+                self.input(stdscr, c)
 
+    def tick(self, stdscr):
+        """Draws whatever has changed, then waits for the network or the
+        keyboard. Returns whether there are keys waiting."""
         for event in self.network.get_events():
             if event[0] in {constants.STATUS_DAMAGED, constants.STATUS_DEATH}:
                 curses.flash()
             else:
                 self.unused_events.append(event)
 
-
-        self.viewport.clear()
-
-        self.draw_infobar()
+        animated = self.animated_cells(self.network.get_visible())
+        if animated and self.frame_timer.check():
+            self.dirty.update(animated)
 
         try:
             my_coord, player = self.network.find_me()
@@ -352,10 +381,30 @@ class GameScene(object):
             # Do not draw the viewport
             pass
         else:
-            self.draw_viewport(self.data['topleft'])
-            curses.doupdate()
+            changed = self.draw_infobar()
+            changed = self.draw_viewport(self.data['topleft']) or changed
+            if changed:
+                curses.doupdate()
+
+        # Nothing to animate means nothing to wake up for
+        if animated:
+            timeout = constants.ANIMATION_PERIOD
+        else:
+            timeout = None
+        keys = self.network.wait((sys.stdin,), timeout)
+        return bool(keys)
+
+    def animated_cells(self, visible):
+        """Returns the coords that look different every frame"""
+        # Hallucinating picks new colours for everything
+        if self.data.get('hallu', False):
+            return set(visible)
+        return set()
 
     def draw_viewport(self, topleft):
+        """Draws the cells that have changed since the last frame, or
+        everything if the viewport has scrolled. Returns whether anything
+        was drawn."""
         visible = self.network.get_visible()
         my_coord, player = self.network.find_me()
 
@@ -363,13 +412,6 @@ class GameScene(object):
 
         bottomright = [topleft[0] + max_x, topleft[1] + max_y]
 
-        drawing = set()
-        for i in range(topleft[0], bottomright[0]):
-            for j in range(topleft[1], bottomright[1]):
-                drawing.add((i,j))
-
-        # drawing is the set of in-game coordinates that we are going
-        # to draw
         while not all(topleft[i] <= my_coord[i] < bottomright[i]
                       for i in (0,1)):
             if bottomright[0] <= my_coord[0]:
@@ -384,58 +426,81 @@ class GameScene(object):
             # Recalculate bottomright
             bottomright = [topleft[0] + max_x, topleft[1] + max_y]
 
-        if my_coord in drawing:
-            screen_x,screen_y = (my_coord[0] - topleft[0],
-                                 my_coord[1] - topleft[1])
-            curses.curs_set(2) # block cursor
+        if self.redraw_all or self.drawn_topleft != tuple(topleft):
+
+            self.viewport.erase()
+            coords = visible
+            self.redraw_all = False
+            self.drawn_topleft = tuple(topleft)
         else:
-            screen_x, screen_y = (0,0)
-            curses.curs_set(0) # hide cursor
+            coords = self.dirty
 
+        self.dirty = set()
 
-        for coord, objects in visible.items():
-            if coord not in drawing:
-                continue
+        drawn = False
+        for coord in coords:
+            if (topleft[0] <= coord[0] < bottomright[0] and
+                topleft[1] <= coord[1] < bottomright[1]):
+                self._draw_cell(visible, coord, topleft)
+                drawn = True
 
-            x,y = (coord[0] - topleft[0], coord[1] - topleft[1])
-            if objects:
-                for o in objects:
-                    display_chr, colour = self.display_character(o)
-                try:
-                    self.viewport.addstr(y,x,display_chr, colour)
-                except curses.error:
-                    pass
-            elif self.data.get('empty-?'):
-                # A bold purple ? mark indicates a coordinate that is
-                # in the known_world, but has no objects, meaning it has
-                # been explicitly cleared by the network.
-                #
-                # This is an artifact that may or may not be present
-                # as stuff changes.
-                purple = curses.color_pair(5) | curses.A_BOLD
-                self.viewport.addstr(y,x,"?",purple)
-                pass
+        cursor = (my_coord[0] - topleft[0], my_coord[1] - topleft[1])
+        if not drawn and cursor == self.drawn_cursor:
+            return False
+
+        if self.drawn_cursor is None:
+            curses.curs_set(2) # block cursor
+        self.drawn_cursor = cursor
 
         # Cursor on player
+        screen_x, screen_y = cursor
         self.viewport.move(screen_y,screen_x)
         self.viewport.noutrefresh()
+        return True
+
+    def _draw_cell(self, visible, coord, topleft):
+        x,y = (coord[0] - topleft[0], coord[1] - topleft[1])
+        objects = visible.get(coord)
+
+        if objects:
+            # Only the last object in a cell is shown
+            display_chr, colour = self.display_character(objects[-1])
+        elif objects is not None and self.data.get('empty-?'):
+            # A bold purple ? mark indicates a coordinate that is
+            # in the known_world, but has no objects, meaning it has
+            # been explicitly cleared by the network.
+            #
+            # This is an artifact that may or may not be present
+            # as stuff changes.
+            display_chr = "?"
+            colour = curses.color_pair(5) | curses.A_BOLD
+        else:
+            display_chr = " "
+            colour = curses.color_pair(0)
+
+        try:
+            self.viewport.addstr(y,x,display_chr, colour)
+        except curses.error:
+            # Writing to the bottom right corner moves the cursor off
+            # the window
+            pass
 
     def draw_infobar(self):
+        """Returns whether anything was drawn"""
         assert self.infobar_type in ('rightside', 'bottom')
 
         if self.infobar_type == 'bottom':
-            self._draw_bottom_infobar()
+            return self._draw_bottom_infobar()
         elif self.infobar_type == 'rightside':
-            self._draw_rightside_infobar()
+            return self._draw_rightside_infobar()
 
     def _draw_rightside_infobar(self):
         visible = self.network.get_visible()
         my_coord, player = self.network.find_me()
         self.infobox.border()
+        return True
 
     def _draw_bottom_infobar(self):
-        self.infobar.clear()
-        visible = self.network.get_visible()
         try:
             my_coord, player = self.network.find_me()
 
@@ -443,13 +508,12 @@ class GameScene(object):
         except PlayerNotFound:
             attr = {}
 
-        # Attempt to determine our score.
-        scores_json = self.network.keyvalues.get(constants.KEYVALUE_SCORES)
-        scores = json.loads(scores_json) if scores_json else {}
-
-        # Cooerce string json keys to numeric keys
-        for key in list(scores):
-            scores[int(key)] = scores[key]
+        scoreboard = self.network.scoreboard
+        top = scoreboard.top(1)
+        if top:
+            top_id, top_score = top[0]
+        else:
+            top_id, top_score = None, '?'
 
         fmta = {
             'name' : attr.get('name', 'Unnamed'),
@@ -457,9 +521,9 @@ class GameScene(object):
             'hp_max': attr.get('hp_max', '?'),
             'ammo': attr.get('ammo','?'),
             'player_id': attr.get('player_id','?'),
-            'topname': '?',
-            'topscore': '?',
-            'yourscore': scores.get(attr.get('player_id','?'), '?'),
+            'topname': self.network.players.get(top_id, '?'),
+            'topscore': top_score,
+            'yourscore': scoreboard.get(attr.get('player_id'), '?'),
         }
 
         fmt1 = "Name: {name}"
@@ -472,13 +536,17 @@ class GameScene(object):
         # Adding scores to the bottom row.
         fmt2 += ' Score: {yourscore}'
 
-        line1 = fmt1.format(**fmta)
-        line2 = fmt2.format(**fmta)
+        lines = fmt1.format(**fmta), fmt2.format(**fmta)
+        if lines == self.infobar_lines:
+            return False
+        self.infobar_lines = lines
 
-        self.infobar.addstr(0,0,line1)
-        self.infobar.addstr(1,0,line2)
+        self.infobar.erase()
+        self.infobar.addstr(0,0,lines[0])
+        self.infobar.addstr(1,0,lines[1])
 
         self.infobar.noutrefresh()
+        return True
 
     def display_character(self, object, history=False):
         display_chr = None
@@ -624,7 +692,7 @@ class GameScene(object):
                 pass
 
 class ClientNetwork(object):
-    def __init__(self,socket_type='tcp'):
+    def __init__(self,socket_type='tcp',predict=False,compression=False):
         self.handlers = {
             # c->s get games list
             constants.GAMES_LIST: self._games_running,
@@ -642,6 +710,11 @@ class ClientNetwork(object):
         assert socket_type in ('tcp','udp')
         self.socket_type = socket_type
 
+        if socket_type == 'udp':
+            self.channel = reliable.ReliableChannel()
+        else:
+            self.channel = None
+
         self.known_world = {}
 
         self.game_id = None
@@ -655,10 +728,47 @@ class ClientNetwork(object):
         self.keepalive_timer = utility.Stopwatch()
         self.lastheard_timer = utility.Stopwatch()
 
-        self._cached_player = None
+        # player_id -> (coord, object) and coord -> player_ids, for every
+        # player in the known_world, kept up to date by _notify_vision
+        self.player_index = {}
+        self.player_coords = {}
+
+        # When predicting, our moves and looks are shown in the
+        # known_world straight away. Until the server says it has carried
+        # them out, they're kept in pending as (sequence, cmd, arg, time
+        # sent), and the server's version of the cells they changed in
+        # predicted. Any the server never acknowledges are dropped after
+        # PREDICTION_TIMEOUT.
+        self.predict = predict
+        self.action_sequence = 0
+        # Actions are numbered when predicting, or if this is set. The
+        # server says which it has carried out in acked_sequence.
+        self.number_actions = predict
+        self.acked_sequence = 0
+        self.pending = collections.deque()
+        self.predicted = {}
+
+        # The vision update being applied, the last one that has been
+        # applied in full, and how many parts of the current one are in
+        self.vision_sequence = 0
+        self.vision_complete = 0
+        self._vision_parts = 0
+
         self._buffer = ''
+        # Whether to ask for compression, and the decompressor for the
+        # stream from the server, which any compressed chunk goes through
+        self.compression = compression and socket_type == 'tcp'
+        self._decompressobj = zlib.decompressobj()
 
         self.keyvalues = {}
+        self.scoreboard = scoreboard.Scoreboard()
+
+        self.vision_listeners = []
+
+        self.stats = {'packets_sent':0,
+                      'packets_recieved':0,
+                      'bytes_sent':0,
+                      'bytes_recieved':0}
 
     def connect(self, addr):
         family = socket.AF_INET6
@@ -678,15 +788,30 @@ class ClientNetwork(object):
         elif self.socket_type == 'udp':
             type_ = socket.SOCK_DGRAM
 
+        self._new_connection()
         self.socket = socket.socket(family, type_)
         self._server_addr = (ip, port)
 
         if self.socket_type == 'tcp':
             self.socket.connect((ip, port))
 
-        self._send_keepalive()
+        self._send_keepalive(compression=self.compression)
         self.lastheard_timer.start()
 
+    def _new_connection(self):
+        # The server starts afresh for each connection: a new compressed
+        # stream, reliable channel and vision history, and its own
+        # numbering of acknowledged actions
+        self._buffer = ''
+        self._decompressobj = zlib.decompressobj()
+        if self.channel is not None:
+            self.channel = reliable.ReliableChannel()
+
+        self.vision_sequence = 0
+        self.vision_complete = 0
+        self._vision_parts = 0
+        self.acked_sequence = 0
+
     def join_game(self, autojoin=False, game_id=None,
                   player_name=None, player_team=None):
 
@@ -711,17 +836,61 @@ class ClientNetwork(object):
     def update(self):
         # Do network things
         if self.socket is not None:
-            self._cached_player = None
-            self._ticklet()
+            self.wait(timeout=0.1)
 
+    def wait(self, others=(), timeout=None):
+        """Sleeps until the server sends something, one of the others is
+        readable, or timeout seconds pass; by default, until a keepalive
+        is due. Handles what the server sent, and returns the others that
+        are ready to read."""
+        assert self.socket is not None
 
-            if self.keepalive_timer.elapsed_seconds > constants.KEEPALIVE_TIME:
+        keepalive_due = max(constants.KEEPALIVE_TIME -
+                            self.keepalive_timer.elapsed_seconds, 0)
+        if timeout is None or keepalive_due < timeout:
+            timeout = keepalive_due
+
+        deadlines = []
+        if self.channel is not None:
+            deadlines.append(self.channel.next_deadline())
+        if self.pending:
+            deadlines.append(self.pending[0][3] + constants.PREDICTION_TIMEOUT)
+        for deadline in deadlines:
+            if deadline is not None:
+                timeout = min(timeout, max(deadline - time.time(), 0))
+
+        rlist, wlist, xlist = select.select((self.socket,) + tuple(others),
+                                            (),(),timeout)
+        ready = []
+        for f in rlist:
+            if f is self.socket:
+                self.handle_readable()
+            else:
+                ready.append(f)
+
+        self.check_timers()
+        return ready
+
+    def check_timers(self):
+        if self.pending:
+            self._expire_predictions()
+
+        if self.channel is not None:
+            # Only critical packets are sent from the client, so all the
+            # lost ones are sent again
+            lost = self.channel.lost()
+            if lost:
+                self._send_packets(lost)
+            if self.channel.ack_due():
                 self._send_keepalive()
 
-            if self.lastheard_timer.elapsed_seconds > 30:
-                # Later, we'll flag the server as being disconnected,
-                # but for now, raise the exception FIXME
-                raise ServerDisconnect
+        if self.keepalive_timer.elapsed_seconds > constants.KEEPALIVE_TIME:
+            self._send_keepalive()
+
+        if self.lastheard_timer.elapsed_seconds > 30:
+            # Later, we'll flag the server as being disconnected,
+            # but for now, raise the exception FIXME
+            raise ServerDisconnect
 
     def shutdown(self, reason=constants.DISCONNECT_SHUTDOWN):
         if self.socket is not None:
@@ -732,50 +901,71 @@ class ClientNetwork(object):
 
             self._send_packets((p,))
 
-    def _ticklet(self):
-        rlist, wlist, xlist = select.select((self.socket,),(),(),0.1)
-        for rs in rlist:
-            if self.socket_type == 'udp':
-                data, addr = rs.recvfrom(4096)
-                chunks = (data,)
-            elif self.socket_type == 'tcp':
-                data = rs.recv(4096)
-                if not data:
-                    raise ServerDisconnect
-
-                self._buffer += data
-                chunks, buffer = utility.stream_unwrap(self._buffer)
-                self._buffer = buffer
-
-            self.lastheard_timer.restart()
-            try:
-                for chunk in chunks:
-                    packet = packet_pb2.Packet.FromString(chunk)
+    def fileno(self):
+        return self.socket.fileno()
+
+    def handle_readable(self):
+        # Called when the socket has data waiting, either from wait or
+        # from somebody else's event loop (see swarm.py)
+        if self.socket_type == 'udp':
+            data, addr = self.socket.recvfrom(4096)
+            chunks = (data,)
+        elif self.socket_type == 'tcp':
+            data = self.socket.recv(4096)
+            if not data:
+                raise ServerDisconnect
 
-                    self.handlers[packet.payload_type](packet)
+            self._buffer += data
+            chunks, buffer = utility.stream_unwrap(self._buffer,
+                                                   self._decompressobj)
+            self._buffer = buffer
 
-            except Exception as e:
-                #traceback.print_exc()
-                # Can't print exceptions when the tty is up
-                raise
+        self.lastheard_timer.restart()
+        try:
+            for chunk in chunks:
+                packet = packet_pb2.Packet.FromString(chunk)
+
+                self.stats['packets_recieved'] += 1
+                self.stats['bytes_recieved'] += len(chunk)
 
-    def _send_keepalive(self):
+                if self.channel is None:
+                    self.handlers[packet.payload_type](packet)
+                else:
+                    # Duplicates and stale packets are dropped, and
+                    # critical packets are held until their turn
+                    for packet in self.channel.receive(packet):
+                        self.handlers[packet.payload_type](packet)
+
+        except Exception as e:
+            #traceback.print_exc()
+            # Can't print exceptions when the tty is up
+            raise
+
+    def _send_keepalive(self, compression=False):
         p = packet_pb2.Packet()
         p.packet_id = get_id('packet')
         p.payload_type = constants.KEEP_ALIVE
         p.timestamp = int(time.time())
+        if compression:
+            p.compression = True
 
         self._send_packets([p])
 
     def _send_packets(self, packets):
         if self.socket is not None:
             for packet in packets:
+                if self.channel is not None:
+                    packet.vision_ack = self.vision_complete
+                    self.channel.stamp(packet)
                 data = packet.SerializeToString()
                 if self.socket_type == 'tcp':
                     self.socket.sendall(utility.stream_wrap(data))
                 elif self.socket_type == 'udp':
                     self.socket.sendto(data, self._server_addr)
 
+                self.stats['packets_sent'] += 1
+                self.stats['bytes_sent'] += len(data)
+
             self.keepalive_timer.restart()
 
     def send_command(self,cmd,arg):
@@ -794,30 +984,128 @@ class ClientNetwork(object):
         p.action = cmd_num
         p.argument = arg_num
 
+        if self.number_actions:
+            self.action_sequence += 1
+            p.action_sequence = self.action_sequence
+
         self._send_packets([p])
 
-    def find_me(self):
-        assert self.socket is not None
+        if self.predict and cmd in (constants.CMD_MOVE, constants.CMD_LOOK):
+            self.pending.append((self.action_sequence, cmd, arg,
+                                 time.time()))
+            self._notify_vision(self._predict(cmd, arg))
 
-        if self.player_id is not None:
-            if self._cached_player is not None:
-                return self._cached_player
-            else:
-                for coord, objects in self.known_world.items():
-                    for object in objects:
-                        if (object[0] == constants.OBJ_PLAYER and
-                            object[1]['player_id'] == self.player_id):
+    def _predict(self, cmd, arg):
+        """Changes the known_world the way the server is expected to for
+        one of our commands. Returns the coords changed."""
+        try:
+            coord, player = self.find_me()
+        except PlayerNotFound:
+            return set()
+
+        obj_type, attr = player
+        cell = self.known_world[coord]
+
+        if cmd == constants.CMD_LOOK:
+            turned = (obj_type, dict(attr, direction=arg))
+            self._predict_cell(coord, [turned if o is player else o
+                                       for o in cell])
+            changed = {coord}
+
+        elif cmd == constants.CMD_MOVE:
+            diff = constants.DIFFS[arg]
+            new_coord = (coord[0] + diff[0], coord[1] + diff[1])
+
+            # Only move into cells that we know are clear
+            new_cell = self.known_world.get(new_coord)
+            if new_cell is None or any(o[0] in constants.SOLID_OBJECTS
+                                       for o in new_cell):
+                return set()
+
+            self._predict_cell(coord, [o for o in cell if o is not player])
+            self._predict_cell(new_coord, new_cell + [player])
+            changed = {coord, new_coord}
+
+        self._index_players(changed)
+        return changed
+
+    def _predict_cell(self, coord, cell):
+        if coord not in self.predicted:
+            self.predicted[coord] = self.known_world[coord]
+        self.known_world[coord] = cell
+
+    def _unpredict(self):
+        """Puts back the server's version of the predicted cells. Returns
+        the coords changed."""
+        restored = set(self.predicted)
+        self.known_world.update(self.predicted)
+        self.predicted = {}
+        return restored
+
+    def _expire_predictions(self):
+        expired = time.time() - constants.PREDICTION_TIMEOUT
+        if self.pending[0][3] > expired:
+            return
+
+        while self.pending and self.pending[0][3] <= expired:
+            self.pending.popleft()
+
+        # Show the server's version, with whatever is still pending
+        changed = self._unpredict()
+        self._index_players(changed)
+        for sequence, cmd, arg, sent in self.pending:
+            changed |= self._predict(cmd, arg)
+        self._notify_vision(changed)
+
+    def _forget_predictions(self):
+        self.pending.clear()
+        self.predicted = {}
 
-                            self._cached_player = (coord, object)
+    def find_me(self):
+        assert self.socket is not None
 
-                            return coord, object
+        return self.find_player(self.player_id)
 
-        # If no player is found
-        raise PlayerNotFound
+    def find_player(self, player_id):
+        """Returns (coord, object) of a player in the known_world"""
+        try:
+            return self.player_index[player_id]
+        except KeyError:
+            raise PlayerNotFound
 
     def get_visible(self):
         return self.known_world
 
+    def add_vision_listener(self, listener):
+        # listener(known_world, coords) is called with the coords of the
+        # known_world that have just changed.
+        self.vision_listeners.append(listener)
+
+    def remove_vision_listener(self, listener):
+        self.vision_listeners.remove(listener)
+
+    def _notify_vision(self, coords):
+        self._index_players(coords)
+        for listener in self.vision_listeners:
+            listener(self.known_world, coords)
+
+    def _index_players(self, coords):
+        player_index = self.player_index
+        player_coords = self.player_coords
+
+        for coord in coords:
+            for player_id in player_coords.pop(coord, ()):
+                found = player_index.get(player_id)
+                if found is not None and found[0] == coord:
+                    del player_index[player_id]
+
+        for coord in coords:
+            for object in self.known_world.get(coord, ()):
+                if object[0] == constants.OBJ_PLAYER:
+                    player_id = object[1]['player_id']
+                    player_index[player_id] = coord, object
+                    player_coords.setdefault(coord, set()).add(player_id)
+
     def get_events(self):
         e = self.events
         self.events = []
@@ -844,45 +1132,89 @@ class ClientNetwork(object):
         }
         repeated Attribute attributes = 601;
         """
-        # unpack attributes first
-        unpacked_attributes = []
-
-        for attribute in packet.attributes:
-            unpacked = {}
-            for key in constants.ATTRIBUTE_KEYS:
-                if attribute.HasField(key):
-                    value = getattr(attribute, key)
-                    if key in constants.ATTRIBUTE_CONSTANT_KEYS:
-                        value = constants.from_numerical_constant(value)
-                    unpacked[key] = value
-
-            unpacked_attributes.append(unpacked)
-
-        cleared = set()
+        if packet.HasField('vision_sequence'):
+            sequence = packet.vision_sequence
+            if sequence < self.vision_sequence or (
+                not packet.clear_all and
+                packet.vision_baseline > self.vision_complete):
+                # Older than what we have, or the changes since an
+                # update that we don't have all of
+                return
+
+            if sequence > self.vision_sequence:
+                self.vision_sequence = sequence
+                self._vision_parts = 0
+            self._vision_parts += 1
+            if self._vision_parts == packet.vision_parts:
+                self.vision_complete = sequence
+
+        # Each attribute is decoded once, and the same dict is shared by
+        # every object that refers to it, so they mustn't be modified.
+        # The empty dict on the end is what an attr_id of -1 finds.
+        attributes = [_unpack_attribute(attribute)
+                      for attribute in packet.attributes]
+        attributes.append({})
+
+        # The server's update applies to its version of the world
+        restored = self._unpredict()
 
         if packet.clear_all:
+            # Everything we knew about has changed as well
+            cleared_all = set(self.known_world)
             self.known_world.clear()
+        else:
+            cleared_all = set()
 
+        # objects is a flat list of x,y,obj_type,attr_id
+        objects = packet.objects[:]
+        assert len(objects) % 4 == 0
 
-        for x,y,obj_type,attr_id in grouper(4, packet.objects):
-            assert None not in (x,y,obj_type,attr_id)
-
-            if attr_id == -1:
-                attr = {}
-            else:
-                attr = unpacked_attributes[attr_id].copy()
-
-            if (x,y) not in cleared:
-                self.known_world[x,y] = []
+        known_world = self.known_world
+        cleared = set()
+        coord = cell = None
+
+        for x, y, obj_type, attr_id in itertools.izip(objects[0::4],
+                                                      objects[1::4],
+                                                      objects[2::4],
+                                                      objects[3::4]):
+            if obj_type == -2:
+                # An obj_type of -2 forgets the (x,y) cell
+                known_world.pop((x,y), None)
                 cleared.add((x,y))
+                coord = None
+                continue
+
+            # The objects of a cell are sent together
+            if coord != (x,y):
+                coord = x,y
+                if coord in cleared:
+                    # Forgotten or cleared earlier in this packet
+                    cell = known_world.setdefault(coord, [])
+                else:
+                    cell = known_world[coord] = []
+                    cleared.add(coord)
 
             if obj_type == -1:
                 # An obj_type of -1 merely clears the (x,y) cell
                 continue
 
-            obj_type = constants.from_numerical_constant(obj_type)
+            cell.append((obj_type, attributes[attr_id]))
 
-            self.known_world[x,y].append((obj_type, attr))
+        changed = cleared | cleared_all | restored
+
+        if packet.HasField('acked_sequence'):
+            acked = self.acked_sequence = packet.acked_sequence
+            while self.pending and self.pending[0][0] <= acked:
+                self.pending.popleft()
+
+        if self.pending:
+            # Replay the commands the server hasn't got to yet on top of
+            # what it has sent
+            self._index_players(changed)
+            for sequence, cmd, arg, sent in self.pending:
+                changed |= self._predict(cmd, arg)
+
+        self._notify_vision(changed)
 
     def _keep_alive(self, packet):
         pass
@@ -898,6 +1230,13 @@ class ClientNetwork(object):
             self.vision = packet.game_vision
             event = (status, self.game_id, self.player_id, self.vision)
 
+            # Scores and vision updates from any previous game no longer
+            # apply
+            self.scoreboard.clear()
+            self.vision_sequence = 0
+            self.vision_complete = 0
+            self._vision_parts = 0
+
         elif status == constants.STATUS_JOINED:
             event = (status, packet.game_id, packet.player_id,
                      packet.joined_player_name)
@@ -907,6 +1246,9 @@ class ClientNetwork(object):
             if packet.player_id == self.player_id:
                 # You just left the game
                 self.game_id = None
+            else:
+                self.players.pop(packet.player_id, None)
+                self.scoreboard.remove(packet.player_id)
 
         elif status == constants.STATUS_SPAWN:
             pass
@@ -920,7 +1262,9 @@ class ClientNetwork(object):
 
             event = (status, responsible, damage_type)
             if status == constants.STATUS_DEATH:
-                self.known_world.clear()
+                # The server tells us which cells to forget in the next
+                # vision update
+                self._forget_predictions()
 
         elif status == constants.STATUS_KILL:
             event = (status, packet.victim_id)
@@ -948,11 +1292,15 @@ class ClientNetwork(object):
     def _disconnect(self, packet):
         # Like STATUS_LEFT, but we remove all information about the server
 
+        self._forget_predictions()
+        forgotten = set(self.known_world)
         self.known_world = {}
+        self._notify_vision(forgotten)
 
         self.game_id = None
         self.player_id = None
         self.vision = None
+        self._new_connection()
 
         # FIXME later we won't raise this, maybe possibly change scenes?
         raise ServerDisconnect
@@ -961,6 +1309,18 @@ class ClientNetwork(object):
         for key, value in utility.grouper(2, packet.keyvalues):
             self.keyvalues[key] = value
 
+        if packet.score_deltas:
+            self.scoreboard.apply(packet.score_deltas)
+
+def _unpack_attribute(attribute):
+    unpacked = {}
+    for field, value in attribute.ListFields():
+        key = field.name
+        if key in constants.ATTRIBUTE_CONSTANT_KEYS:
+            value = constants.from_numerical_constant(value)
+        unpacked[key] = value
+    return unpacked
+
 class ClientException(Exception):
     pass
 
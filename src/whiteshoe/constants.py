@@ -50,6 +50,24 @@ class Constants(object):
     _constants_table = [c[1] for c in _constants]
     del _constants
 
+    _constants_index = dict((constant, number)
+                            for number, constant in enumerate(_constants_table))
+
+    # Object types are kept as their network numbers everywhere, so they
+    # never need translating, and are cheap to compare and hash.
+    OBJ_WALL = _constants_index[OBJ_WALL]
+    OBJ_HORIZONTAL_WALL = _constants_index[OBJ_HORIZONTAL_WALL]
+    OBJ_VERTICAL_WALL = _constants_index[OBJ_VERTICAL_WALL]
+    OBJ_CORNER_WALL = _constants_index[OBJ_CORNER_WALL]
+    OBJ_PLAYER = _constants_index[OBJ_PLAYER]
+    OBJ_EMPTY = _constants_index[OBJ_EMPTY]
+    OBJ_BULLET = _constants_index[OBJ_BULLET]
+    OBJ_EXPLOSION = _constants_index[OBJ_EXPLOSION]
+    OBJ_MINE = _constants_index[OBJ_MINE]
+    OBJ_SLIME = _constants_index[OBJ_SLIME]
+    OBJ_SLIME_BULLET = _constants_index[OBJ_SLIME_BULLET]
+    OBJ_LAVA = _constants_index[OBJ_LAVA]
+
     # Non-network constants after this point
 
     BANNER = """Whiteshoe {version}""".format(version='0.0.0')
@@ -77,6 +95,8 @@ class Constants(object):
     LAVA_DAMAGE = 1
 
     PACKET_SIZE_LIMIT = 600
+    # Seconds between updates of the server's stderr statistics line
+    STATS_DISPLAY_PERIOD = 1.0
     DEFAULT_PORT = 25008
     TIMEOUT = 30
 
@@ -100,6 +120,22 @@ class Constants(object):
     GAME_MESSAGE = 4
     KEYVALUE = 5
 
+    # For the metrics, and anything else that wants to show them
+    PAYLOAD_NAMES = {
+        GET_GAMES_LIST: 'get_games_list',
+        GAMES_LIST: 'games_list',
+        MAKE_NEW_GAME: 'make_new_game',
+        ERROR: 'error',
+        JOIN_GAME: 'join_game',
+        KEEP_ALIVE: 'keep_alive',
+        DISCONNECT: 'disconnect',
+        GAME_ACTION: 'game_action',
+        VISION_UPDATE: 'vision_update',
+        GAME_STATUS: 'game_status',
+        GAME_MESSAGE: 'game_message',
+        KEYVALUE: 'keyvalue',
+    }
+
     DISCONNECT_SHUTDOWN = 1
     DISCONNECT_KICKED = 2
     DISCONNECT_ERROR = 3
@@ -117,8 +153,46 @@ class Constants(object):
     STATUS_GAMEPAUSE = 8
     STATUS_GAMERESUME = 9
 
-    KEYVALUE_SCORES = "scores"
-    KEYVALUE_ENHANCED_SCORES = "scores+"
+    # The world is split into square regions of this many cells across,
+    # and players are kept informed of always visible objects in the
+    # regions up to INTEREST_RADIUS regions away from their own.
+    INTEREST_REGION_SIZE = 8
+    INTEREST_RADIUS = 2
+
+    # Score changes are sent at most this often, in seconds
+    SCORES_PERIOD = 0.25
+
+    # Game events kept for each player between ticks; the oldest are
+    # dropped first.
+    EVENT_QUEUE_LENGTH = 32
+
+    # On the server, each player's actions are carried out at most
+    # INPUT_BUDGET every INPUT_PERIOD seconds. Up to INPUT_QUEUE_LENGTH
+    # wait their turn, and any more are dropped.
+    INPUT_BUDGET = 2
+    INPUT_PERIOD = 0.05
+    INPUT_QUEUE_LENGTH = 8
+
+    # Over UDP, a packet that hasn't been acknowledged after RESEND_TIME
+    # seconds is taken to be lost. Acknowledgements are sent on their
+    # own if nothing else has carried them for ACK_DELAY seconds.
+    RESEND_TIME = 0.25
+    ACK_DELAY = 0.05
+    # How many packets before the latest are acknowledged by ack_bits
+    ACK_WINDOW = 32
+
+    # A predicted action that the server hasn't acknowledged after this
+    # many seconds is taken never to have happened
+    PREDICTION_TIMEOUT = 4 * RESEND_TIME
+
+    # How many vision updates are remembered for each player. A client
+    # that hasn't acknowledged any of them is sent everything it knows.
+    VISION_HISTORY = 64
+
+    # Over TCP, to a client that can take them, packets of at least
+    # COMPRESS_THRESHOLD bytes are sent zlib compressed
+    COMPRESS_THRESHOLD = 256
+    COMPRESS_LEVEL = 6
 
     DIRECTIONS = (UP, RIGHT, DOWN, LEFT)
 
@@ -139,19 +213,20 @@ class Constants(object):
         RIGHT: (UP, RIGHT, DOWN, NORTHEAST, SOUTHEAST),
     }
 
-    WALLS = (OBJ_WALL, OBJ_HORIZONTAL_WALL, OBJ_VERTICAL_WALL, OBJ_CORNER_WALL)
-    HISTORICAL_OBJECTS = WALLS + (OBJ_EMPTY,)
-    SOLID_OBJECTS = WALLS + (OBJ_PLAYER,)
+    WALLS = frozenset((OBJ_WALL, OBJ_HORIZONTAL_WALL, OBJ_VERTICAL_WALL,
+                       OBJ_CORNER_WALL))
+    HISTORICAL_OBJECTS = WALLS | frozenset((OBJ_EMPTY,))
+    SOLID_OBJECTS = WALLS | frozenset((OBJ_PLAYER,))
     AIRTIGHT_OBJECTS = WALLS
     OPAQUE_OBJECTS = WALLS
-    ALWAYS_VISIBLE_OBJECTS = (OBJ_EXPLOSION,OBJ_SLIME)
-    TEMPORARY_OBJECTS = (OBJ_EXPLOSION, OBJ_SLIME)
+    ALWAYS_VISIBLE_OBJECTS = frozenset((OBJ_EXPLOSION,OBJ_SLIME))
+    TEMPORARY_OBJECTS = frozenset((OBJ_EXPLOSION, OBJ_SLIME))
 
-    VISIBLE_OBJECTS = WALLS + (OBJ_EMPTY,OBJ_PLAYER,OBJ_EXPLOSION,OBJ_BULLET,
-                              OBJ_MINE)
-    BLOWABLE_UP = WALLS + (OBJ_PLAYER,OBJ_MINE,OBJ_SLIME)
-    CAN_STAB = (OBJ_PLAYER,)
-    SLIMEABLE = (OBJ_PLAYER, OBJ_MINE)
+    VISIBLE_OBJECTS = WALLS | frozenset((OBJ_EMPTY,OBJ_PLAYER,OBJ_EXPLOSION,
+                                         OBJ_BULLET,OBJ_MINE))
+    BLOWABLE_UP = WALLS | frozenset((OBJ_PLAYER,OBJ_MINE,OBJ_SLIME))
+    CAN_STAB = frozenset((OBJ_PLAYER,))
+    SLIMEABLE = frozenset((OBJ_PLAYER, OBJ_MINE))
 
     DISPLAY_CHAR = {
         OBJ_PLAYER: '@',
@@ -185,6 +260,8 @@ class Constants(object):
     EXPLOSION_LIFE = 0.5
     KEEPALIVE_TIME = 5
     STAB_DAMAGE = 2
+    # How often the client redraws cells that are animated, in seconds
+    ANIMATION_PERIOD = 0.1
 
     ORIGIN_UNKNOWN = -1
     ORIGIN_ENVIRONMENT = -2
@@ -195,7 +272,7 @@ class Constants(object):
 
     @classmethod
     def to_numerical_constant(cls,constant):
-        return cls._constants_table.index(constant)
+        return cls._constants_index[constant]
 
     @classmethod
     def from_numerical_constant(cls,number):
@@ -0,0 +1,57 @@
+import collections
+
+import constants
+
+# Events that the game sends to a particular player as GAME_STATUS
+# packets. When a player has several waiting at the end of a tick, one
+# is sent for each status: the latest, as the client only shows who did
+# it most recently.
+
+class Damaged(collections.namedtuple('Damaged', 'responsible damage_type')):
+    __slots__ = ()
+    status = constants.STATUS_DAMAGED
+    priority = 1
+
+class Death(collections.namedtuple('Death', 'responsible damage_type')):
+    __slots__ = ()
+    status = constants.STATUS_DEATH
+    priority = 2
+
+class EventBus(object):
+    def __init__(self, maxlen=constants.EVENT_QUEUE_LENGTH):
+        self.maxlen = maxlen
+        # player_id -> deque of events
+        self.queues = {}
+        self.dropped = 0
+
+    def __len__(self):
+        return sum(len(queue) for queue in self.queues.values())
+
+    def publish(self, player_id, event):
+        queue = self.queues.get(player_id)
+        if queue is None:
+            queue = self.queues[player_id] = collections.deque(
+                maxlen=self.maxlen)
+
+        if len(queue) == self.maxlen:
+            self.dropped += 1
+        queue.append(event)
+
+    def forget(self, player_id):
+        self.queues.pop(player_id, None)
+
+    def drain(self):
+        """Returns a list of (player_id, events), oldest event first, for
+        every player with events waiting, and empties their queues."""
+        drained = [(player_id, list(queue))
+                   for player_id, queue in self.queues.items() if queue]
+        self.queues.clear()
+        return drained
+
+def coalesce(events):
+    """Returns the latest of events with each status, lowest priority
+    first, so that the client handles the most important last."""
+    latest = {}
+    for event in events:
+        latest[event.status] = event
+    return sorted(latest.values(), key=lambda event: event.priority)
@@ -1,12 +1,20 @@
 import random
 import collections
 import json
+import zlib
 
 import utility
 import constants
 import packet_pb2
 import maps
+import events
+import scoreboard
+import interest
+import baselines
 import vision
+import profiling
+import objects
+import projectiles
 
 modes = {}
 
@@ -30,11 +38,26 @@ class BaseGame(object):
 
         self.max_players = max_players
 
+        self.map_generator = map_generator
         generator = self.MAP_GENERATORS[map_generator]
         self.world = generator(seed=self.random.random())
 
         #self.world = pretty_walls(self.world)
 
+        self.solidity = projectiles.SolidityGrid(self.world)
+        self.projectiles = {
+            constants.OBJ_BULLET: projectiles.ProjectileBatch(),
+            constants.OBJ_SLIME_BULLET: projectiles.ProjectileBatch(),
+        }
+
+        # Live explosions, and the cells that each one covers
+        self.explosions = []
+        self.explosion_cells = utility.SpatialHash()
+        self._new_explosions = []
+
+        # Slime colonies
+        self.slimes = []
+
         print("World ({0}) generated.".format(map_generator))
         self.name = name
 
@@ -47,14 +70,61 @@ class BaseGame(object):
 
         self.players = []
         self.player_attr = {}
+        # player_id -> action_sequence of their last action, for the
+        # players whose clients are predicting
+        self.action_sequences = {}
+        # Predicting players whose actions have been carried out since
+        # the last flush, who hear about it even if nothing has changed
+        self._acks_owed = set()
+
+        # If set, actions only mark what they change, and everything is
+        # sent at the next flush() or tick(), as the server does
+        self.defer_flush = False
+
+        # If set, actions wait in a queue for each player, and up to
+        # input_budget of each player's are carried out every INPUT_PERIOD
+        self.input_budget = None
+        self._inputs = collections.OrderedDict()
+        self._inputs_wait = 0.0
 
         self.known_worlds = {}
-        self.events = []
-        self.scores = collections.defaultdict(int)
-        self._update_scores = False
+        # The vision updates sent to each player, and the coords that
+        # each player has to be told to forget
+        self.vision_history = {}
+        self._forgotten = {}
+        # What each player could see at the last flush
+        self._last_visible = {}
+        self.interest = interest.InterestManager(self.world)
+
+        # player_id -> ((location, direction, opacity generation), coords)
+        self._vision_cache = {}
+        # Goes up whenever something opaque is destroyed
+        self._opacity_generation = 0
+        # If set, a visionpool.VisionPool that works out vision in other
+        # processes
+        self.vision_pool = None
+        # Only valid during a flush; player_id -> (location, player), and
+        # vision that game modes share between players
+        self._located_players = {}
+        self._shared_vision = {}
+        self.events = events.EventBus()
+        self.scores = scoreboard.Scoreboard()
+        # Seconds until score changes can next be sent, and who needs
+        # sending all of the scores
+        self._scores_wait = 0.0
+        self._full_scores = set()
 
         self.tick_stopwatch = utility.Stopwatch()
 
+        # If set, a replay.ReplayRecorder that is told about every input
+        self.recorder = None
+
+        # Replaced with a profiling.Profiler when the server is profiling
+        self.profiler = profiling.NullProfiler()
+
+        # Running totals of work done, for the server's metrics
+        self.stats = collections.Counter()
+
         # Dirty stuff
         self._dirty_coords = set()
         self._dirty_players = set()
@@ -83,8 +153,15 @@ class BaseGame(object):
 
         elif packet.payload_type == constants.GAME_ACTION:
             action, argument = packet.action, packet.argument
+            if packet.HasField('action_sequence'):
+                sequence = packet.action_sequence
+            else:
+                sequence = None
 
-            return self.player_action(player_id, action, argument)
+            if self.input_budget is not None:
+                self._queue_action(player_id, action, argument, sequence)
+                return []
+            return self.player_action(player_id, action, argument, sequence)
         elif packet.payload_type == constants.GAME_MESSAGE:
             #TODO implement game message
             return []
@@ -119,13 +196,8 @@ class BaseGame(object):
         start_max_hp = 10
         start_ammo = 10
 
-        new_player = (constants.OBJ_PLAYER,
-                      {'player_id':player_id,
-                       'direction': direction,
-                       'team':player_id,
-                       'hp':start_max_hp,
-                       'hp_max': start_max_hp,
-                       'ammo' : start_ammo})
+        new_player = objects.Player(player_id, direction, player_id,
+                                    start_max_hp, start_ammo)
 
         self.world[spawn_coord].append(new_player)
 
@@ -148,41 +220,37 @@ class BaseGame(object):
         else:
             delta = +1
 
-        self.scores[responsible] += delta
-        self._update_scores = True
+        self.scores.add(responsible, delta)
 
-        self.known_worlds[player_id] = {}
+        self._forget_known_world(player_id)
 
-        event_type = constants.STATUS_DEATH
-        event = (player_id, event_type, responsible, damage_type)
-        self.events.append(event)
+        self.events.publish(player_id, events.Death(responsible, damage_type))
 
         new_location, player = self._spawn_player(player_id)
 
-        old_attr = old_player[1]
-        new_attr = player[1]
-
-        for attribute in ('name','team'):
-            if attribute in old_attr:
-                new_attr[attribute] = old_attr[attribute]
+        player.name = old_player.name
+        player.team = old_player.team
 
     def player_join(self,player_id,name=None,team=None):
         assert player_id not in self.players
 
+        if self.recorder is not None:
+            self.recorder.record_join(player_id, name, team)
+
         self.players.append(player_id)
-        self.known_worlds[player_id] = {}
+        self._forget_known_world(player_id)
+        self.vision_history[player_id] = baselines.VisionHistory()
         self.player_attr[player_id] = {}
 
         location, player = self._spawn_player(player_id)
 
-        attr = player[1]
         if name is None or not name:
             name = "Unnamed"
         if team is None:
             team = 0
 
-        self.player_attr[player_id]['name'] = attr['name'] = name
-        self.player_attr[player_id]['team'] = attr['team'] = team
+        self.player_attr[player_id]['name'] = player.name = name
+        self.player_attr[player_id]['team'] = player.team = team
 
         join_packet = packet_pb2.Packet()
         join_packet.packet_id = utility.get_id('packet')
@@ -197,8 +265,6 @@ class BaseGame(object):
         join_packet.game_number_players = len(self.players)
         join_packet.game_vision = self.vision
 
-        direction = player[1]['direction']
-
         packets = [(player_id, join_packet)]
 
         # Inform the joined player of other players in the game
@@ -234,75 +300,84 @@ class BaseGame(object):
 
             packets.append((player_id, p2))
 
-        # There is a new entry on the score table, so set the update_scores
-        # flag.
-        self._update_scores = True
+        # The new player needs the whole score table.
+        self._full_scores.add(player_id)
 
         packets.extend(self._event_check())
         packets.extend(self._flush_dirty())
 
         return packets
 
-    def _update_known_world(self, player_id, visible, dirty):
+    def _update_known_world(self, player_id, visible, dirty, interesting=(),
+                            subscribed=(), unsubscribed=()):
+        # visible and dirty coords are checked for any changes.
+        # interesting coords are dirty coords in the player's area of
+        # interest, where always visible objects can be seen out of
+        # sight, and subscribed and unsubscribed are the regions that
+        # have just entered or left that area.
         known_world = self.known_worlds[player_id]
-
-        intersection_coords = visible & dirty
-
-        av_coords = self.find_obj_locations(*constants.ALWAYS_VISIBLE_OBJECTS)
+        last_visible = self._last_visible.get(player_id, frozenset())
+        self._last_visible[player_id] = visible
 
         changed = set()
 
-        # Intersection coords are in direct vision.
-        # so we don't historify them, we merely replace the contents
-        # of them
-
-        for coord in set(known_world) - visible:
-            assert coord in self.world
-
-            to_remove = []
-
-            for obj,attr in known_world[coord]:
-                if obj in constants.HISTORICAL_OBJECTS:
-                    marked_historical = attr.get('historical', False)
-
-                    if not marked_historical:
-                        attr['historical'] = True
-                        changed.add(coord)
-                else:
-                    to_remove.append((obj,attr))
-                    changed.add(coord)
-
-            for doomed in to_remove:
-                known_world[coord].remove(doomed)
-
-        for coord in intersection_coords:
-            assert coord in self.world
-
-            if known_world.get(coord) == self.world[coord]:
-                # No change.
-                continue
-            else:
-                known_world[coord] = new_contents = []
-                for obj,attr in self.world[coord]:
-                    new_contents.append((obj, attr.copy()))
+        # Coords in direct vision, so we don't historify them, we merely
+        # replace the contents of them. The known world holds snapshots,
+        # (type, attribute pairs) tuples, rather than the objects
+        # themselves.
+        for coord in (visible & dirty) | (visible - last_visible):
+            contents = [obj.snapshot() for obj in self.world[coord]]
+            if known_world.get(coord) != contents:
+                known_world[coord] = contents
                 changed.add(coord)
 
-        for coord in dirty | set(av_coords):
-            for obj,attr in self.world[coord]:
-                if obj in constants.ALWAYS_VISIBLE_OBJECTS:
-                    if coord not in known_world:
-                        known_world[coord] = []
-                    known_world[coord].append((obj,dict(attr)))
-                    changed.add(coord)
+        out_of_sight = set(last_visible - visible)
+        out_of_sight |= set(interesting)
+        out_of_sight |= self.interest.always_visible_cells(subscribed)
+        for coord in self.interest.cells(unsubscribed):
+            if coord in known_world:
+                out_of_sight.add(coord)
+        out_of_sight -= visible
+
+        for coord in out_of_sight:
+            remembered = []
+
+            for obj_type, attrs in known_world.get(coord, ()):
+                if obj_type in constants.HISTORICAL_OBJECTS:
+                    if _HISTORICAL not in attrs:
+                        attrs += (_HISTORICAL,)
+                    remembered.append((obj_type, attrs))
+
+            if self.interest.interested(player_id, coord):
+                for obj in self.world[coord]:
+                    if obj.type in constants.ALWAYS_VISIBLE_OBJECTS:
+                        remembered.append(obj.snapshot())
+
+            if known_world.get(coord, []) != remembered:
+                known_world[coord] = remembered
+                changed.add(coord)
 
         assert changed <= set(self.world)
 
         return changed
 
+    def _forget_known_world(self, player_id):
+        # The client is told to forget the cells in the next update,
+        # rather than being sent everything again
+        forgotten = self._forgotten.setdefault(player_id, set())
+        forgotten.update(self.known_worlds.get(player_id, ()))
+
+        self.known_worlds[player_id] = {}
+        self._last_visible.pop(player_id, None)
+        self._vision_cache.pop(player_id, None)
+        self.interest.unsubscribe(player_id)
 
     def player_leave(self, player_id):
         assert player_id in self.players
 
+        if self.recorder is not None:
+            self.recorder.record_leave(player_id)
+
         try:
             location, player = self._find_player(player_id)
         except PlayerNotFound:
@@ -310,17 +385,47 @@ class BaseGame(object):
         else:
             self._remove_player(player_id)
 
+        self._forget_known_world(player_id)
         del self.known_worlds[player_id]
+        del self.vision_history[player_id]
+        del self._forgotten[player_id]
         del self.player_attr[player_id]
+        self.events.forget(player_id)
+        self._full_scores.discard(player_id)
+        self.action_sequences.pop(player_id, None)
+        self._acks_owed.discard(player_id)
+        self._inputs.pop(player_id, None)
         self.players.remove(player_id)
+        self.scores.remove(player_id)
 
+        # Everyone still here forgets them, and their score
         packets = []
+        for other_id in self.players:
+            p = packet_pb2.Packet()
+            p.packet_id = utility.get_id('packet')
+            p.payload_type = constants.GAME_STATUS
+            p.game_id = self.id
+            p.status = constants.STATUS_LEFT
+            p.player_id = player_id
+            packets.append((other_id, p))
+
         packets.extend(self._event_check())
         packets.extend(self._flush_dirty())
         return packets
 
     def _determine_can_see(self, coord, player):
-        direction = player[1]['direction']
+        return self._player_vision(coord, player)
+
+    def _player_vision(self, coord, player):
+        # What a single player can see only changes when they move or
+        # turn, or when something opaque is destroyed, so it's kept
+        # between flushes.
+        direction = player.direction
+        key = (coord, direction, self._opacity_generation)
+
+        cached = self._vision_cache.get(player.player_id)
+        if cached is not None and cached[0] == key:
+            return cached[1]
 
         vision_func = self.VISION_FUNCTIONS[self.vision]
 
@@ -329,9 +434,57 @@ class BaseGame(object):
         #visible_world = _visible_world(self.world, coords)
         assert coords <= set(self.world)
 
+        coords = frozenset(coords)
+        self._vision_cache[player.player_id] = (key, coords)
         return coords
 
-    def _send_player_vision(self,player_id, coords, all=False):
+    def _pool_vision(self):
+        # Works out, all at once, the vision of every player that isn't
+        # already cached, so that _player_vision finds it there.
+        misses = []
+        for player_id, (location, player) in self._located_players.items():
+            key = (location, player.direction, self._opacity_generation)
+            cached = self._vision_cache.get(player_id)
+            if cached is None or cached[0] != key:
+                misses.append((player_id, key))
+
+        if len(misses) < 2:
+            # Not worth the round trip; _player_vision can do it here
+            return
+
+        requests = [key[:2] for player_id, key in misses]
+        results = self.vision_pool.compute(self.world, requests)
+
+        for (player_id, key), coords in zip(misses, results):
+            self._vision_cache[player_id] = (key, coords)
+
+    def _vision_update(self, player_id, changed, always=False):
+        """Sends the player the coords that have changed, along with any
+        that changed since the last update they've acknowledged."""
+        history = self.vision_history[player_id]
+        outstanding = history.outstanding()
+        baseline = history.baseline
+
+        if outstanding is None:
+            # Too far behind to know what they've missed
+            sequence = history.record(changed)
+            return self._send_player_vision(
+                player_id, list(self.known_worlds[player_id]), all=True,
+                sequence=sequence, baseline=0)
+
+        if not changed and not outstanding and not always:
+            return []
+
+        sequence = history.record(changed)
+        return self._send_player_vision(player_id, outstanding | set(changed),
+                                        sequence=sequence, baseline=baseline)
+
+    def vision_acked(self, player_id, sequence):
+        if player_id in self.vision_history:
+            self.vision_history[player_id].ack(sequence)
+
+    def _send_player_vision(self, player_id, coords, all=False,
+                            sequence=None, baseline=None):
         #location, player = self._find_player(player_id)
 
         known_world = self.known_worlds[player_id]
@@ -343,57 +496,77 @@ class BaseGame(object):
             packet.packet_id = utility.get_id('packet')
             packet.payload_type = constants.VISION_UPDATE
             packet.game_id = self.id
+            if player_id in self.action_sequences:
+                packet.acked_sequence = self.action_sequences[player_id]
+            if sequence is not None:
+                packet.vision_sequence = sequence
+                packet.vision_baseline = baseline
             return packet
 
         current_packet = gen_packet()
         if all:
             current_packet.clear_all = True
 
+        # Identical attributes in a packet are only sent once
+        attr_ids = {}
+
         for coord in coords:
             if current_packet.ByteSize() > constants.PACKET_SIZE_LIMIT:
                 packets.append(current_packet)
                 current_packet = gen_packet()
+                attr_ids = {}
 
             if coord not in self.world:
                 continue
+
             if coord not in known_world:
-                continue
+                x,y = coord
+                obj_type = -2
+                attr_id = -1
+                current_packet.objects.extend([x,y,obj_type,attr_id])
 
-            if known_world[coord] == []:
+            elif known_world[coord] == []:
                 x,y = coord
                 obj_type = -1
                 attr_id = -1
                 current_packet.objects.extend([x,y,obj_type,attr_id])
 
             else:
-                for object in known_world[coord]:
-                    x,y = coord
-                    obj_type, obj_attr = object
-                    obj_type = constants.to_numerical_constant(obj_type)
-                    if obj_attr == {}:
+                x,y = coord
+                for obj_type, attrs in known_world[coord]:
+                    if not attrs:
                         attr_id = -1
+                    elif attrs in attr_ids:
+                        attr_id = attr_ids[attrs]
                     else:
-                        packed = pack_attribute(obj_attr)
-                        attr_id = len(current_packet.attributes)
+                        packed = pack_attribute(attrs)
+                        attr_id = attr_ids[attrs] = len(current_packet.attributes)
                         current_packet.attributes.extend([packed])
 
                     current_packet.objects.extend([x,y,obj_type,attr_id])
 
         packets.append(current_packet)
 
-        #TODO For each packet, make sure that identical Attributes are
-        # compressed down to one, and the corresponding attr_ids are changed.
+        if sequence is not None:
+            for packet in packets:
+                packet.vision_parts = len(packets)
 
         out = [(player_id, packet) for packet in packets]
         return out
 
+    def resend_vision(self, player_id):
+        """For when vision updates have gone missing on the way to a
+        player: sends them everything since the last update they have."""
+        if player_id not in self.vision_history:
+            return []
+        return self._vision_update(player_id, ())
+
     def find_objs(self, *obj_types):
         locations = []
-        for coord, objects in self.world.items():
-            for obj, attr in objects:
-                if obj in obj_types:
-                    pair = (coord, (obj,attr))
-                    locations.append(pair)
+        for coord, cell in self.world.iteritems():
+            for obj in cell:
+                if obj.type in obj_types:
+                    locations.append((coord, obj))
 
         return locations
 
@@ -406,7 +579,7 @@ class BaseGame(object):
         location = None
 
         for coord, object in self.find_objs(constants.OBJ_PLAYER):
-            if object[1]['player_id'] == player_id:
+            if object.player_id == player_id:
                 location = coord
                 player = object
                 break
@@ -419,8 +592,13 @@ class BaseGame(object):
     def _player_death(self, player_id):
         location, player = self._find_player(player_id)
 
-    def player_action(self, player_id, action, argument):
+    def player_action(self, player_id, action, argument, sequence=None,
+                      flush=True):
         assert player_id in self.players
+
+        if self.recorder is not None:
+            self.recorder.record_action(player_id, action, argument)
+
         # Translate into internal constants
         cmd = constants.from_numerical_constant(action)
         arg = constants.from_numerical_constant(argument)
@@ -437,17 +615,71 @@ class BaseGame(object):
             constants.CMD_FIRE: self._fire,
         }
 
-        handlers[cmd](player, location, arg)
+        with self.profiler.phase('player_action'):
+            handlers[cmd](player, location, arg)
 
+        if sequence is not None:
+            self.action_sequences[player_id] = sequence
+            self._acks_owed.add(player_id)
+
+        if self.defer_flush or not flush:
+            return []
+        return self.flush()
+
+    def _queue_action(self, player_id, action, argument, sequence):
+        queue = self._inputs.setdefault(player_id, collections.deque())
+        if len(queue) >= constants.INPUT_QUEUE_LENGTH:
+            self.stats['inputs_dropped'] += 1
+            if sequence is not None:
+                # The last queued action acknowledges this one as well,
+                # so a predicting client stops showing it. Acknowledging
+                # a sequence acknowledges every action before it, so the
+                # highest is kept.
+                action, argument, last = queue[-1]
+                if last is None or sequence > last:
+                    queue[-1] = (action, argument, sequence)
+            return
+        queue.append((action, argument, sequence))
+
+    def _apply_inputs(self):
+        # Players take turns, one action at a time, so that nobody gets
+        # to do everything first. What they change is sent by the tick's
+        # flush.
+        for i in range(self.input_budget):
+            if not self._inputs:
+                break
+            for player_id, queue in self._inputs.items():
+                action, argument, sequence = queue.popleft()
+                if not queue:
+                    del self._inputs[player_id]
+                self.player_action(player_id, action, argument, sequence,
+                                   flush=False)
+
+    def flush(self):
+        """Sends the events and the vision changes since the last flush.
+        With defer_flush set, actions from any number of players within a
+        tick cost one vision update per player."""
         packets = []
-        packets.extend(self._event_check())
-        packets.extend(self._flush_dirty())
+        with self.profiler.phase('event_check'):
+            packets.extend(self._event_check())
+        with self.profiler.phase('flush_dirty'):
+            packets.extend(self._flush_dirty())
+
+        if self._acks_owed:
+            updated = set(pid for pid, packet in packets
+                          if packet.payload_type == constants.VISION_UPDATE)
+            for player_id in self._acks_owed - updated:
+                # Nothing they can see changed, but a predicting client
+                # still needs to hear that the action has been carried out
+                packets.extend(self._vision_update(player_id, (),
+                                                   always=True))
+            self._acks_owed.clear()
 
         return packets
 
     def _look(self, player, location, arg):
-        player[1]['direction'] = arg
-        player_id = player[1]['player_id']
+        player.direction = arg
+        player_id = player.player_id
         self._mark_dirty_cell(location)
         self._mark_dirty_player(player_id)
 
@@ -464,9 +696,9 @@ class BaseGame(object):
         if new_location not in self.world:
             can_move = False
         else:
-            for obj,attr in self.world[new_location]:
+            for obj in self.world[new_location]:
                 # If the area is empty
-                if obj in constants.SOLID_OBJECTS:
+                if obj.type in constants.SOLID_OBJECTS:
                     can_move = False
                     break
 
@@ -477,9 +709,9 @@ class BaseGame(object):
 
             if new_location in self.world:
                 # Special case stabbing things.
-                for object in self.world[new_location]:
-                    if object[0] in constants.CAN_STAB:
-                        responsible = player[1]['player_id']
+                for object in list(self.world[new_location]):
+                    if object.type in constants.CAN_STAB:
+                        responsible = player.player_id
                         self._damage_object(new_location, object,
                                             constants.STAB_DAMAGE,
                                             constants.DAMAGETYPE_STAB,
@@ -487,8 +719,7 @@ class BaseGame(object):
                         self._mark_dirty_cell(new_location)
 
         else:
-            player_id = player[1]['player_id']
-            direction = player[1]['direction']
+            player_id = player.player_id
 
             self.world[new_location].append(player)
 
@@ -499,27 +730,24 @@ class BaseGame(object):
             self._move_into(player, old_location, new_location)
 
     def _fire(self, player, location, arg):
-        direction = player[1]['direction']
-        player_id = player[1]['player_id']
+        direction = player.direction
+        player_id = player.player_id
 
         if arg in (constants.SMALL_SLIME, constants.BIG_SLIME):
             ammo_cost = constants.SLIME_COSTS[arg]
 
-            if player[1]['ammo'] >= ammo_cost:
-                player[1]['ammo'] -= ammo_cost
+            if player.ammo >= ammo_cost:
+                player.ammo -= ammo_cost
             else:
                 # Nothing fires
                 return []
 
-            attr = {'owner': player_id, 'direction': direction, 'size': arg}
-            bullet = (constants.OBJ_SLIME_BULLET, attr)
+            bullet = objects.SlimeBullet(player_id, direction, arg)
 
         else:
             power = arg
 
-            attr = player[1]
-
-            ammo = attr['ammo']
+            ammo = player.ammo
             ammo_cost = power**2
             # Find how much ammo the player can spend
             while ammo_cost > ammo:
@@ -530,15 +758,14 @@ class BaseGame(object):
                     return []
                 ammo_cost = power**2
 
-            attr['ammo'] -= ammo_cost
+            player.ammo -= ammo_cost
 
-            attr = {'owner': player_id, 'direction':direction, 'size':power}
-            bullet = (constants.OBJ_BULLET, attr)
+            bullet = objects.Bullet(player_id, direction, power)
 
-        diff = constants.DIFFS[direction]
         bullet_location = location
 
         self.world[bullet_location].append(bullet)
+        self.projectiles[bullet.type].add(bullet_location, bullet)
 
         self._mark_dirty_cell(bullet_location)
 
@@ -552,18 +779,16 @@ class BaseGame(object):
                 if other_diff == diff:
                     break
 
-        for object in self.world[new_location]:
-            obj, attr = object
-
-            if object == player:
+        for object in list(self.world[new_location]):
+            if object is player:
                 continue
-            elif obj == constants.OBJ_MINE:
+            elif object.type == constants.OBJ_MINE:
                 # If the direction of the movement is the same as the
                 # look direction of the player, then the mine will most likely
                 # not explode.
-                player_diff = constants.DIFFS[player[1]['direction']]
+                player_diff = constants.DIFFS[player.direction]
 
-                if direction == player[1]['direction']:
+                if direction == player.direction:
                     chance = constants.MINE_DIRECT_PROBABILITY
 
                 # Backwards is the biggest chance.
@@ -574,7 +799,7 @@ class BaseGame(object):
                 else:
                     chance = constants.MINE_SIDE_PROBABILITY
 
-                size = attr['size']
+                size = object.size
                 self.world[new_location].remove(object)
 
                 # The chance is chance of NO EXPLOSION
@@ -587,13 +812,14 @@ class BaseGame(object):
                     else:
                         ammo_increase = 0
 
-                    player[1]['ammo'] += ammo_increase
+                    player.ammo += ammo_increase
                 else:
-                    responsible = player[1]['player_id']
+                    responsible = player.player_id
                     self._make_explosion(new_location, size, responsible)
 
     def _mark_dirty_cell(self, coord):
         self._dirty_coords.add(coord)
+        self.solidity.mark(coord)
 
     def _mark_dirty_player(self, player_id):
         self._dirty_players.add(player_id)
@@ -605,38 +831,68 @@ class BaseGame(object):
             # If nothing is marked dirty, then nothing has changed.
             return packets
 
+        dirty = self._dirty_coords
+
+        # Changes to cells out of sight only matter to players who have
+        # those cells in their area of interest
+        self.interest.update_cells(self.world, dirty)
+        routed = self.interest.route(dirty)
+
+        # Every player is found in one pass over the world, rather than
+        # a pass each
+        self._located_players = dict(
+            (obj.player_id, (coord, obj))
+            for coord, obj in self.find_objs(constants.OBJ_PLAYER))
+        self._shared_vision = {}
+
+        if self.vision_pool is not None:
+            with self.profiler.phase('vision_pool'):
+                self._pool_vision()
+
         # Return a number of packet tuples, in the form
         # (player_id, packet) generally vision packets, informing the player
         # of what has changed.
         for player_id in self.players:
-            try:
-                location, playerobj = self._find_player(player_id)
-            except PlayerNotFound:
+            if player_id not in self._located_players:
                 # If player isn't present in the map, then we don't have
                 # to worry about vision for them
                 continue
+            location, playerobj = self._located_players[player_id]
 
-            direction = playerobj[1]['direction']
-
-            visible = self._determine_can_see(location, playerobj)
+            with self.profiler.phase('vision'):
+                visible = self._determine_can_see(location, playerobj)
+            self.stats['vision_cells'] += len(visible)
             # So we have the list of coordinates that are in direct vision
 
-            dirty = self._dirty_coords
+            subscribed, unsubscribed = self.interest.subscribe(player_id,
+                                                               location)
+            interesting = routed.get(player_id, ())
 
             changed = ()
 
             always_dirty = 'AlwaysDirtyPlayers' in self.options
 
-            if always_dirty or player_id in self._dirty_players:
-                # yes, for now, if a player is marked dirty, then we
-                # just send his whole known world
-                changed = self._update_known_world(player_id, visible, visible)
+            with self.profiler.phase('update_known_world'):
+                if always_dirty or player_id in self._dirty_players:
+                    # yes, for now, if a player is marked dirty, then we
+                    # just send his whole known world
+                    changed = self._update_known_world(
+                        player_id, visible, visible, interesting,
+                        subscribed, unsubscribed)
 
-            else:
-                changed = self._update_known_world(player_id, visible, dirty)
+                else:
+                    changed = self._update_known_world(
+                        player_id, visible, dirty, interesting,
+                        subscribed, unsubscribed)
+
+            forgotten = self._forgotten[player_id]
+            if forgotten:
+                changed = set(changed) | forgotten
+                forgotten.clear()
 
             if changed:
-                p = self._send_player_vision(player_id, changed)
+                with self.profiler.phase('send_player_vision'):
+                    p = self._vision_update(player_id, changed)
                 packets.extend(p)
 
         self._dirty_players.clear()
@@ -646,393 +902,390 @@ class BaseGame(object):
 
     def _event_check(self):
         packets = []
-        p = None
 
-        while self.events:
-            event = self.events.pop()
-            player_id = event[0]
+        for player_id, queued in self.events.drain():
+            if player_id not in self.players:
+                continue
 
-            if p is None:
+            # At most one packet per status per player per tick
+            for event in events.coalesce(queued):
                 p = packet_pb2.Packet()
                 p.packet_id = utility.get_id('packet')
                 p.payload_type = constants.GAME_STATUS
                 p.game_id = self.id
 
-            if event[1] in {constants.STATUS_DAMAGED, constants.STATUS_DEATH}:
-                p.status = event[1]
-
-                p.responsible_id = event[2]
-                p.damage_type = event[3]
+                p.status = event.status
+                p.responsible_id = event.responsible
+                p.damage_type = event.damage_type
 
                 packets.append((player_id, p))
-                p = None
-
-        if self._update_scores:
-            # clear the update scores flag
-            self._update_scores = False
 
-            p = packet_pb2.Packet()
-            p.packet_id = utility.get_id('packet')
-            p.game_id = self.id
-            p.payload_type = constants.KEYVALUE
+        # Score changes are held back until SCORES_PERIOD has passed
+        # since the last lot, then all go out in one packet.
+        if self.scores.changed and self._scores_wait <= 0:
+            self._scores_wait = constants.SCORES_PERIOD
 
-            p.keyvalues.append(constants.KEYVALUE_SCORES)
-
-            scores_text = json.dumps(dict(self.scores))
-            p.keyvalues.append(scores_text)
+            p = self._scores_packet(self.scores.pop_changes())
+            for player_id in self.players:
+                if player_id not in self._full_scores:
+                    packets.append((player_id, p))
 
-            scores_with_names = {}
-            for key in self.scores:
-                name = self.player_attr[key]['name']
-                scores_with_names[name] = self.scores[key]
+        if self._full_scores:
+            # Players who have just joined get the whole scoreboard
+            p = self._scores_packet(sorted(self.scores.items()))
+            for player_id in self._full_scores:
+                packets.append((player_id, p))
+            self._full_scores.clear()
 
-            scores_with_names_text = json.dumps(scores_with_names)
+        return packets
 
-            p.keyvalues.append(constants.KEYVALUE_ENHANCED_SCORES)
-            p.keyvalues.append(scores_with_names_text)
+    def _scores_packet(self, scores):
+        p = packet_pb2.Packet()
+        p.packet_id = utility.get_id('packet')
+        p.game_id = self.id
+        p.payload_type = constants.KEYVALUE
 
-            for player_id in self.players:
-                packets.append((player_id, p))
+        for player_id, score in scores:
+            p.score_deltas.extend((player_id, score))
 
-        return packets
+        return p
 
-    def tick(self):
+    def tick(self, time_diff_s=None):
         # Do anything that occurs independently of network input
         # like bullets moving
-        if not self.tick_stopwatch.running:
-            # Can't do anything on a tick until we know how much time
-            # has passed
-            self.tick_stopwatch.start()
-            return ()
-
-        elapsed = self.tick_stopwatch.restart()
-        time_diff_s = elapsed.total_seconds()
-
-        self._tick_bullets(time_diff_s)
-        self._tick_explosions(time_diff_s)
-        self._tick_slimes(time_diff_s)
-        self._tick_lava(time_diff_s)
+        # time_diff_s is only given when replaying, otherwise it's
+        # measured.
+        if time_diff_s is None:
+            if not self.tick_stopwatch.running:
+                # Can't do anything on a tick until we know how much time
+                # has passed
+                self.tick_stopwatch.start()
+                return ()
+
+            elapsed = self.tick_stopwatch.restart()
+            time_diff_s = elapsed.total_seconds()
+
+        profiler = self.profiler
+
+        # Queued actions are recorded before the tick, so a replay
+        # carries them out in the same order. The server ticks every
+        # time round its loop, so the budget goes by game time instead.
+        self._inputs_wait -= time_diff_s
+        if self._inputs and self._inputs_wait <= 0:
+            self._inputs_wait = constants.INPUT_PERIOD
+            with profiler.phase('apply_inputs'):
+                self._apply_inputs()
+
+        if self.recorder is not None:
+            self.recorder.record_tick(time_diff_s)
+
+        self._scores_wait -= time_diff_s
+
+        with profiler.phase('tick_bullets'):
+            self._tick_bullets(time_diff_s)
+        with profiler.phase('tick_explosions'):
+            self._tick_explosions(time_diff_s)
+        with profiler.phase('tick_slimes'):
+            self._tick_slimes(time_diff_s)
+        with profiler.phase('tick_lava'):
+            self._tick_lava(time_diff_s)
+
+        packets = self.flush()
+
+        if self.recorder is not None:
+            self.recorder.tick_done(self)
 
-        packets = []
-        packets.extend(self._event_check())
-        packets.extend(self._flush_dirty())
         return packets
 
-    def _tick_bullets(self, time_passed):
-        # Pair of (coord, object)
-        bullets = self.find_objs(constants.OBJ_BULLET)
-        for coord,object in bullets:
-            attr = object[1]
-            size = attr['size']
-            speed = constants.BULLET_SPEEDS[size]
-
-            if '_time_remaining' not in attr:
-                attr['_time_remaining'] = speed
-
-            attr['_time_remaining'] -= time_passed
-
-            exploded = False
-            while attr['_time_remaining'] < 0 and not exploded:
-                attr['_time_remaining'] += speed
-
-
-                self.world[coord].remove(object)
-                self._mark_dirty_cell(coord)
-
-                loc_diff = constants.DIFFS[object[1]['direction']]
-
-                new_coord = (coord[0] + loc_diff[0], coord[1] + loc_diff[1])
+    def state_digest(self):
+        # A checksum of everything in the world, for checking that a
+        # replay is doing the same thing as the original game.
+        crc = 0
+        for coord in sorted(self.world):
+            for obj in self.world[coord]:
+                crc = zlib.crc32(json.dumps((coord, obj.snapshot())), crc)
+        return crc & 0xffffffff
 
-                if new_coord not in self.world:
-                    # Bullet just disappears.
-                    break
+    def _tick_bullets(self, time_passed):
+        bullets = self.projectiles[constants.OBJ_BULLET]
+        if not bullets:
+            return
 
-                any_solid = any(o[0] in constants.SOLID_OBJECTS
-                                for o in self.world[new_coord])
+        self.solidity.refresh(self.world)
 
-                if any_solid:
-                    self._make_explosion(new_coord, size, attr['owner'])
-                    exploded = True
+        for bullet, start, end, hit in bullets.advance(time_passed,
+                                                       self.solidity):
+            self.world[start].remove(bullet)
+            self._mark_dirty_cell(start)
 
-                if exploded:
-                    break
-                else:
-                    # Bullet keeps moving
-                    self.world[new_coord].append(object)
-                    self._mark_dirty_cell(new_coord)
-                    coord = new_coord
-                    # Then the while loop may continue
+            if hit is not None:
+                self._make_explosion(hit, bullet.size, bullet.owner)
+            elif end is not None:
+                # Bullet keeps moving
+                self.world[end].append(bullet)
+                self._mark_dirty_cell(end)
 
     def _make_explosion(self, coord, size, responsible=None):
         if responsible is None:
             responsible = constants.ORIGIN_UNKNOWN
 
-        for ex_coord in utility.neighbourhood(coord,n=size-1):
-            if ex_coord not in self.world:
-                continue
+        cells = [ex_coord for ex_coord in utility.neighbourhood(coord,n=size-1)
+                 if ex_coord in self.world]
 
-            explosion = (constants.OBJ_EXPLOSION,
-                         {'_damage':size**2, '_responsible':responsible})
+        explosion = objects.Explosion(size**2, responsible, cells)
 
+        for ex_coord in cells:
             self.world[ex_coord].append(explosion)
             self._mark_dirty_cell(ex_coord)
 
+        # Only resolved on the next explosion tick, so chain reactions
+        # go off one tick at a time
+        self._new_explosions.append(explosion)
 
     def _tick_explosions(self, time_passed):
-        explosions = self.find_objs(constants.OBJ_EXPLOSION)
-        for coord,explosion in explosions:
-            attr = explosion[1]
-            if '_time_left' not in attr:
-                attr['_time_left'] = constants.EXPLOSION_LIFE
-            if '_damaged' not in attr:
-                attr['_damaged'] = []
-
-            for object in list(self.world[coord]):
-                if object[0] in constants.BLOWABLE_UP:
-                    if object in attr['_damaged']:
-                        continue
-                    else:
-                        attr['_damaged'].append(object)
-
-                    self._damage_object(coord, object, attr['_damage'],
-                                        constants.DAMAGETYPE_EXPLOSION,
-                                        attr['_responsible'])
-                    self._mark_dirty_cell(coord)
-
-
-            attr['_time_left'] -= time_passed
-            if attr['_time_left'] < 0:
-                self.world[coord].remove(explosion)
-                self._mark_dirty_cell(coord)
-
-    def _tick_slimes(self, time_passed):
-        slime_bullets = self.find_objs(constants.OBJ_SLIME_BULLET)
-
-        for coord, bullet in slime_bullets:
-            # Horrible reuse of explosion bullet code here,
-            # TODO will need to see if we can combine it into some sort
-            # of function
-            attr = bullet[1]
-            size = attr['size']
-            speed = constants.SLIME_BULLET_SPEED[size]
-
-            if '_time_remaining' not in attr:
-                attr['_time_remaining'] = speed
-
-            attr['_time_remaining'] -= time_passed
+        for explosion in self._new_explosions:
+            self.explosion_cells.add(explosion, explosion.cells)
+            self.explosions.append(explosion)
+        self._new_explosions = []
 
-            explode = False
-            while attr['_time_remaining'] < 0 and not explode:
-                attr['_time_remaining'] += speed
+        if not self.explosions:
+            return
 
+        dirty = set()
 
-                self.world[coord].remove(bullet)
-                old_coord = coord
-                self._mark_dirty_cell(coord)
+        for coord, covering in self.explosion_cells.items():
+            for object in list(self.world[coord]):
+                if object.type not in constants.BLOWABLE_UP:
+                    continue
 
-                loc_diff = constants.DIFFS[bullet[1]['direction']]
+                for explosion in covering:
+                    if object.type == constants.OBJ_PLAYER:
+                        # Players are hurt once by each explosion. Anything
+                        # else is destroyed cell by cell, including a slime
+                        # colony, which is the same object in every cell.
+                        if object in explosion.damaged:
+                            continue
+                        explosion.damaged.add(object)
 
-                new_coord = (coord[0] + loc_diff[0], coord[1] + loc_diff[1])
+                    self._damage_object(coord, object, explosion.damage,
+                                        constants.DAMAGETYPE_EXPLOSION,
+                                        explosion.responsible)
+                    dirty.add(coord)
+
+                    if object not in self.world[coord]:
+                        # Destroyed, or killed and respawned elsewhere
+                        break
+
+        remaining = []
+        for explosion in self.explosions:
+            explosion.time_left -= time_passed
+            if explosion.time_left >= 0:
+                remaining.append(explosion)
+                continue
 
-                if new_coord not in self.world:
-                    # Bullet just disappears.
-                    break
+            self.explosion_cells.remove(explosion, explosion.cells)
+            for coord in explosion.cells:
+                self.world[coord].remove(explosion)
+                dirty.add(coord)
+        self.explosions = remaining
 
-                any_solid = any(o[0] in constants.SOLID_OBJECTS
-                                for o in self.world[new_coord])
+        for coord in dirty:
+            self._mark_dirty_cell(coord)
 
-                if any_solid:
-                    explode = True
+    def _tick_slimes(self, time_passed):
+        slime_bullets = self.projectiles[constants.OBJ_SLIME_BULLET]
+        if slime_bullets:
+            self.solidity.refresh(self.world)
+
+            for bullet, start, end, hit in slime_bullets.advance(
+                    time_passed, self.solidity):
+                self.world[start].remove(bullet)
+                self._mark_dirty_cell(start)
+
+                if hit is not None:
+                    # A new slime is born, just short of what the bullet
+                    # hit
+                    colony = objects.Slime(bullet.owner, bullet.size)
+                    self._occupy_with_slime(colony, end)
+                    self.slimes.append(colony)
+                    self._mark_dirty_cell(end)
+                elif end is not None:
+                    self.world[end].append(bullet)
+                    self._mark_dirty_cell(end)
+
+        dirty = set()
+        remaining = []
+
+        for colony in self.slimes:
+            if not colony.cells:
+                # Every part of it has been blown up
+                continue
 
-                if explode:
-                    # The bullet has been removed by this point
-                    break
-                else:
-                    # Bullet keeps moving
-                    self.world[new_coord].append(bullet)
-                    self._mark_dirty_cell(new_coord)
-                    old_coord = coord
-                    coord = new_coord
-                    assert old_coord != new_coord
-                    # Then the while loop may continue
-            if explode:
-                slime_coord = old_coord
-                # A new slime is born
-                attr = {}
-                attr['owner'] = bullet[1]['owner']
-                attr['size'] = bullet[1]['size']
-                attr['_spread_to'] = set([slime_coord])
-                attr['_damaged'] = []
-
-                slime = (constants.OBJ_SLIME, attr)
-                self.world[slime_coord].append(slime)
-                self._mark_dirty_cell(slime_coord)
-        # end for
-
-        for coord, slime in self.find_objs(constants.OBJ_SLIME):
-            for obj in self.world[coord]:
-                if obj == slime:
-                    continue
-                elif obj[0] in constants.SLIMEABLE:
-                    if obj in slime[1]['_damaged']:
+            for coord in list(colony.cells):
+                for obj in list(self.world[coord]):
+                    if obj.type not in constants.SLIMEABLE:
                         continue
-                    else:
-                        slime[1]['_damaged'].append(obj)
-
-                    responsible = slime[1]['owner']
+                    if obj in colony.damaged:
+                        continue
+                    colony.damaged.add(obj)
 
                     self._damage_object(coord, obj, constants.SLIME_DAMAGE,
                                         constants.DAMAGETYPE_SLIME,
-                                        responsible)
-                    self._mark_dirty_cell(coord)
-
-            attr = slime[1]
-            if '_death_time' in attr:
-                attr['_death_time'] -= time_passed
-                if attr['_death_time'] < 0:
-                    self.world[coord].remove(slime)
-                    self._mark_dirty_cell(coord)
+                                        colony.owner)
+                    dirty.add(coord)
+
+            if colony.death_time is not None:
+                colony.death_time -= time_passed
+                if colony.death_time < 0:
+                    for coord in colony.cells:
+                        self.world[coord].remove(colony)
+                        dirty.add(coord)
                     continue
 
-            if '_spread_time' not in attr:
-                attr['_spread_time'] = constants.SLIME_SPREAD_TIME
-
-            attr['_spread_time'] -= time_passed
-            while attr['_spread_time'] < 0:
-                attr['_spread_time'] += constants.SLIME_SPREAD_TIME
-                neighbourhood = utility.cardinal_neighbourhood(coord)
-                possible_locations = set(neighbourhood) - attr['_spread_to']
-                possible_locations &= set(self.world)
-
-                slime_spread = constants.SLIME_SPREAD[attr['size']]
-                spreads_remaining = slime_spread - len(attr['_spread_to'])
+            colony.spread_time -= time_passed
+            while colony.spread_time < 0 and colony.death_time is None:
+                colony.spread_time += constants.SLIME_SPREAD_TIME
+                self._spread_slime(colony, dirty)
 
-                if spreads_remaining == 0:
-                    attr['_death_time'] = constants.SLIME_SPREAD_TIME
-                    break
-
-                assert spreads_remaining >= 0
-
-                # Slime can only spread to non-solid locations
-                for location in list(possible_locations):
-                    if any(obj[0] in constants.AIRTIGHT_OBJECTS
-                           for obj in self.world[location]):
-                        possible_locations.remove(location)
+            remaining.append(colony)
 
-                if possible_locations and spreads_remaining:
-                    spread_coord = self.random.choice(list(possible_locations))
-                    attr['_spread_to'].add(spread_coord)
-                    self._mark_dirty_cell(spread_coord)
+        self.slimes = remaining
 
-                    new_attr = {}
-                    new_attr['owner'] = slime[1]['owner']
-                    new_attr['size'] = slime[1]['size']
-                    new_attr['_spread_to'] = slime[1]['_spread_to']
-                    new_attr['_damaged'] = slime[1]['_damaged']
+        for coord in dirty:
+            self._mark_dirty_cell(coord)
 
-                    slime = (constants.OBJ_SLIME, new_attr)
-                    self.world[spread_coord].append(slime)
+    def _spread_slime(self, colony, dirty):
+        # Each occupied cell spreads to one more, until the budget runs
+        # out. Slime can only spread to non-solid locations.
+        possible_locations = [location for location in colony.frontier
+                              if not any(obj.type in constants.AIRTIGHT_OBJECTS
+                                         for obj in self.world[location])]
+
+        budget = colony.budget
+        if not budget or not possible_locations:
+            colony.death_time = constants.SLIME_SPREAD_TIME
+            return
+
+        count = min(len(colony.cells), budget, len(possible_locations))
+        for spread_coord in self.random.sample(possible_locations, count):
+            self._occupy_with_slime(colony, spread_coord)
+            dirty.add(spread_coord)
+
+    def _occupy_with_slime(self, colony, coord):
+        self.world[coord].append(colony)
+        colony.cells.add(coord)
+        colony.spread_to.add(coord)
+        colony.frontier.discard(coord)
+
+        for neighbour in utility.cardinal_neighbourhood(coord):
+            if neighbour in self.world and neighbour not in colony.spread_to:
+                colony.frontier.add(neighbour)
 
     def _tick_lava(self, time_passed):
         for coord, lava in self.find_objs(constants.OBJ_LAVA):
             # Lava damages people in a pool on regular intervals
             # Getting syncronised lava damaging is difficult, so we'll just
             # do it every LAVA_TIME seconds
-            attr = lava[1]
-
-            if '_time_passed' not in attr:
-                attr['_time_passed'] = 0
+            lava.time_passed += time_passed
 
-            attr['_time_passed'] += time_passed
-
-            times = attr['_time_passed'] // constants.LAVA_TIME
+            times = lava.time_passed // constants.LAVA_TIME
 
             if times:
-                attr['_time_passed'] %= constants.LAVA_TIME
-                for other in self.world[coord]:
-                    if other == lava:
+                lava.time_passed %= constants.LAVA_TIME
+                for other in list(self.world[coord]):
+                    if other is lava:
                         continue
                     else:
                         damage = constants.LAVA_DAMAGE * times
-                        damage_type = constants.DAMAGE_LAVA
+                        damage_type = constants.DAMAGETYPE_LAVA
                         responsible = constants.ORIGIN_ENVIRONMENT
                         self._damage_object(coord, other, damage, damage_type,
                                             responsible)
 
-            if attr['_spreading']:
+            if lava.spreading:
                 pass #LAVA SPREADS, EVERYONE DIES
 
     def _damage_object(self, coord, object, amount, damage_type=None,
                        responsible=None):
 
         if damage_type is None:
-            damage_type = constants.DAMAGE_UNKNOWN
+            damage_type = constants.DAMAGETYPE_UNKNOWN
 
         if responsible is None:
             responsible = constants.ORIGIN_UNKNOWN
 
-        is_player = object[0] == constants.OBJ_PLAYER
-
-        hp = object[1].get('hp', 0)
-        hp -= amount
+        is_player = object.type == constants.OBJ_PLAYER
 
-        object[1]['hp'] = hp
+        if is_player:
+            object.hp -= amount
+            hp = object.hp
+        else:
+            # Anything else is destroyed by any damage at all
+            hp = 0
 
         if hp <= 0:
             if is_player:
-                player_id = object[1]['player_id']
-                self._kill_player(player_id, responsible, damage_type)
+                self._kill_player(object.player_id, responsible, damage_type)
             else:
                 self.world[coord].remove(object)
                 self._mark_dirty_cell(coord)
 
-            if object[0] == constants.OBJ_MINE:
+                if object.type in constants.OPAQUE_OBJECTS:
+                    self._opacity_generation += 1
+                    if self.vision_pool is not None:
+                        self.vision_pool.mark(coord)
+
+                batch = self.projectiles.get(object.type)
+                if batch is not None:
+                    batch.discard(object)
+
+                if object.type == constants.OBJ_EXPLOSION:
+                    # Only gone from this one cell
+                    object.cells.discard(coord)
+                    self.explosion_cells.remove(object, (coord,))
+                elif object.type == constants.OBJ_SLIME:
+                    object.cells.discard(coord)
+
+            if object.type == constants.OBJ_MINE:
                 # Mines explode when they're destroyed
-                self._make_explosion(coord, object[1]['size'], responsible)
+                self._make_explosion(coord, object.size, responsible)
 
         elif is_player:
-            player_id = object[1]['player_id']
-            event_type = constants.STATUS_DAMAGED
-            event = (player_id, event_type, responsible, damage_type)
-            self.events.append(event)
+            event = events.Damaged(responsible, damage_type)
+            self.events.publish(object.player_id, event)
 
         # Finally
         non_temporary = [o for o in self.world[coord]
-                         if o[0] not in constants.TEMPORARY_OBJECTS]
+                         if o.type not in constants.TEMPORARY_OBJECTS]
 
         if not non_temporary:
             # If we've destroyed everything else,
             # insert a new EMPTY into the world
-            empty = (constants.OBJ_EMPTY, {})
+            empty = objects.GameObject(constants.OBJ_EMPTY)
             self.world[coord].insert(0,empty)
             self._mark_dirty_cell(coord)
 
+# Marks an object in a known world as remembered rather than seen.
+_HISTORICAL = ('historical', True)
+
 def network_pack_object(coord, object):
     x,y = coord
-    obj_type, obj_attr = object
-    obj_type = constants.to_numerical_constant(obj_type)
+    obj_type, attrs = object.snapshot()
 
-    if obj_attr == {}:
+    if not attrs:
         attribute = None
     else:
-        attribute = packet_pb2.Packet.Attribute()
-        for key in constants.ATTRIBUTE_KEYS:
-            if key in obj_attr:
-                value = obj_attr[key]
-                if key in constants.ATTRIBUTE_CONSTANT_KEYS:
-                    value = constants.to_numerical_constant(value)
-                setattr(attribute, key, value)
+        attribute = pack_attribute(attrs)
 
     return x,y,obj_type,attribute
 
-def pack_attribute(obj_attr):
+def pack_attribute(attrs):
+    # attrs is a tuple of (key, value) pairs, see objects.GameObject
     attribute = packet_pb2.Packet.Attribute()
-    for key in constants.ATTRIBUTE_KEYS:
-        if key in obj_attr:
-            value = obj_attr[key]
-            if key in constants.ATTRIBUTE_CONSTANT_KEYS:
-                value = constants.to_numerical_constant(value)
-            setattr(attribute, key, value)
+    for key, value in attrs:
+        if key in constants.ATTRIBUTE_CONSTANT_KEYS:
+            value = constants.to_numerical_constant(value)
+        setattr(attribute, key, value)
     return attribute
 
 @gamemode
@@ -1052,7 +1305,7 @@ class FreeForAllGame(BaseGame):
             mine_coord = self.random.choice(list(suitable))
             suitable.remove(mine_coord)
 
-            mine = (constants.OBJ_MINE, {'size': mine_size})
+            mine = objects.Mine(mine_size)
 
             self.world[mine_coord].append(mine)
             self._mark_dirty_cell(mine_coord)
@@ -1060,7 +1313,7 @@ class FreeForAllGame(BaseGame):
         # And increase all ammo for all players by 5
         # including the new player
         for coord, player in self.find_objs(constants.OBJ_PLAYER):
-            player[1]['ammo'] += 5
+            player.ammo += 5
             self._mark_dirty_cell(coord)
 
         return coord, new_player
@@ -1068,23 +1321,21 @@ class FreeForAllGame(BaseGame):
 @gamemode
 class TeamGame(BaseGame):
     mode = "teambase"
-    def _determine_can_see(self, coord, player):
-        can_see_func = super(TeamGame, self)._determine_can_see
 
-        coords = can_see_func(coord, player)
-
-        team = player[1]['team']
+    def _determine_can_see(self, coord, player):
+        # In a team game, you share vision with your teammates. The whole
+        # team sees the same thing, so it's only worked out once per team
+        # per flush, from each member's own (cached) vision.
+        team = player.team
+
+        coords = self._shared_vision.get(team)
+        if coords is None:
+            coords = set()
+            for location, member in self._located_players.values():
+                if member.team == team:
+                    coords |= self._player_vision(location, member)
+            coords = self._shared_vision[team] = frozenset(coords)
 
-        # In a team game, you share vision with your teammates
-        for player_id in self.players:
-            if player_id == player[1]['player_id']:
-                continue
-            try:
-                location, other_player = self._find_player(player_id)
-            except PlayerNotFound:
-                continue
-            else:
-                coords |= can_see_func(location, other_player)
         return coords
 
 class GameException(Exception):
@@ -0,0 +1,102 @@
+import collections
+
+import constants
+
+class InterestManager(object):
+    """Splits the world into square regions, and subscribes each player
+    to the regions around them: their area of interest. Changes to cells
+    are only routed to the subscribers of the cell's region.
+
+    It also keeps track of which cells have always visible objects in
+    them, so a player can be told about those when a region is added to
+    their area of interest."""
+    def __init__(self, world, region_size=constants.INTEREST_REGION_SIZE,
+                 radius=constants.INTEREST_RADIUS):
+        self.region_size = region_size
+        self.radius = radius
+
+        # region -> coords
+        self.regions = collections.defaultdict(set)
+        for coord in world:
+            self.regions[self.region(coord)].add(coord)
+
+        # player_id -> (centre region, set of regions)
+        self.subscriptions = {}
+        # region -> player_ids
+        self.subscribers = collections.defaultdict(set)
+
+        # region -> coords with always visible objects in them
+        self.always_visible = collections.defaultdict(set)
+        self.update_cells(world, world)
+
+    def region(self, coord):
+        return coord[0] // self.region_size, coord[1] // self.region_size
+
+    def subscribe(self, player_id, coord):
+        """Moves the player's area of interest to be around coord.
+        Returns (regions added, regions removed)."""
+        centre = self.region(coord)
+
+        old_centre, old_regions = self.subscriptions.get(player_id,
+                                                         (None, set()))
+        if centre == old_centre:
+            return (), ()
+
+        regions = set()
+        radius = self.radius
+        for dx in range(-radius, radius + 1):
+            for dy in range(-radius, radius + 1):
+                region = centre[0] + dx, centre[1] + dy
+                if region in self.regions:
+                    regions.add(region)
+
+        added = regions - old_regions
+        removed = old_regions - regions
+
+        for region in added:
+            self.subscribers[region].add(player_id)
+        for region in removed:
+            self.subscribers[region].discard(player_id)
+
+        self.subscriptions[player_id] = centre, regions
+        return added, removed
+
+    def unsubscribe(self, player_id):
+        centre, regions = self.subscriptions.pop(player_id, (None, ()))
+        for region in regions:
+            self.subscribers[region].discard(player_id)
+        return regions
+
+    def interested(self, player_id, coord):
+        centre, regions = self.subscriptions.get(player_id, (None, ()))
+        return self.region(coord) in regions
+
+    def update_cells(self, world, coords):
+        for coord in coords:
+            cells = self.always_visible[self.region(coord)]
+            if any(obj.type in constants.ALWAYS_VISIBLE_OBJECTS
+                   for obj in world[coord]):
+                cells.add(coord)
+            else:
+                cells.discard(coord)
+
+    def route(self, coords):
+        """Returns {player_id: set of coords} of the coords in each
+        player's area of interest"""
+        routed = collections.defaultdict(set)
+        for coord in coords:
+            for player_id in self.subscribers.get(self.region(coord), ()):
+                routed[player_id].add(coord)
+        return routed
+
+    def cells(self, regions):
+        coords = set()
+        for region in regions:
+            coords.update(self.regions[region])
+        return coords
+
+    def always_visible_cells(self, regions):
+        coords = set()
+        for region in regions:
+            coords.update(self.always_visible.get(region, ()))
+        return coords
@@ -2,6 +2,7 @@ import random
 import operator
 
 import constants
+import objects
 import utility
 import itertools
 
@@ -18,9 +19,9 @@ def purerandom(X=80,Y=24,seed=0):
 
     for i,j in itertools.product(range(X), range(Y)):
         if r.random() < 0.35:
-            world[i,j] = [(constants.OBJ_WALL, {})]
+            world[i,j] = [objects.GameObject(constants.OBJ_WALL)]
         else:
-            world[i,j] = [(constants.OBJ_EMPTY, {})]
+            world[i,j] = [objects.GameObject(constants.OBJ_EMPTY)]
 
     return world
 
@@ -29,7 +30,7 @@ def empty(X=80,Y=24,seed=None):
     world = {}
 
     for i,j in itertools.product(range(X), range(Y)):
-        world[i,j] = [(constants.OBJ_EMPTY, {})]
+        world[i,j] = [objects.GameObject(constants.OBJ_EMPTY)]
     return world
 
 @generator
@@ -93,7 +94,7 @@ def depth_first(X=80, Y=24, seed=0):
     world = {}
 
     for x,y in itertools.product(range(X), range(Y)):
-        world[x,y] = [(constants.OBJ_WALL, {})]
+        world[x,y] = [objects.GameObject(constants.OBJ_WALL)]
 
     for point_a, point_b in removed_walls:
         real_a = (point_a[0] * 2, point_a[1] * 2)
@@ -105,9 +106,9 @@ def depth_first(X=80, Y=24, seed=0):
 
         assert len(shared) == 1
 
-        world[shared.pop()] = [(constants.OBJ_EMPTY, {})]
-        world[real_a] = [(constants.OBJ_EMPTY, {})]
-        world[real_b] = [(constants.OBJ_EMPTY, {})]
+        world[shared.pop()] = [objects.GameObject(constants.OBJ_EMPTY)]
+        world[real_a] = [objects.GameObject(constants.OBJ_EMPTY)]
+        world[real_b] = [objects.GameObject(constants.OBJ_EMPTY)]
 
     return world
 
@@ -133,15 +134,14 @@ def world_to_string(world):
         char = ' '
         if world[coord]:
             last_object = world[coord][-1]
-            objtag, attr = last_object
-            char = constants.DISPLAY_CHAR.get(objtag, '?')
+            char = constants.DISPLAY_CHAR.get(last_object.type, '?')
         row += char
 
     return '\n'.join(rows)
 
 def pretty_walls(world):
-    for coord, objects in world.items():
-        if objects[0][0] == constants.OBJ_EMPTY:
+    for coord, cell in world.items():
+        if cell[0].type == constants.OBJ_EMPTY:
             continue
 
         vertical = False
@@ -150,14 +150,14 @@ def pretty_walls(world):
         for neighbour in ((coord[0], coord[1] - 1), (coord[0], coord[1] + 1)):
             if neighbour not in world:
                 continue
-            if world[neighbour][0][0] != constants.OBJ_EMPTY:
+            if world[neighbour][0].type != constants.OBJ_EMPTY:
                 vertical = True
                 break
 
         for neighbour in ((coord[0] - 1, coord[1]), (coord[0] + 1, coord[1])):
             if neighbour not in world:
                 continue
-            if world[neighbour][0][0] != constants.OBJ_EMPTY:
+            if world[neighbour][0].type != constants.OBJ_EMPTY:
                 horizontal = True
                 break
 
@@ -165,13 +165,13 @@ def pretty_walls(world):
             # Do nothing
             continue
         elif vertical and not horizontal:
-            del objects[0]
-            objects.append((constants.OBJ_VERTICAL_WALL, {}))
+            del cell[0]
+            cell.append(objects.GameObject(constants.OBJ_VERTICAL_WALL))
         elif not vertical and horizontal:
-            del objects[0]
-            objects.append((constants.OBJ_HORIZONTAL_WALL, {}))
+            del cell[0]
+            cell.append(objects.GameObject(constants.OBJ_HORIZONTAL_WALL))
         elif vertical and horizontal:
-            del objects[0]
-            objects.append((constants.OBJ_CORNER_WALL, {}))
+            del cell[0]
+            cell.append(objects.GameObject(constants.OBJ_CORNER_WALL))
 
     return world
@@ -0,0 +1,237 @@
+import bisect
+import collections
+import errno
+import logging
+import os
+import socket
+
+logger = logging.getLogger(__name__)
+
+# Seconds; good for anything from a fast tick to a very slow one
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1.0)
+
+class Metric(object):
+    kind = None
+
+    def __init__(self, name, help, labelnames=(), collect=None):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        # label values tuple -> value
+        self.values = {}
+        # If given, collect() returns {label values tuple: value}, and is
+        # only called when the metrics are rendered.
+        self.collect = collect
+
+    def samples(self):
+        """Yields (suffix, label pairs, value)"""
+        values = self.values
+        if self.collect is not None:
+            values = self.collect()
+
+        for labels in sorted(values):
+            yield '', zip(self.labelnames, labels), values[labels]
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, labels=()):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def set(self, value, labels=()):
+        self.values[labels] = value
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super(Histogram, self).__init__(name, help, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, labels=()):
+        try:
+            counts, totals = self.values[labels]
+        except KeyError:
+            # One extra bucket at the end for +Inf
+            counts = [0] * (len(self.buckets) + 1)
+            totals = [0, 0.0]
+            self.values[labels] = counts, totals
+
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        totals[0] += 1
+        totals[1] += value
+
+    def samples(self):
+        for labels in sorted(self.values):
+            counts, totals = self.values[labels]
+            pairs = zip(self.labelnames, labels)
+
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                yield '_bucket', pairs + [('le', bound)], cumulative
+
+            yield '_count', pairs, totals[0]
+            yield '_sum', pairs, totals[1]
+
+class Registry(object):
+    def __init__(self):
+        self.metrics = collections.OrderedDict()
+
+    def _add(self, metric):
+        assert metric.name not in self.metrics
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help, labelnames=(), collect=None):
+        return self._add(Counter(name, help, labelnames, collect))
+
+    def gauge(self, name, help, labelnames=(), collect=None):
+        return self._add(Gauge(name, help, labelnames, collect))
+
+    def histogram(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._add(Histogram(name, help, labelnames, buckets))
+
+    def __getitem__(self, name):
+        return self.metrics[name]
+
+    def render(self):
+        """The Prometheus text exposition format"""
+        lines = []
+        for metric in self.metrics.values():
+            lines.append("# HELP {0} {1}".format(metric.name, metric.help))
+            lines.append("# TYPE {0} {1}".format(metric.name, metric.kind))
+
+            for suffix, pairs, value in metric.samples():
+                if pairs:
+                    label_text = ','.join('{0}="{1}"'.format(key, _escape(v))
+                                          for key, v in pairs)
+                    label_text = '{' + label_text + '}'
+                else:
+                    label_text = ''
+                lines.append("{0}{1}{2} {3}".format(metric.name, suffix,
+                                                    label_text,
+                                                    _format_value(value)))
+        lines.append('')
+        return '\n'.join(lines)
+
+def _escape(value):
+    value = unicode(value)
+    value = value.replace('\\', '\\\\').replace('\n', '\\n')
+    return value.replace('"', '\\"').encode('utf-8')
+
+def _format_value(value):
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+class MetricsEndpoint(object):
+    """A tiny non-blocking HTTP server that answers every request with
+    the rendered registry. Its sockets are meant to go into the server's
+    own select(), so scraping never holds up the game loop.
+
+    address is either a port number on localhost, or a path for a UNIX
+    socket."""
+
+    MAX_REQUEST = 8192
+
+    def __init__(self, registry, address):
+        self.registry = registry
+
+        if isinstance(address, basestring) and not address.isdigit():
+            if os.path.exists(address):
+                os.unlink(address)
+            self.listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.listener.bind(address)
+        else:
+            self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            self.listener.bind(('127.0.0.1', int(address)))
+
+        self.listener.setblocking(0)
+        self.listener.listen(5)
+
+        # socket -> request data recieved so far
+        self.reading = {}
+        # socket -> response data still to send
+        self.writing = {}
+
+    def rlist(self):
+        return [self.listener] + list(self.reading)
+
+    def wlist(self):
+        return list(self.writing)
+
+    def owns(self, sock):
+        return (sock is self.listener or sock in self.reading or
+                sock in self.writing)
+
+    def handle_readable(self, sock):
+        if sock is self.listener:
+            try:
+                conn, address = self.listener.accept()
+            except socket.error as e:
+                if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    return
+                raise
+            conn.setblocking(0)
+            self.reading[conn] = ''
+            return
+
+        try:
+            data = sock.recv(4096)
+        except socket.error as e:
+            logger.error(e)
+            data = ''
+
+        if not data:
+            self._close(sock)
+            return
+
+        request = self.reading[sock] + data
+        if '\r\n\r\n' in request or '\n\n' in request:
+            del self.reading[sock]
+            self.writing[sock] = self._response()
+        elif len(request) > self.MAX_REQUEST:
+            self._close(sock)
+        else:
+            self.reading[sock] = request
+
+    def handle_writable(self, sock):
+        data = self.writing[sock]
+        try:
+            sent = sock.send(data)
+        except socket.error as e:
+            if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return
+            logger.error(e)
+            self._close(sock)
+            return
+
+        data = data[sent:]
+        if data:
+            self.writing[sock] = data
+        else:
+            self._close(sock)
+
+    def _response(self):
+        body = self.registry.render()
+        header = ("HTTP/1.0 200 OK\r\n"
+                  "Content-Type: text/plain; version=0.0.4\r\n"
+                  "Content-Length: {0}\r\n"
+                  "Connection: close\r\n\r\n").format(len(body))
+        return header + body
+
+    def _close(self, sock):
+        self.reading.pop(sock, None)
+        self.writing.pop(sock, None)
+        sock.close()
+
+    def close(self):
+        for sock in list(self.reading) + list(self.writing):
+            self._close(sock)
+        self.listener.close()
@@ -0,0 +1,256 @@
+import collections
+import heapq
+
+import constants
+import utility
+
+# Cardinal directions only, as that's all CMD_MOVE can do.
+_STEPS = tuple((direction, constants.DIFFS[direction])
+               for direction in constants.DIRECTIONS)
+
+_INFINITY = float('inf')
+
+class NavigationGrid(object):
+    """Passability of the known world, plus a cache of distance fields
+    that are repaired as cells change rather than recomputed.
+
+    Feed it with update(world, coords) whenever the cells at coords have
+    changed; ClientNetwork.add_vision_listener(grid.update) does this
+    for a client's known world."""
+
+    def __init__(self, world=None, blocking=constants.WALLS, max_fields=32):
+        # Players move around, so by default only walls block a path.
+        self.blocking = frozenset(blocking)
+        self.max_fields = max_fields
+
+        self.passable = set()
+        self._fields = collections.OrderedDict()
+
+        if world is not None:
+            self.update(world, list(world))
+
+    def update(self, world, coords):
+        opened = []
+        closed = []
+
+        for coord in coords:
+            now = (coord in world and
+                   not any(o[0] in self.blocking for o in world[coord]))
+            was = coord in self.passable
+
+            if now and not was:
+                self.passable.add(coord)
+                opened.append(coord)
+            elif was and not now:
+                self.passable.remove(coord)
+                closed.append(coord)
+
+        if opened or closed:
+            for field in self._fields.values():
+                field.repair(opened, closed)
+
+    def clear(self):
+        self.passable.clear()
+        self._fields.clear()
+
+    def distance_field(self, targets, key=None):
+        """Returns the DistanceField towards the nearest of targets,
+        reusing a cached one if possible.
+
+        Targets that move, like other players, should be given a key
+        naming them, eg. 'enemies'. The field cached under that key is
+        then moved to the new targets, rather than a field being built
+        for every place they have been."""
+        targets = frozenset(targets)
+        if key is None:
+            key = targets
+
+        if key in self._fields:
+            field = self._fields.pop(key)
+            if field.targets != targets:
+                field.retarget(targets)
+        else:
+            field = DistanceField(self, targets)
+            while len(self._fields) >= self.max_fields:
+                self._fields.popitem(last=False)
+
+        # Most recently used goes to the end
+        self._fields[key] = field
+        return field
+
+    def next_step(self, coord, targets, key=None):
+        return self.distance_field(targets, key).next_step(coord)
+
+    def find_path(self, start, goal):
+        """A* from start to goal over passable cells. Returns the list of
+        coords after start up to and including goal, or None."""
+        key = frozenset((goal,))
+        if key in self._fields:
+            # Someone's already paying for a field to this goal
+            return self._fields[key].path(start)
+
+        if goal not in self.passable:
+            return None
+
+        def heuristic(coord):
+            return abs(coord[0] - goal[0]) + abs(coord[1] - goal[1])
+
+        came_from = {start: None}
+        cost = {start: 0}
+        heap = [(heuristic(start), start)]
+
+        while heap:
+            priority, coord = heapq.heappop(heap)
+            if coord == goal:
+                break
+
+            for neighbour in utility.cardinal_neighbourhood(coord):
+                if neighbour not in self.passable:
+                    continue
+                new_cost = cost[coord] + 1
+                if new_cost < cost.get(neighbour, _INFINITY):
+                    cost[neighbour] = new_cost
+                    came_from[neighbour] = coord
+                    heapq.heappush(heap,
+                                   (new_cost + heuristic(neighbour), neighbour))
+        else:
+            return None
+
+        path = []
+        coord = goal
+        while coord != start:
+            path.append(coord)
+            coord = came_from[coord]
+        path.reverse()
+        return path
+
+class DistanceField(object):
+    """Step distances from every reachable passable cell to the nearest
+    target cell, ie. a flow field. Kept up to date by repair()."""
+
+    def __init__(self, grid, targets):
+        self.grid = grid
+        self.targets = frozenset(targets)
+        self.distances = {}
+
+        heap = [(0, target) for target in self.targets
+                if target in grid.passable]
+        for distance, target in heap:
+            self.distances[target] = distance
+        self._relax(heap)
+
+    def _relax(self, heap):
+        # Plain Dijkstra from whatever has been pushed onto the heap.
+        distances = self.distances
+        passable = self.grid.passable
+
+        heapq.heapify(heap)
+        while heap:
+            distance, coord = heapq.heappop(heap)
+            if distance > distances.get(coord, _INFINITY):
+                continue
+            distance += 1
+            for neighbour in utility.cardinal_neighbourhood(coord):
+                if neighbour not in passable:
+                    continue
+                if distance < distances.get(neighbour, _INFINITY):
+                    distances[neighbour] = distance
+                    heapq.heappush(heap, (distance, neighbour))
+
+    def repair(self, opened, closed):
+        distances = self.distances
+        passable = self.grid.passable
+
+        # Work out which cells got their distance from the closed cells,
+        # and have no other neighbour of the same distance to fall back on.
+        # Going in order of distance means the supporting cells have
+        # always been decided before the cells they support.
+        affected = set()
+        heap = [(distances[coord], coord) for coord in closed
+                if coord in distances]
+        heapq.heapify(heap)
+
+        while heap:
+            distance, coord = heapq.heappop(heap)
+            if coord in affected:
+                continue
+
+            if coord in passable:
+                if coord in self.targets:
+                    continue
+                supported = False
+                for neighbour in utility.cardinal_neighbourhood(coord):
+                    if (neighbour not in affected and
+                        distances.get(neighbour) == distance - 1 and
+                        neighbour in passable):
+                        supported = True
+                        break
+                if supported:
+                    continue
+
+            affected.add(coord)
+            for neighbour in utility.cardinal_neighbourhood(coord):
+                if distances.get(neighbour) == distance + 1:
+                    heapq.heappush(heap, (distance + 1, neighbour))
+
+        for coord in affected:
+            del distances[coord]
+
+        # Reseed the affected cells from their unaffected neighbours,
+        # and the newly opened cells from theirs.
+        heap = []
+        for coord in list(affected) + list(opened):
+            if coord not in passable:
+                continue
+            if coord in self.targets:
+                best = 0
+            else:
+                best = min([distances.get(n, _INFINITY)
+                            for n in utility.cardinal_neighbourhood(coord)])
+                best += 1
+            if best < distances.get(coord, _INFINITY):
+                distances[coord] = best
+                heap.append((best, coord))
+
+        self._relax(heap)
+
+    def retarget(self, targets):
+        # A target that's gone is like a closed cell, in that whatever got
+        # its distance from it has to find another way; a new target is
+        # opened with a distance of 0.
+        targets = frozenset(targets)
+        removed = self.targets - targets
+        added = targets - self.targets
+
+        self.targets = targets
+        self.repair(added, removed)
+
+    def distance(self, coord):
+        return self.distances.get(coord)
+
+    def next_step(self, coord):
+        """Returns the direction to move from coord to get closer to a
+        target, or None if there isn't one."""
+        best = self.distances.get(coord, _INFINITY)
+        best_direction = None
+
+        for direction, diff in _STEPS:
+            neighbour = coord[0] + diff[0], coord[1] + diff[1]
+            distance = self.distances.get(neighbour, _INFINITY)
+            if distance < best:
+                best = distance
+                best_direction = direction
+
+        return best_direction
+
+    def path(self, start):
+        if start not in self.distances:
+            return None
+
+        path = []
+        coord = start
+        while self.distances[coord] != 0:
+            diff = constants.DIFFS[self.next_step(coord)]
+            coord = coord[0] + diff[0], coord[1] + diff[1]
+            path.append(coord)
+        return path
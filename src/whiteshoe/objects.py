@@ -0,0 +1,133 @@
+import constants
+
+# The objects that live in the cells of a game's world. Each cell is a list
+# of these, and they're removed by identity, so two bullets that happen to
+# look the same are never confused with each other.
+#
+# Only the attributes named in network_keys are ever sent to clients;
+# everything else is server side bookkeeping.
+
+class GameObject(object):
+    """Anything that can sit in a cell. Plain terrain, like walls and
+    empty floor, is just one of these."""
+    __slots__ = ('type',)
+
+    # In the same order as constants.ATTRIBUTE_KEYS
+    network_keys = ()
+
+    def __init__(self, type):
+        self.type = type
+
+    def network_attributes(self):
+        """The attributes sent to clients, as a tuple of (key, value)
+        pairs. Being a tuple, it can be compared, hashed and kept."""
+        pairs = []
+        for key in self.network_keys:
+            value = getattr(self, key)
+            if value is not None:
+                pairs.append((key, value))
+        return tuple(pairs)
+
+    def snapshot(self):
+        return (self.type, self.network_attributes())
+
+    def __repr__(self):
+        return "<{0} {1!r}>".format(self.__class__.__name__,
+                                    self.network_attributes())
+
+class Player(GameObject):
+    __slots__ = ('player_id', 'direction', 'team', 'hp_max', 'hp', 'ammo',
+                 'name')
+    network_keys = ('player_id', 'direction', 'team', 'hp_max', 'hp',
+                    'ammo', 'name')
+
+    def __init__(self, player_id, direction, team, hp, ammo, name=None):
+        self.type = constants.OBJ_PLAYER
+        self.player_id = player_id
+        self.direction = direction
+        self.team = team
+        self.hp_max = hp
+        self.hp = hp
+        self.ammo = ammo
+        self.name = name
+
+class Bullet(GameObject):
+    __slots__ = ('direction', 'owner', 'size')
+    network_keys = ('direction', 'owner', 'size')
+
+    def __init__(self, owner, direction, size):
+        self.type = constants.OBJ_BULLET
+        self.owner = owner
+        self.direction = direction
+        self.size = size
+
+    @property
+    def speed(self):
+        # Seconds per cell
+        return constants.BULLET_SPEEDS[self.size]
+
+class SlimeBullet(Bullet):
+    __slots__ = ()
+
+    def __init__(self, owner, direction, size):
+        Bullet.__init__(self, owner, direction, size)
+        self.type = constants.OBJ_SLIME_BULLET
+
+    @property
+    def speed(self):
+        return constants.SLIME_BULLET_SPEED[self.size]
+
+class Explosion(GameObject):
+    # One of these covers the whole area of a blast, and the same object
+    # sits in every cell that it covers.
+    __slots__ = ('damage', 'responsible', 'cells', 'time_left', 'damaged')
+
+    def __init__(self, damage, responsible, cells):
+        self.type = constants.OBJ_EXPLOSION
+        self.damage = damage
+        self.responsible = responsible
+        self.cells = set(cells)
+        self.time_left = constants.EXPLOSION_LIFE
+        # Players that this explosion has already hurt
+        self.damaged = set()
+
+class Mine(GameObject):
+    __slots__ = ('size',)
+    network_keys = ('size',)
+
+    def __init__(self, size):
+        self.type = constants.OBJ_MINE
+        self.size = size
+
+class Slime(GameObject):
+    # A whole colony, grown from one slime bullet. Like an explosion, the
+    # same object sits in every cell that the colony occupies.
+    __slots__ = ('owner', 'size', 'cells', 'spread_to', 'frontier',
+                 'damaged', 'spread_time', 'death_time')
+    network_keys = ('owner', 'size')
+
+    def __init__(self, owner, size):
+        self.type = constants.OBJ_SLIME
+        self.owner = owner
+        self.size = size
+        # Cells occupied now, and every cell ever occupied
+        self.cells = set()
+        self.spread_to = set()
+        # Cells next to the colony that it hasn't spread to yet
+        self.frontier = set()
+        self.damaged = set()
+        self.spread_time = constants.SLIME_SPREAD_TIME
+        self.death_time = None
+
+    @property
+    def budget(self):
+        # How many more cells the colony can spread to
+        return constants.SLIME_SPREAD[self.size] - len(self.spread_to)
+
+class Lava(GameObject):
+    __slots__ = ('time_passed', 'spreading')
+
+    def __init__(self, spreading=False):
+        self.type = constants.OBJ_LAVA
+        self.time_passed = 0
+        self.spreading = spreading
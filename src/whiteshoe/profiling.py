@@ -0,0 +1,141 @@
+import collections
+import cProfile
+import pstats
+import StringIO
+import time
+
+import utility
+
+class _PhaseTimer(object):
+    # One of these per phase name, reused, so timing a phase doesn't
+    # allocate anything. Phases of the same name mustn't nest.
+    def __init__(self, histogram):
+        self.histogram = histogram
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.time()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.histogram.add(time.time() - self.start)
+
+class RollingHistogram(object):
+    """Keeps the last `window` samples for percentiles, as well as
+    running totals since the start."""
+    def __init__(self, window=1000):
+        self.samples = collections.deque(maxlen=window)
+        self.count = 0
+        self.total = 0.0
+
+    def add(self, value):
+        self.samples.append(value)
+        self.count += 1
+        self.total += value
+
+    def summary(self):
+        samples = sorted(self.samples)
+        return {
+            'count': self.count,
+            'total': self.total,
+            'mean': self.total / self.count if self.count else 0.0,
+            'p50': utility.percentile(samples, 0.50),
+            'p90': utility.percentile(samples, 0.90),
+            'p99': utility.percentile(samples, 0.99),
+            'max': samples[-1] if samples else None,
+        }
+
+class Profiler(object):
+    def __init__(self, window=1000):
+        self.window = window
+        self.histograms = collections.OrderedDict()
+        self._timers = {}
+
+    def histogram(self, name):
+        if name not in self.histograms:
+            self.histograms[name] = RollingHistogram(self.window)
+        return self.histograms[name]
+
+    def phase(self, name):
+        # with profiler.phase('tick_bullets'):
+        timer = self._timers.get(name)
+        if timer is None:
+            timer = self._timers[name] = _PhaseTimer(self.histogram(name))
+        return timer
+
+    def add(self, name, seconds):
+        self.histogram(name).add(seconds)
+
+    def format(self, title):
+        lines = [title]
+        fmt = "  {0:<24} {1:>9} {2:>10} {3:>9} {4:>9} {5:>9} {6:>9} {7:>9}"
+        lines.append(fmt.format('phase', 'count', 'total s', 'mean ms',
+                                'p50 ms', 'p90 ms', 'p99 ms', 'max ms'))
+
+        def ms(value):
+            if value is None:
+                return '-'
+            return "{0:.3f}".format(value * 1000)
+
+        for name, histogram in self.histograms.items():
+            s = histogram.summary()
+            lines.append(fmt.format(name, s['count'],
+                                    "{0:.3f}".format(s['total']),
+                                    ms(s['mean']), ms(s['p50']), ms(s['p90']),
+                                    ms(s['p99']), ms(s['max'])))
+        return '\n'.join(lines)
+
+class _NullTimer(object):
+    def __enter__(self):
+        pass
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+class NullProfiler(object):
+    # Used when profiling is turned off; does as little as possible.
+    _timer = _NullTimer()
+
+    def phase(self, name):
+        return self._timer
+
+    def add(self, name, seconds):
+        pass
+
+    def format(self, title):
+        return "{0}\n  (profiling is disabled)".format(title)
+
+class CaptureWindow(object):
+    """Runs cProfile for a limited number of seconds, then writes the
+    stats to a file. check() needs calling regularly to notice the end of
+    the window."""
+    def __init__(self):
+        self.profile = None
+        self.stop_time = None
+        self.path = None
+
+    @property
+    def running(self):
+        return self.profile is not None
+
+    def start(self, seconds, path):
+        if self.running:
+            return
+        self.path = path
+        self.stop_time = time.time() + seconds
+        self.profile = cProfile.Profile()
+        self.profile.enable()
+
+    def check(self):
+        """Returns a summary of the capture if one just finished, or None"""
+        if not self.running or time.time() < self.stop_time:
+            return None
+
+        self.profile.disable()
+        self.profile.dump_stats(self.path)
+
+        out = StringIO.StringIO()
+        stats = pstats.Stats(self.profile, stream=out)
+        stats.sort_stats('cumulative').print_stats(20)
+
+        self.profile = None
+        return "cProfile capture written to {0}\n{1}".format(self.path,
+                                                             out.getvalue())
@@ -0,0 +1,270 @@
+import constants
+
+# NumPy is optional; without it the same arithmetic is done with lists,
+# and gives exactly the same results.
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# The values in a SolidityGrid
+OFF_WORLD = 0
+OPEN = 1
+SOLID = 2
+
+class SolidityGrid(object):
+    """Whether each cell of the world stops a projectile, in one flat
+    array, so a whole batch of projectiles can be checked at once. Cells
+    are only recomputed after being marked as changed."""
+    def __init__(self, world, solid=constants.SOLID_OBJECTS):
+        self.solid = solid
+        self.width = max(x for x, y in world) + 1
+        self.height = max(y for x, y in world) + 1
+
+        size = self.width * self.height
+        if numpy is not None:
+            self.cells = numpy.zeros(size, dtype=numpy.uint8)
+        else:
+            self.cells = bytearray(size)
+
+        self.stale = set(world)
+
+    def mark(self, coord):
+        self.stale.add(coord)
+
+    def refresh(self, world):
+        solid = self.solid
+        cells = self.cells
+        width = self.width
+
+        for x, y in self.stale:
+            if any(obj.type in solid for obj in world[x, y]):
+                cells[y * width + x] = SOLID
+            else:
+                cells[y * width + x] = OPEN
+
+        self.stale.clear()
+
+    def lookup(self, x, y):
+        if 0 <= x < self.width and 0 <= y < self.height:
+            return self.cells[y * self.width + x]
+        return OFF_WORLD
+
+    def lookup_many(self, xs, ys):
+        # xs and ys are numpy arrays
+        inside = (xs >= 0) & (xs < self.width) & (ys >= 0) & (ys < self.height)
+        result = numpy.zeros(len(xs), dtype=numpy.uint8)
+        result[inside] = self.cells[ys[inside] * self.width + xs[inside]]
+        return result
+
+class ProjectileBatch(object):
+    """Projectiles of one kind, with their positions, directions, speeds
+    and time until their next step kept in parallel arrays, so that they
+    can all be moved together.
+
+    The projectile objects themselves still sit in the world; advance()
+    says where they've gone, and the game moves them."""
+    def __init__(self):
+        self.projectiles = []
+
+        # Added or discarded since the last advance
+        self._added = []
+        self._discarded = set()
+
+        if numpy is not None:
+            self.x = numpy.zeros(0, dtype=numpy.int64)
+            self.y = numpy.zeros(0, dtype=numpy.int64)
+            self.dx = numpy.zeros(0, dtype=numpy.int64)
+            self.dy = numpy.zeros(0, dtype=numpy.int64)
+            self.speed = numpy.zeros(0)
+            self.time = numpy.zeros(0)
+        else:
+            self.x = []
+            self.y = []
+            self.dx = []
+            self.dy = []
+            self.speed = []
+            self.time = []
+
+    def __len__(self):
+        return len(self.projectiles) + len(self._added)
+
+    def add(self, coord, projectile):
+        self._added.append((coord, projectile))
+
+    def discard(self, projectile):
+        # For when something other than advance() takes a projectile out
+        # of the world.
+        self._discarded.add(projectile)
+
+    def _merge(self):
+        if self._discarded:
+            discarded = self._discarded
+            self._added = [(coord, projectile)
+                           for coord, projectile in self._added
+                           if projectile not in discarded]
+            self._keep([projectile not in discarded
+                        for projectile in self.projectiles])
+            self._discarded = set()
+
+        if not self._added:
+            return
+
+        columns = ([], [], [], [], [], [])
+        for coord, projectile in self._added:
+            dx, dy = constants.DIFFS[projectile.direction]
+            speed = projectile.speed
+            for column, value in zip(columns, (coord[0], coord[1], dx, dy,
+                                               speed, speed)):
+                column.append(value)
+            self.projectiles.append(projectile)
+        self._added = []
+
+        x, y, dx, dy, speed, time = columns
+        if numpy is not None:
+            self.x = numpy.concatenate((self.x, x))
+            self.y = numpy.concatenate((self.y, y))
+            self.dx = numpy.concatenate((self.dx, dx))
+            self.dy = numpy.concatenate((self.dy, dy))
+            self.speed = numpy.concatenate((self.speed, speed))
+            self.time = numpy.concatenate((self.time, time))
+        else:
+            self.x.extend(x)
+            self.y.extend(y)
+            self.dx.extend(dx)
+            self.dy.extend(dy)
+            self.speed.extend(speed)
+            self.time.extend(time)
+
+    def _keep(self, keep):
+        # keep is a sequence of booleans, one per projectile
+        self.projectiles = [projectile for projectile, kept
+                            in zip(self.projectiles, keep) if kept]
+
+        if numpy is not None:
+            keep = numpy.asarray(keep, dtype=bool)
+            for name in ('x', 'y', 'dx', 'dy', 'speed', 'time'):
+                setattr(self, name, getattr(self, name)[keep])
+        else:
+            for name in ('x', 'y', 'dx', 'dy', 'speed', 'time'):
+                column = getattr(self, name)
+                setattr(self, name, [value for value, kept
+                                     in zip(column, keep) if kept])
+
+    def advance(self, time_passed, grid):
+        """Moves every projectile on by time_passed seconds, a cell at a
+        time, stopping at anything solid or the edge of the world.
+
+        Returns a list of (projectile, start, end, hit) for each projectile
+        that moved or stopped. end is where it is now, or None if it left
+        the world. hit is the solid coord it ran into, or None if it's
+        still flying. Stopped projectiles are forgotten."""
+        self._merge()
+        if not self.projectiles:
+            return []
+
+        if numpy is not None:
+            return self._advance_arrays(time_passed, grid)
+        else:
+            return self._advance_lists(time_passed, grid)
+
+    def _advance_arrays(self, time_passed, grid):
+        x, y, dx, dy, speed, time = (self.x, self.y, self.dx, self.dy,
+                                     self.speed, self.time)
+        count = len(self.projectiles)
+
+        start_x = x.copy()
+        start_y = y.copy()
+        stopped = numpy.zeros(count, dtype=bool)
+        lost = numpy.zeros(count, dtype=bool)
+        hit_x = numpy.zeros(count, dtype=numpy.int64)
+        hit_y = numpy.zeros(count, dtype=numpy.int64)
+
+        time -= time_passed
+
+        stepping = (time < 0).nonzero()[0]
+        while len(stepping):
+            time[stepping] += speed[stepping]
+
+            new_x = x[stepping] + dx[stepping]
+            new_y = y[stepping] + dy[stepping]
+            cells = grid.lookup_many(new_x, new_y)
+
+            is_open = cells == OPEN
+            x[stepping[is_open]] = new_x[is_open]
+            y[stepping[is_open]] = new_y[is_open]
+
+            is_solid = cells == SOLID
+            hit_x[stepping[is_solid]] = new_x[is_solid]
+            hit_y[stepping[is_solid]] = new_y[is_solid]
+
+            lost[stepping[cells == OFF_WORLD]] = True
+            stopped[stepping[~is_open]] = True
+
+            stepping = ((time < 0) & ~stopped).nonzero()[0]
+
+        changed = (stopped | (x != start_x) | (y != start_y)).nonzero()[0]
+
+        results = []
+        columns = (start_x[changed].tolist(), start_y[changed].tolist(),
+                   x[changed].tolist(), y[changed].tolist(),
+                   hit_x[changed].tolist(), hit_y[changed].tolist(),
+                   stopped[changed].tolist(), lost[changed].tolist())
+        for i, row in zip(changed.tolist(), zip(*columns)):
+            sx, sy, ex, ey, hx, hy, is_stopped, is_lost = row
+            end = None if is_lost else (ex, ey)
+            hit = (hx, hy) if is_stopped and not is_lost else None
+            results.append((self.projectiles[i], (sx, sy), end, hit))
+
+        if stopped.any():
+            self._keep(~stopped)
+
+        return results
+
+    def _advance_lists(self, time_passed, grid):
+        results = []
+        keep = []
+
+        for i, projectile in enumerate(self.projectiles):
+            x = start_x = self.x[i]
+            y = start_y = self.y[i]
+            dx = self.dx[i]
+            dy = self.dy[i]
+            speed = self.speed[i]
+            time = self.time[i] - time_passed
+
+            end = None
+            hit = None
+            stopped = False
+
+            while time < 0:
+                time += speed
+
+                new_x = x + dx
+                new_y = y + dy
+                cell = grid.lookup(new_x, new_y)
+
+                if cell == OPEN:
+                    x = new_x
+                    y = new_y
+                else:
+                    stopped = True
+                    if cell == SOLID:
+                        hit = (new_x, new_y)
+                    break
+
+            self.x[i] = x
+            self.y[i] = y
+            self.time[i] = time
+            keep.append(not stopped)
+
+            if hit is not None or not stopped:
+                end = (x, y)
+
+            if stopped or (x, y) != (start_x, start_y):
+                results.append((projectile, (start_x, start_y), end, hit))
+
+        if not all(keep):
+            self._keep(keep)
+
+        return results
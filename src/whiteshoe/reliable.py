@@ -0,0 +1,223 @@
+import collections
+import time
+
+import constants
+
+# Payloads that must arrive, in the order they were sent. They're sent
+# again until they're acknowledged.
+CRITICAL_PAYLOADS = frozenset((
+    constants.GAMES_LIST, constants.MAKE_NEW_GAME, constants.ERROR,
+    constants.JOIN_GAME, constants.DISCONNECT, constants.GAME_STATUS,
+    constants.KEYVALUE))
+
+# Payloads that are only worth having if they're the latest news. They
+# aren't sent again; when one is lost, the sender sends whatever is
+# current instead.
+LATEST_PAYLOADS = frozenset((constants.VISION_UPDATE,))
+
+def is_critical(packet):
+    # Numbered actions come from a predicting client, which shows them
+    # straight away, so the server had better carry them out
+    return (packet.payload_type in CRITICAL_PAYLOADS or
+            (packet.payload_type == constants.GAME_ACTION and
+             packet.HasField('action_sequence')))
+
+_ACK_MASK = (1 << constants.ACK_WINDOW) - 1
+
+# Sequence numbers are uint32s on the wire, and wrap around to 0
+_SEQUENCE_MOD = 1 << 32
+
+def sequence_diff(a, b):
+    """How far sequence a is after b, negative if it's before, allowing
+    for either having wrapped around"""
+    diff = (a - b) % _SEQUENCE_MOD
+    if diff >= _SEQUENCE_MOD // 2:
+        diff -= _SEQUENCE_MOD
+    return diff
+
+def _next(sequence):
+    return (sequence + 1) % _SEQUENCE_MOD
+
+class ReliableChannel(object):
+    """One end of a conversation over UDP. Every packet sent through it is
+    stamped with a sequence number and acknowledgements of the packets
+    received, and every packet received goes through it to weed out
+    duplicates and put critical packets back in order.
+
+    Nothing is sent from here; lost() and ack_due() say when the owner
+    should send something."""
+    def __init__(self):
+        self.sequence = 0
+        self.reliable_sequence = 0
+
+        # sequence -> (time sent, packet), for sent packets that are
+        # critical or latest-wins, until they're acknowledged or lost
+        self.sent = collections.OrderedDict()
+
+        # What we've heard from the other end
+        self.remote_sequence = None
+        self.received_bits = 0
+        self.latest_sequence = None
+        # The reliable_sequence of the last critical packet handled, and
+        # those that arrived before their turn
+        self.delivered = 0
+        self.held = {}
+        # When the oldest packet we haven't acknowledged arrived
+        self.ack_owed = None
+
+        self.duplicates = 0
+        self.stale = 0
+        self.lost_count = 0
+
+    def stamp(self, packet, now=None):
+        """Fills in the sequence numbers and acknowledgements of a packet
+        that is about to be sent. A lost critical packet is stamped again
+        when it's resent, keeping its reliable_sequence."""
+        if now is None:
+            now = time.time()
+
+        self.sequence = _next(self.sequence)
+        packet.sequence = self.sequence
+
+        if self.remote_sequence is not None:
+            packet.ack = self.remote_sequence
+            packet.ack_bits = self.received_bits
+            self.ack_owed = None
+
+        if is_critical(packet):
+            if not packet.HasField('reliable_sequence'):
+                self.reliable_sequence = _next(self.reliable_sequence)
+                packet.reliable_sequence = self.reliable_sequence
+            self.sent[self.sequence] = (now, packet)
+        else:
+            packet.reliable_sequence = self.reliable_sequence
+            if packet.payload_type in LATEST_PAYLOADS:
+                self.sent[self.sequence] = (now, packet)
+
+    def receive(self, packet, now=None):
+        """Returns the packets that can be handled now, in order. That's
+        none for a duplicate or a stale packet, and can be several if a
+        critical packet has filled a gap."""
+        if now is None:
+            now = time.time()
+
+        if packet.HasField('ack'):
+            self._acknowledged(packet.ack, packet.ack_bits)
+
+        if not packet.HasField('sequence'):
+            # The other end isn't using a channel
+            return [packet]
+
+        sequence = packet.sequence
+        if self._seen(sequence):
+            self.duplicates += 1
+            return []
+
+        reliable = packet.reliable_sequence
+        critical = is_critical(packet)
+
+        if not critical:
+            latest = packet.payload_type in LATEST_PAYLOADS
+            if (sequence_diff(reliable, self.delivered) > 0 or
+                (latest and self.latest_sequence is not None and
+                 sequence_diff(sequence, self.latest_sequence) < 0)):
+                # It either follows a critical packet we haven't had
+                # yet, or is older than news we already have. It's not
+                # acknowledged, so the sender sends what's current.
+                self.stale += 1
+                return []
+            if latest:
+                self.latest_sequence = sequence
+
+        self._mark_received(sequence, now)
+
+        if not critical:
+            return [packet]
+
+        if (sequence_diff(reliable, self.delivered) <= 0 or
+            reliable in self.held):
+            # Sent again, after the first one got through
+            self.duplicates += 1
+            return []
+
+        self.held[reliable] = packet
+        ready = []
+        while _next(self.delivered) in self.held:
+            self.delivered = _next(self.delivered)
+            ready.append(self.held.pop(self.delivered))
+        return ready
+
+    def _seen(self, sequence):
+        if self.remote_sequence is None:
+            return False
+        behind = sequence_diff(self.remote_sequence, sequence)
+        if behind < 0:
+            return False
+        if behind == 0:
+            return True
+        elif behind > constants.ACK_WINDOW:
+            # Too old to tell; if it mattered, it'll be sent again
+            return True
+        return bool(self.received_bits & (1 << (behind - 1)))
+
+    def _mark_received(self, sequence, now):
+        if self.remote_sequence is None:
+            self.remote_sequence = sequence
+        else:
+            ahead = sequence_diff(sequence, self.remote_sequence)
+            if ahead > 0:
+                bits = ((self.received_bits << 1) | 1) << (ahead - 1)
+                self.received_bits = bits & _ACK_MASK
+                self.remote_sequence = sequence
+            else:
+                self.received_bits |= 1 << (-ahead - 1)
+
+        if self.ack_owed is None:
+            self.ack_owed = now
+
+    def _acknowledged(self, ack, bits):
+        for sequence in list(self.sent):
+            behind = sequence_diff(ack, sequence)
+            if behind < 0:
+                break
+            if behind == 0 or (behind <= constants.ACK_WINDOW and
+                               bits & (1 << (behind - 1))):
+                del self.sent[sequence]
+
+    def lost(self, now=None):
+        """Returns the packets that have gone unacknowledged for too long,
+        oldest first, and stops waiting for them. Critical packets should
+        be sent again."""
+        if now is None:
+            now = time.time()
+
+        lost = []
+        for sequence, (sent_time, packet) in self.sent.items():
+            if now - sent_time < constants.RESEND_TIME:
+                break
+            del self.sent[sequence]
+            lost.append(packet)
+
+        self.lost_count += len(lost)
+        return lost
+
+    def ack_due(self, now=None):
+        """Whether something should be sent just to carry
+        acknowledgements"""
+        if now is None:
+            now = time.time()
+        return (self.ack_owed is not None and
+                now - self.ack_owed >= constants.ACK_DELAY)
+
+    def next_deadline(self):
+        """When lost() or ack_due() will next have something to say, or
+        None"""
+        deadlines = []
+        if self.ack_owed is not None:
+            deadlines.append(self.ack_owed + constants.ACK_DELAY)
+        for sent_time, packet in self.sent.itervalues():
+            deadlines.append(sent_time + constants.RESEND_TIME)
+            break
+        if deadlines:
+            return min(deadlines)
+        return None
@@ -0,0 +1,220 @@
+from __future__ import print_function
+
+import argparse
+import collections
+import cProfile
+import json
+import pstats
+import struct
+import sys
+import time
+
+import game
+
+# A replay file is a header, followed by records appended as the game goes.
+#
+# header: MAGIC, then a '>H' length and that many bytes of JSON, which
+#         contains the arguments the game was created with.
+# record: a single type byte, followed by the fields for that type.
+#         Strings are a '>H' length followed by utf-8 bytes.
+
+MAGIC = 'WSR1'
+
+RECORD_TICK = 'T'
+RECORD_JOIN = 'J'
+RECORD_LEAVE = 'L'
+RECORD_ACTION = 'A'
+RECORD_CHECKSUM = 'C'
+
+_formats = {
+    # time delta in seconds
+    RECORD_TICK: struct.Struct('>d'),
+    # player_id, has_team, team, followed by the name string
+    RECORD_JOIN: struct.Struct('>i?i'),
+    # player_id
+    RECORD_LEAVE: struct.Struct('>i'),
+    # player_id, action, argument
+    RECORD_ACTION: struct.Struct('>iii'),
+    # tick number, game.state_digest()
+    RECORD_CHECKSUM: struct.Struct('>QI'),
+}
+_string_length = struct.Struct('>H')
+
+# Write a checksum every this many ticks
+CHECKSUM_PERIOD = 100
+
+def replay_main(args=None):
+    p = argparse.ArgumentParser(
+        description="Replay a recorded game headlessly, as fast as possible")
+    p.add_argument('path')
+    p.add_argument('--no-check',dest='check',action='store_false',
+                   help="don't compare against the recorded checksums")
+    p.add_argument('--profile',action='store_true',
+                   help="run under cProfile and print the hottest functions")
+    p.add_argument('--sort',default='cumulative')
+    p.add_argument('--limit',type=int,default=30)
+    ns = p.parse_args(args)
+
+    if ns.profile:
+        profile = cProfile.Profile()
+        result = profile.runcall(replay, ns.path, check=ns.check)
+    else:
+        result = replay(ns.path, check=ns.check)
+
+    fmt = ("{records} records, {ticks} ticks, {actions} actions in "
+           "{elapsed:.2f}s ({game_time:.1f}s of game time, "
+           "{speedup:.1f}x). {checked} checksums, {mismatches} mismatches.")
+    print(fmt.format(**result))
+
+    if ns.profile:
+        stats = pstats.Stats(profile, stream=sys.stdout)
+        stats.sort_stats(ns.sort).print_stats(ns.limit)
+
+    if result['mismatches']:
+        sys.exit(1)
+
+class ReplayRecorder(object):
+    def __init__(self, path, game, checksum_period=CHECKSUM_PERIOD):
+        self.checksum_period = checksum_period
+        self.ticks = 0
+
+        # Append only, so a crashing server still leaves a usable file.
+        self.file = open(path, 'ab')
+        if self.file.tell() != 0:
+            raise ReplayException("{0} already exists".format(path))
+
+        header = json.dumps({
+            'mode': game.mode,
+            'max_players': game.max_players,
+            'map_generator': game.map_generator,
+            'name': game.name,
+            'vision': game.vision,
+            'options': game.options,
+        })
+        self.file.write(MAGIC)
+        self.file.write(_string_length.pack(len(header)))
+        self.file.write(header)
+
+    def _write(self, record_type, *fields):
+        self.file.write(record_type)
+        self.file.write(_formats[record_type].pack(*fields))
+
+    def _write_string(self, string):
+        data = string.encode('utf-8')
+        self.file.write(_string_length.pack(len(data)))
+        self.file.write(data)
+
+    def record_tick(self, time_diff_s):
+        self._write(RECORD_TICK, time_diff_s)
+
+    def record_join(self, player_id, name, team):
+        self._write(RECORD_JOIN, player_id, team is not None, team or 0)
+        self._write_string(name or u'')
+
+    def record_leave(self, player_id):
+        self._write(RECORD_LEAVE, player_id)
+
+    def record_action(self, player_id, action, argument):
+        self._write(RECORD_ACTION, player_id, action, argument)
+
+    def tick_done(self, game):
+        self.ticks += 1
+        if self.ticks % self.checksum_period == 0:
+            self._write(RECORD_CHECKSUM, self.ticks, game.state_digest())
+            self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+def read_replay(path):
+    """Returns the header dict, and a generator of (record_type, fields)"""
+    f = open(path, 'rb')
+
+    if f.read(len(MAGIC)) != MAGIC:
+        raise ReplayException("{0} is not a replay".format(path))
+
+    size, = _string_length.unpack(f.read(_string_length.size))
+    header = json.loads(f.read(size),
+                        object_pairs_hook=collections.OrderedDict)
+
+    def records():
+        with f:
+            while True:
+                record_type = f.read(1)
+                if not record_type:
+                    break
+
+                fmt = _formats[record_type]
+                data = f.read(fmt.size)
+                if len(data) < fmt.size:
+                    # The game was cut off halfway through a write
+                    break
+                fields = fmt.unpack(data)
+
+                if record_type == RECORD_JOIN:
+                    size, = _string_length.unpack(
+                        f.read(_string_length.size))
+                    fields += (f.read(size).decode('utf-8'),)
+
+                yield record_type, fields
+
+    return header, records()
+
+def make_game(header):
+    game_cls = game.modes[header['mode']]
+    return game_cls(max_players=header['max_players'],
+                    map_generator=header['map_generator'],
+                    name=header['name'], vision=header['vision'],
+                    options=header['options'])
+
+def replay(path, check=True):
+    header, records = read_replay(path)
+    g = make_game(header)
+
+    result = dict.fromkeys(('records', 'ticks', 'actions', 'checked',
+                            'mismatches'), 0)
+    result['game_time'] = 0.0
+
+    stopwatch_start = time.time()
+
+    for record_type, fields in records:
+        result['records'] += 1
+
+        if record_type == RECORD_TICK:
+            time_diff_s, = fields
+            g.tick(time_diff_s)
+            result['ticks'] += 1
+            result['game_time'] += time_diff_s
+
+        elif record_type == RECORD_JOIN:
+            player_id, has_team, team, name = fields
+            if not has_team:
+                team = None
+            g.player_join(player_id, name=name or None, team=team)
+
+        elif record_type == RECORD_LEAVE:
+            player_id, = fields
+            g.player_leave(player_id)
+
+        elif record_type == RECORD_ACTION:
+            player_id, action, argument = fields
+            g.player_action(player_id, action, argument)
+            result['actions'] += 1
+
+        elif record_type == RECORD_CHECKSUM and check:
+            tick_number, digest = fields
+            result['checked'] += 1
+            if g.state_digest() != digest:
+                result['mismatches'] += 1
+                print("Replay diverged by tick {0}".format(tick_number),
+                      file=sys.stderr)
+
+    result['elapsed'] = time.time() - stopwatch_start
+    result['speedup'] = result['game_time'] / (result['elapsed'] or 1e-9)
+    return result
+
+class ReplayException(Exception):
+    pass
+
+if __name__=='__main__':
+    replay_main()
@@ -0,0 +1,82 @@
+import bisect
+
+class Scoreboard(object):
+    """Scores by player_id, along with a ranking that's kept sorted as
+    the scores change, and the set of players whose scores have changed
+    since they were last sent.
+
+    The server keeps one of these, and clients rebuild their own from
+    the (player_id, score) deltas that it sends."""
+    def __init__(self):
+        self.scores = {}
+        # (-score, player_id), so the best score is first
+        self.ranking = []
+        self.changed = set()
+
+    def __contains__(self, player_id):
+        return player_id in self.scores
+
+    def __getitem__(self, player_id):
+        return self.scores[player_id]
+
+    def __len__(self):
+        return len(self.scores)
+
+    def get(self, player_id, default=None):
+        return self.scores.get(player_id, default)
+
+    def items(self):
+        return self.scores.items()
+
+    def add(self, player_id, delta):
+        self.set(player_id, self.scores.get(player_id, 0) + delta)
+
+    def set(self, player_id, score):
+        old_score = self.scores.get(player_id)
+        if old_score == score:
+            return
+
+        if old_score is not None:
+            index = bisect.bisect_left(self.ranking, (-old_score, player_id))
+            del self.ranking[index]
+
+        bisect.insort(self.ranking, (-score, player_id))
+        self.scores[player_id] = score
+        self.changed.add(player_id)
+
+    def remove(self, player_id):
+        score = self.scores.pop(player_id, None)
+        if score is None:
+            return
+
+        index = bisect.bisect_left(self.ranking, (-score, player_id))
+        del self.ranking[index]
+        self.changed.discard(player_id)
+
+    def clear(self):
+        self.scores.clear()
+        del self.ranking[:]
+        self.changed.clear()
+
+    def rank(self, player_id):
+        """1 for the best score; tied players are ranked by player_id"""
+        score = self.scores[player_id]
+        return bisect.bisect_left(self.ranking, (-score, player_id)) + 1
+
+    def top(self, n=None):
+        """[(player_id, score), ...] best first"""
+        ranking = self.ranking if n is None else self.ranking[:n]
+        return [(player_id, -negative) for negative, player_id in ranking]
+
+    def pop_changes(self):
+        """[(player_id, score), ...] for everything changed since the
+        last call"""
+        changes = [(player_id, self.scores[player_id])
+                   for player_id in sorted(self.changed)]
+        self.changed.clear()
+        return changes
+
+    def apply(self, deltas):
+        # deltas is a flat sequence of player_id, score pairs
+        for i in range(0, len(deltas) - 1, 2):
+            self.set(deltas[i], deltas[i + 1])
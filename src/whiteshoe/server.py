@@ -1,7 +1,9 @@
 from __future__ import print_function
 
 import datetime
+import errno
 import select
+import signal
 import socket
 import random
 import itertools
@@ -13,7 +15,10 @@ import fractions
 import operator
 import time
 import logging
+import struct
 import collections
+import fcntl
+import termios
 
 import constants
 import packet_pb2
@@ -23,6 +28,11 @@ import utility
 import maps
 import vision
 import game
+import replay
+import profiling
+import visionpool
+import metrics
+import reliable
 
 logger = logging.getLogger(__name__)
 
@@ -35,6 +45,27 @@ def server_main(args=None):
     p.add_argument('-q','--quiet',action='store_true',default=False)
     p.add_argument('-d','--debug',action='store_true')
     p.add_argument('-o',dest='options',action='append',default=[])
+    p.add_argument('-r','--record',metavar='FILE',default=None,
+                   help="record the game to FILE, for use with replay.py")
+    p.add_argument('--profile',action='store_true',
+                   help="time each phase of the server; SIGUSR1 dumps the "
+                        "timings to stderr")
+    p.add_argument('--profile-capture',type=float,default=10.0,
+                   metavar='SECONDS',
+                   help="on SIGUSR2, run cProfile for this many seconds")
+    p.add_argument('--vision-processes',type=int,default=0,metavar='N',
+                   help="work out players' vision in N worker processes")
+    p.add_argument('--metrics',metavar='PORT|PATH',default=None,
+                   help="serve Prometheus metrics on localhost:PORT, or on "
+                        "a UNIX socket at PATH")
+    p.add_argument('--input-budget',type=int,default=constants.INPUT_BUDGET,
+                   metavar='N',
+                   help="carry out at most N actions per player every "
+                        "{0}s; 0 carries them out as they arrive".format(
+                            constants.INPUT_PERIOD))
+    p.add_argument('--no-compression',dest='compression',
+                   action='store_false',
+                   help="never compress what is sent to TCP clients")
     ns = p.parse_args(args)
 
     options = collections.OrderedDict()
@@ -56,12 +87,41 @@ class Server(object):
 
         self.games = []
 
+        # Actions each player can have carried out every INPUT_PERIOD,
+        # or None
+        self.input_budget = ns.input_budget or None
+
         # Debug starting game
         game_cls = game.modes[ns.mode]
 
         g = game_cls(vision=ns.vision, map_generator=ns.map, options=options)
+        # Actions are sent out once per loop, when the game ticks
+        g.defer_flush = True
+        g.input_budget = self.input_budget
         self.games.append(g)
 
+        if ns.record is not None:
+            g.recorder = replay.ReplayRecorder(ns.record, g)
+
+        self.vision_processes = ns.vision_processes
+        if self.vision_processes:
+            g.vision_pool = visionpool.VisionPool(g.world, g.vision,
+                                                  self.vision_processes)
+
+        self.profiling = ns.profile
+        if self.profiling:
+            self.profiler = profiling.Profiler()
+            g.profiler = profiling.Profiler()
+        else:
+            self.profiler = profiling.NullProfiler()
+
+        self.capture = profiling.CaptureWindow()
+        self.capture_seconds = ns.profile_capture
+
+        # Set by signal handlers, and dealt with in the main loop
+        self._dump_requested = False
+        self._capture_requested = False
+
         self.display_stats = not ns.quiet
         self.debug = ns.debug
 
@@ -81,20 +141,130 @@ class Server(object):
         self.stats = {'packets_sent':0,
                       'packets_recieved':0,
                       'bytes_sent':0,
-                      'bytes_recieved':0}
+                      'bytes_recieved':0,
+                      'bytes_compressed':0,
+                      'bytes_saved':0,
+                      'compress_seconds':0.0,
+                      'inputs_dropped':0}
+
+        # Whether TCP clients that ask for compression get it
+        self.compression = ns.compression
 
         self.options = options
 
+        self.stats_timer = utility.RecurringTimer(
+            constants.STATS_DISPLAY_PERIOD)
+
+        self.metrics = self._make_metrics()
+        if ns.metrics is not None:
+            self.metrics_endpoint = metrics.MetricsEndpoint(self.metrics,
+                                                            ns.metrics)
+        else:
+            self.metrics_endpoint = None
+
+    def _make_metrics(self):
+        registry = metrics.Registry()
+
+        registry.counter('whiteshoe_packets_sent_total',
+                         "Packets sent, by payload type", ('payload_type',))
+        registry.counter('whiteshoe_bytes_sent_total',
+                         "Packet bytes sent, by payload type",
+                         ('payload_type',))
+        registry.counter('whiteshoe_packets_recieved_total',
+                         "Packets recieved, by payload type",
+                         ('payload_type',))
+        registry.counter('whiteshoe_bytes_recieved_total',
+                         "Packet bytes recieved, by payload type",
+                         ('payload_type',))
+        registry.histogram('whiteshoe_game_tick_seconds',
+                           "Time taken by each game tick", ('game',))
+
+        # The rest are only worked out when someone asks for them
+        def players():
+            return dict(((game.id,), len(game.players))
+                        for game in self.games)
+        registry.gauge('whiteshoe_players', "Players in each game",
+                       ('game',), collect=players)
+
+        def clients():
+            return {(): len(self.clients)}
+        registry.gauge('whiteshoe_clients', "Connected clients",
+                       collect=clients)
+
+        def vision_cells():
+            return dict(((game.id,), game.stats['vision_cells'])
+                        for game in self.games)
+        registry.counter('whiteshoe_vision_cells_total',
+                         "Cells of vision computed for players", ('game',),
+                         collect=vision_cells)
+
+        def compression_saved():
+            return {(): self.stats['bytes_saved']}
+        registry.counter('whiteshoe_compression_saved_bytes_total',
+                         "Bytes saved by compressing packets to TCP clients",
+                         collect=compression_saved)
+
+        def compression_seconds():
+            return {(): self.stats['compress_seconds']}
+        registry.counter('whiteshoe_compression_seconds_total',
+                         "Time spent compressing packets to TCP clients",
+                         collect=compression_seconds)
+
+        def inputs_dropped():
+            return dict(((game.id,), game.stats['inputs_dropped'])
+                        for game in self.games)
+        registry.counter('whiteshoe_inputs_dropped_total',
+                         "Actions dropped because a player's queue was full",
+                         ('game',), collect=inputs_dropped)
+
+        # Only Linux can say how much is sitting in a socket's send buffer
+        if hasattr(termios, 'TIOCOUTQ'):
+            def send_queue():
+                return {(): self._send_queue_bytes()}
+            registry.gauge('whiteshoe_send_queue_bytes',
+                           "Bytes sitting unsent in TCP client send buffers",
+                           collect=send_queue)
+
+        return registry
+
+    def _send_queue_bytes(self):
+        total = 0
+        for conn in self.client_sockets:
+            try:
+                unsent = fcntl.ioctl(conn.fileno(), termios.TIOCOUTQ, '\0' * 4)
+            except (IOError, socket.error):
+                continue
+            total += struct.unpack('i', unsent)[0]
+        return total
+
+    def _count_packet(self, direction, packet, size):
+        payload_name = constants.PAYLOAD_NAMES.get(packet.payload_type,
+                                                   str(packet.payload_type))
+        labels = (payload_name,)
+        self.metrics['whiteshoe_packets_{0}_total'.format(direction)].inc(
+            1, labels)
+        self.metrics['whiteshoe_bytes_{0}_total'.format(direction)].inc(
+            size, labels)
+
 
     def serve(self):
         self.udp_socket.bind(('',self.port))
         self.tcp_socket.bind(('',self.port))
         self.tcp_socket.listen(self.tcp_backlog)
 
+        if hasattr(signal, 'SIGUSR1'):
+            signal.signal(signal.SIGUSR1, self._request_dump)
+            signal.signal(signal.SIGUSR2, self._request_capture)
+
         while True:
             try:
+                self._profiling_requests()
+
                 for game in self.games:
+                    tick_start = time.time()
                     packets = game.tick()
+                    self.metrics['whiteshoe_game_tick_seconds'].observe(
+                        time.time() - tick_start, (game.id,))
                     self._send_packets(packets)
 
                 for network_id in list(self.clients):
@@ -104,29 +274,50 @@ class Server(object):
                     if last_heard.elapsed_seconds > self.timeout:
                         reason = constants.DISCONNECT_TIMEOUT
                         self._disconnect_client(network_id, reason)
+                        continue
 
-                    elif last_sent.elapsed_seconds > constants.KEEPALIVE_TIME:
-                        p = packet_pb2.Packet()
-                        p.packet_id = get_id('packet')
-                        p.payload_type = constants.KEEP_ALIVE
-                        p.timestamp = int(time.time())
-
-                        self._send_packets([(network_id, p)])
+                    if last_sent.elapsed_seconds > constants.KEEPALIVE_TIME:
+                        self._send_keepalive(network_id)
                         # Sending the packets resets the last_sent
                         # stopwatch
 
+                    channel = self.clients[network_id].get('channel')
+                    if channel is not None:
+                        self._check_channel(network_id, channel)
+
                 rlist = [self.udp_socket, self.tcp_socket]
                 rlist.extend(self.client_sockets)
 
-                rlist, wlist, xlist = select.select(rlist,(),(),0.05)
+                wlist = []
+                if self.metrics_endpoint is not None:
+                    rlist.extend(self.metrics_endpoint.rlist())
+                    wlist.extend(self.metrics_endpoint.wlist())
 
-                if self.display_stats:
+                try:
+                    rlist, wlist, xlist = select.select(rlist,wlist,(),0.05)
+                except select.error as e:
+                    # A signal arriving interrupts the select
+                    if e.args[0] != errno.EINTR:
+                        raise
+                    rlist = wlist = []
+
+                if self.display_stats and self.stats_timer.check():
+                    self.stats['inputs_dropped'] = sum(
+                        g.stats['inputs_dropped'] for g in self.games)
                     display_stats(self.stats)
 
+                for ws in wlist:
+                    self.metrics_endpoint.handle_writable(ws)
+
 
                 for rs in rlist:
-                    if rs == self.udp_socket:
-                        data, addr = rs.recvfrom(4096)
+                    if (self.metrics_endpoint is not None and
+                        self.metrics_endpoint.owns(rs)):
+                        self.metrics_endpoint.handle_readable(rs)
+
+                    elif rs == self.udp_socket:
+                        with self.profiler.phase('recv'):
+                            data, addr = rs.recvfrom(4096)
 
                         key = ('UDP', addr)
 
@@ -141,16 +332,23 @@ class Server(object):
                             self.clients[network_id] = {
                                 'last_heard': utility.Stopwatch(start=True),
                                 'last_sent': utility.Stopwatch(start=True),
+                                'channel': reliable.ReliableChannel(),
                             }
 
-                        self.clients[network_id]['last_heard'].restart()
+                        client = self.clients[network_id]
+                        client['last_heard'].restart()
 
 
-                        packet = packet_pb2.Packet.FromString(data)
+                        with self.profiler.phase('decode'):
+                            packet = packet_pb2.Packet.FromString(data)
                         self.stats['packets_recieved'] += 1
                         self.stats['bytes_recieved'] += len(data)
+                        self._count_packet('recieved', packet, len(data))
 
-                        self.handle(packet, network_id)
+                        # Duplicates and stale packets are dropped, and
+                        # critical packets are held until their turn
+                        for packet in client['channel'].receive(packet):
+                            self.handle(packet, network_id)
 
                     elif rs == self.tcp_socket:
                         conn, address = self.tcp_socket.accept()
@@ -176,7 +374,8 @@ class Server(object):
                         disconnect = False
 
                         try:
-                            data = rs.recv(4096)
+                            with self.profiler.phase('recv'):
+                                data = rs.recv(4096)
                         except socket.error as e:
                             disconnect = True
                             logger.error(e)
@@ -194,12 +393,15 @@ class Server(object):
                             client['buffer'] = remaining
 
                             for chunk in chunks:
-                                packet = packet_pb2.Packet.FromString(chunk)
+                                with self.profiler.phase('decode'):
+                                    packet = packet_pb2.Packet.FromString(chunk)
 
                                 self.handle(packet, network_id)
 
                                 self.stats['packets_recieved'] += 1
                                 self.stats['bytes_recieved'] += len(chunk)
+                                self._count_packet('recieved', packet,
+                                                   len(chunk))
 
                         else:
                             # Recieving the empty string means a disconnect
@@ -211,6 +413,13 @@ class Server(object):
                     # Print an extra newline, because of the live statistics
                     print()
                 # TODO Notify all connected clients of server shutdown
+                for game in self.games:
+                    if game.recorder is not None:
+                        game.recorder.close()
+                    if game.vision_pool is not None:
+                        game.vision_pool.close()
+                if self.metrics_endpoint is not None:
+                    self.metrics_endpoint.close()
                 break
 
             except Exception as e:
@@ -223,17 +432,40 @@ class Server(object):
 
     def _send_packets(self, packets):
         for network_id, packet in packets:
-            data = packet.SerializeToString()
-
             if network_id not in self.network_id_bidict:
                 continue
 
             type_, other = self.network_id_bidict[network_id]
 
+            if type_ == 'UDP':
+                # The same packet can be going to several clients, and
+                # each client's copy has its own sequence numbers
+                stamped = packet_pb2.Packet()
+                stamped.CopyFrom(packet)
+                self.clients[network_id]['channel'].stamp(stamped)
+                packet = stamped
+
+            with self.profiler.phase('serialize'):
+                data = packet.SerializeToString()
+
             if type_ == 'TCP':
                 conn = other
+
+                compressor = self.clients[network_id].get('compressor')
+                if compressor is not None and len(data) >= compressor.threshold:
+                    with self.profiler.phase('compress'):
+                        start = time.time()
+                        chunk = utility.stream_wrap(data, compressor)
+                        self.stats['compress_seconds'] += time.time() - start
+                    self.stats['bytes_compressed'] += len(data)
+                    # Less the four byte size in front of the chunk
+                    self.stats['bytes_saved'] += len(data) - (len(chunk) - 4)
+                else:
+                    chunk = utility.stream_wrap(data)
+
                 try:
-                    conn.sendall(utility.stream_wrap(data))
+                    with self.profiler.phase('socket_send'):
+                        conn.sendall(chunk)
                 except socket.error:
                     # TCP sockets are prone to randomly freaking out,
                     # occasionally.
@@ -242,12 +474,75 @@ class Server(object):
 
             elif type_ == 'UDP':
                 addr = other
-                self.udp_socket.sendto(data, addr)
+                with self.profiler.phase('socket_send'):
+                    self.udp_socket.sendto(data, addr)
 
             self.clients[network_id]['last_sent'].restart()
             self.stats['packets_sent'] += 1
             self.stats['bytes_sent'] += len(data)
+            self._count_packet('sent', packet, len(data))
+
 
+    def _send_keepalive(self, network_id):
+        p = packet_pb2.Packet()
+        p.packet_id = get_id('packet')
+        p.payload_type = constants.KEEP_ALIVE
+        p.timestamp = int(time.time())
+
+        self._send_packets([(network_id, p)])
+
+    def _check_channel(self, network_id, channel):
+        # Critical packets that were lost are sent again, but for lost
+        # vision updates, the player is sent everything since the last
+        # update they have.
+        lost_vision = set()
+        resend = []
+        for packet in channel.lost():
+            if reliable.is_critical(packet):
+                resend.append((network_id, packet))
+            else:
+                lost_vision.add(packet.game_id)
+
+        self._send_packets(resend)
+
+        for game in self.games:
+            if game.id in lost_vision and network_id in game.players:
+                self._send_packets(game.resend_vision(network_id))
+
+        if channel.ack_due():
+            self._send_keepalive(network_id)
+
+    def _request_dump(self, signum, frame):
+        self._dump_requested = True
+
+    def _request_capture(self, signum, frame):
+        self._capture_requested = True
+
+    def _profiling_requests(self):
+        # Signal handlers only set flags; the actual work happens here,
+        # at a safe point in the loop.
+        if self._dump_requested:
+            self._dump_requested = False
+            # Start on a fresh line, because of the live statistics
+            sys.stderr.write('\n' + self.profile_report() + '\n')
+            sys.stderr.flush()
+
+        if self._capture_requested:
+            self._capture_requested = False
+            path = 'whiteshoed-{0}.pstats'.format(int(time.time()))
+            self.capture.start(self.capture_seconds, path)
+
+        summary = self.capture.check()
+        if summary is not None:
+            sys.stderr.write('\n' + summary + '\n')
+            sys.stderr.flush()
+
+    def profile_report(self):
+        reports = [self.profiler.format("Server")]
+        for game in self.games:
+            title = "Game {0} ({1})".format(game.id, game.name)
+            reports.append(game.profiler.format(title))
+        return '\n'.join(reports)
 
     def handle(self, packet, network_id):
         # Entry point for new packets that arrive.
@@ -255,6 +550,11 @@ class Server(object):
         # Negative payload type is handled by the server class,
         # a positive payload type is handled by the game class.
 
+        if packet.HasField('vision_ack'):
+            for game in self.games:
+                if network_id in game.players:
+                    game.vision_acked(network_id, packet.vision_ack)
+
         if packet.payload_type > 0:
             found_game = False
 
@@ -310,6 +610,13 @@ class Server(object):
         game_id = get_id('game')
 
         g = Game(max_players,map_generator,game_name,game_mode,game_id)
+        g.defer_flush = True
+        g.input_budget = self.input_budget
+        if self.profiling:
+            g.profiler = profiling.Profiler()
+        if self.vision_processes:
+            g.vision_pool = visionpool.VisionPool(g.world, g.vision,
+                                                  self.vision_processes)
         if packet.join_new_game:
             packets = g.player_join(network_id)
             self._send_packets(packets)
@@ -335,7 +642,12 @@ class Server(object):
         pass
 
     def _keep_alive(self, packet, network_id):
-        pass
+        type_, other = self.network_id_bidict[network_id]
+        client = self.clients[network_id]
+        if (packet.compression and self.compression and type_ == 'TCP' and
+            'compressor' not in client):
+            # The client can decompress what we send from now on
+            client['compressor'] = utility.StreamCompressor()
 
     def _disconnect_packet(self, packet, network_id):
         self._disconnect_client(network_id, packet.disconnect_code or None)
@@ -378,6 +690,12 @@ def display_stats(stats):
                    stats['packets_recieved'],
                    bytes_to_human(stats['bytes_sent']),
                    bytes_to_human(stats['bytes_recieved']))
+    if stats['bytes_compressed']:
+        s += ", Compression saved: {0} ({1:.0f}ms)".format(
+            bytes_to_human(stats['bytes_saved']),
+            stats['compress_seconds'] * 1000)
+    if stats['inputs_dropped']:
+        s += ", Inputs dropped: {0}".format(stats['inputs_dropped'])
 
     sys.stderr.write(s)
     sys.stderr.flush()
@@ -0,0 +1,318 @@
+from __future__ import print_function
+
+import argparse
+import heapq
+import random
+import select
+import socket
+import sys
+import time
+import logging
+
+import constants
+import client
+import bot
+import utility
+
+logger = logging.getLogger(__name__)
+
+# How long we wait for the server to acknowledge a command before we give
+# up on it and count it as unanswered.
+LATENCY_WINDOW = 1.0
+
+def swarm_main(args=None):
+    p = argparse.ArgumentParser(
+        description="Run a swarm of bots against a server, for load testing")
+    p.add_argument('-c','--connect',default="::1",dest='ipaddr')
+    p.add_argument('-p','--port',type=int,default=constants.DEFAULT_PORT)
+    p.add_argument('-n','--bots',type=int,default=100)
+    p.add_argument('-b','--behaviour',action='append',default=[],
+                   help="name[=weight], can be given multiple times")
+    p.add_argument('-r','--rate',type=float,default=5.0,
+                   help="actions per second, per bot")
+    p.add_argument('-u','--udp',type=float,default=0.0,
+                   help="fraction of bots that connect over UDP")
+    p.add_argument('--ramp',type=float,default=50.0,
+                   help="bots connected per second")
+    p.add_argument('-t','--duration',type=float,default=None)
+    p.add_argument('--report',type=float,default=5.0,
+                   help="seconds between reports")
+    p.add_argument('--seed',type=int,default=None)
+    ns = p.parse_args(args)
+
+    mix = []
+    for behaviour_string in ns.behaviour or ['hunter']:
+        if '=' not in behaviour_string:
+            mix.append((behaviour_string, 1.0))
+        else:
+            parts = behaviour_string.split('=')
+            assert len(parts) == 2
+
+            mix.append((parts[0], float(parts[1])))
+
+    for name, weight in mix:
+        if name not in bot.behaviours:
+            p.error("Unknown behaviour: {0}".format(name))
+
+    s = Swarm((ns.ipaddr, ns.port), ns.bots, mix, rate=ns.rate,
+              udp_fraction=ns.udp, ramp=ns.ramp, seed=ns.seed)
+    try:
+        s.run(duration=ns.duration, report_period=ns.report)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        s.shutdown()
+        s.report(final=True)
+
+class SwarmMember(object):
+    def __init__(self, bot):
+        self.bot = bot
+        # When the action being timed was sent, and its action_sequence
+        self.sent_at = None
+        self.sent_sequence = None
+        self.connected = False
+
+class Swarm(object):
+    def __init__(self, addr, number, mix, rate=5.0, udp_fraction=0.0,
+                 ramp=50.0, seed=None):
+        self.addr = addr
+        self.number = number
+        self.rate = rate
+        self.ramp = ramp
+
+        self.random = random.Random(seed)
+
+        total_weight = sum(weight for name, weight in mix)
+
+        self.members = []
+        for i in range(number):
+            # Pick a behaviour, weighted
+            choice = self.random.uniform(0, total_weight)
+            for name, weight in mix:
+                choice -= weight
+                if choice <= 0:
+                    break
+
+            if self.random.random() < udp_fraction:
+                socket_type = 'udp'
+            else:
+                socket_type = 'tcp'
+
+            b = bot.Bot(addr, None, socket_type=socket_type, behaviour=name,
+                        name='Swarm{0}'.format(i),
+                        rng=random.Random(self.random.random()))
+            self.members.append(SwarmMember(b))
+
+        self.by_fd = {}
+        if hasattr(select, 'poll'):
+            self.poller = select.poll()
+        else:
+            self.poller = None
+
+        # Heap of (next think time, member index)
+        self.thinking = []
+
+        self.dropped = 0
+        self.actions = 0
+        self.unanswered = 0
+        self.latencies = []
+
+        self.stopwatch = utility.Stopwatch(start=True)
+        self.last_report = 0.0
+        self.last_totals = self._totals()
+
+    def _connect(self, index, now):
+        member = self.members[index]
+        try:
+            member.bot.start()
+        except socket.error as e:
+            logger.error(e)
+            self.dropped += 1
+            return
+
+        member.connected = True
+        # Latency is timed until the server acknowledges the action
+        member.bot.network.number_actions = True
+
+        fd = member.bot.network.fileno()
+        self.by_fd[fd] = member
+        if self.poller is not None:
+            self.poller.register(fd, select.POLLIN)
+
+        # Spread the thinking out, so we don't get everyone acting at once
+        next_think = now + self.random.uniform(0, 1.0 / self.rate)
+        heapq.heappush(self.thinking, (next_think, index))
+
+    def _drop(self, member):
+        member.connected = False
+        self.dropped += 1
+
+        fd = member.bot.network.fileno()
+        if self.poller is not None:
+            self.poller.unregister(fd)
+        del self.by_fd[fd]
+
+    def _poll(self, timeout):
+        if self.poller is not None:
+            return [fd for fd, event in self.poller.poll(timeout * 1000)]
+        elif self.by_fd:
+            rlist, wlist, xlist = select.select(list(self.by_fd),(),(),timeout)
+            return rlist
+        else:
+            time.sleep(timeout)
+            return []
+
+    def run(self, duration=None, report_period=5.0):
+        connected = 0
+
+        while True:
+            now = time.time()
+            elapsed = self.stopwatch.elapsed_seconds
+
+            if duration is not None and elapsed > duration:
+                break
+
+            # Bring more bots into the world, at the ramp rate
+            should_be_connected = min(self.number, int(elapsed * self.ramp) + 1)
+            while connected < should_be_connected:
+                self._connect(connected, now)
+                connected += 1
+
+            if self.thinking:
+                timeout = self.thinking[0][0] - now
+            else:
+                timeout = 0.05
+            timeout = min(max(timeout, 0), 0.05)
+
+            for fd in self._poll(timeout):
+                member = self.by_fd.get(fd)
+                if member is None:
+                    continue
+                network = member.bot.network
+                try:
+                    network.handle_readable()
+                except (client.ClientException, socket.error):
+                    self._drop(member)
+                    continue
+
+                if (member.sent_at is not None and
+                    network.acked_sequence >= member.sent_sequence):
+                    latency = time.time() - member.sent_at
+                    if latency > LATENCY_WINDOW:
+                        self.unanswered += 1
+                    else:
+                        self.latencies.append(latency)
+                    member.sent_at = None
+
+            now = time.time()
+            while self.thinking and self.thinking[0][0] <= now:
+                next_think, index = heapq.heappop(self.thinking)
+                member = self.members[index]
+                if not member.connected:
+                    continue
+
+                self._think(member, now)
+
+                # Jitter the period a bit so the bots stay spread out
+                period = self.random.uniform(0.5, 1.5) / self.rate
+                heapq.heappush(self.thinking, (next_think + period, index))
+
+            if elapsed - self.last_report >= report_period:
+                self.report()
+
+    def _think(self, member, now):
+        network = member.bot.network
+
+        if (member.sent_at is not None and
+            now - member.sent_at > LATENCY_WINDOW):
+            self.unanswered += 1
+            member.sent_at = None
+
+        try:
+            network.check_timers()
+        except (client.ClientException, socket.error):
+            self._drop(member)
+            return
+
+        # Keepalives and resends don't count as actions
+        before = network.action_sequence
+        try:
+            member.bot.think()
+        except client.NotInGame:
+            # Haven't heard our GAMEINFO yet
+            pass
+        except (client.ClientException, socket.error):
+            self._drop(member)
+            return
+
+        if network.action_sequence > before:
+            self.actions += 1
+            if member.sent_at is None:
+                member.sent_at = now
+                member.sent_sequence = network.action_sequence
+
+    def _totals(self):
+        totals = {'bytes_sent': 0, 'bytes_recieved': 0}
+        for member in self.members:
+            if member.bot.network is None:
+                continue
+            for key in totals:
+                totals[key] += member.bot.network.stats[key]
+        return totals
+
+    def report(self, final=False):
+        elapsed = self.stopwatch.elapsed_seconds
+        period = (elapsed - self.last_report) or 1e-9
+
+        totals = self._totals()
+        alive = sum(1 for member in self.members if member.connected)
+
+        def per_bot(key):
+            rate = (totals[key] - self.last_totals[key]) / period
+            return _rate_to_human(rate / (alive or 1))
+
+        latencies = sorted(self.latencies)
+        def ms(fraction):
+            value = utility.percentile(latencies, fraction)
+            if value is None:
+                return '-'
+            return "{0:.1f}".format(value * 1000)
+
+        fmt = ("[{elapsed:7.1f}s] bots: {alive} ({dropped} dropped) "
+               "actions/s: {actions:.0f} "
+               "latency ms p50: {p50} p90: {p90} p99: {p99} max: {max} "
+               "(unanswered: {unanswered}) "
+               "per bot up: {up} down: {down}")
+        line = fmt.format(elapsed=elapsed,
+                          alive=alive,
+                          dropped=self.dropped,
+                          actions=self.actions / period,
+                          p50=ms(0.5), p90=ms(0.9), p99=ms(0.99), max=ms(1.0),
+                          unanswered=self.unanswered,
+                          up=per_bot('bytes_sent'),
+                          down=per_bot('bytes_recieved'))
+        if final:
+            line += " (final)"
+        print(line)
+        sys.stdout.flush()
+
+        self.last_report = elapsed
+        self.last_totals = totals
+        self.actions = 0
+        self.unanswered = 0
+        self.latencies = []
+
+    def shutdown(self):
+        for member in self.members:
+            if member.connected:
+                try:
+                    member.bot.network.shutdown()
+                except socket.error:
+                    pass
+
+def _rate_to_human(rate):
+    # utility.bytes_to_human only likes whole numbers of bytes
+    return utility.bytes_to_human(int(rate)) + "/s"
+
+if __name__=='__main__':
+    swarm_main()
@@ -0,0 +1,53 @@
+import socket
+import unittest
+
+import client
+import constants
+import packet_pb2
+import utility
+
+def keyvalue_packet(key, value):
+    p = packet_pb2.Packet()
+    p.packet_id = 1
+    p.payload_type = constants.KEYVALUE
+    p.keyvalues.extend([key, value])
+    return p.SerializeToString()
+
+class ReconnectTest(unittest.TestCase):
+    def setUp(self):
+        self.network = client.ClientNetwork(compression=True)
+        self.network.socket, self.server = socket.socketpair()
+
+    def tearDown(self):
+        self.network.socket.close()
+        self.server.close()
+
+    def receive(self, data):
+        self.server.sendall(data)
+        self.network.handle_readable()
+
+    def test_new_connection_starts_afresh(self):
+        network = self.network
+        compressor = utility.StreamCompressor(threshold=1)
+
+        self.receive(utility.stream_wrap(keyvalue_packet('a', 'x' * 100),
+                                         compressor))
+        # Cut off partway through a chunk
+        data = utility.stream_wrap(keyvalue_packet('b', 'y' * 100),
+                                   compressor)
+        self.receive(data[:len(data) // 2])
+        network.vision_sequence = network.vision_complete = 5
+
+        network._new_connection()
+        self.assertEqual(network.vision_sequence, 0)
+        self.assertEqual(network.vision_complete, 0)
+
+        # The new server's stream has its own compression context
+        compressor = utility.StreamCompressor(threshold=1)
+        self.receive(utility.stream_wrap(keyvalue_packet('c', 'x' * 100),
+                                         compressor))
+        self.assertEqual(network.keyvalues['c'], 'x' * 100)
+        self.assertFalse('b' in network.keyvalues)
+
+if __name__=='__main__':
+    unittest.main()
@@ -0,0 +1,51 @@
+import unittest
+
+import constants
+import events
+
+class EventBusTest(unittest.TestCase):
+    def test_overflow_drops_oldest(self):
+        bus = events.EventBus(maxlen=4)
+        for i in range(7):
+            bus.publish(1, events.Damaged(i, constants.DAMAGETYPE_UNKNOWN))
+        bus.publish(2, events.Death(0, constants.DAMAGETYPE_UNKNOWN))
+
+        self.assertEqual(bus.dropped, 3)
+        self.assertEqual(len(bus), 5)
+
+        drained = dict(bus.drain())
+        self.assertEqual([event.responsible for event in drained[1]],
+                         [3, 4, 5, 6])
+        self.assertEqual(len(drained[2]), 1)
+        self.assertEqual(len(bus), 0)
+        self.assertEqual(bus.drain(), [])
+
+    def test_forget(self):
+        bus = events.EventBus()
+        bus.publish(1, events.Damaged(0, constants.DAMAGETYPE_UNKNOWN))
+        bus.forget(1)
+        bus.forget(2)
+        self.assertEqual(bus.drain(), [])
+
+class CoalesceTest(unittest.TestCase):
+    def test_latest_of_each_status(self):
+        queued = [events.Damaged(1, constants.DAMAGETYPE_STAB),
+                  events.Death(2, constants.DAMAGETYPE_EXPLOSION),
+                  events.Damaged(3, constants.DAMAGETYPE_LAVA)]
+
+        # Damage before death, whatever order they happened in
+        self.assertEqual(events.coalesce(queued),
+                         [events.Damaged(3, constants.DAMAGETYPE_LAVA),
+                          events.Death(2, constants.DAMAGETYPE_EXPLOSION)])
+
+    def test_ties_go_to_latest(self):
+        queued = [events.Death(1, constants.DAMAGETYPE_STAB),
+                  events.Death(2, constants.DAMAGETYPE_STAB)]
+        self.assertEqual(events.coalesce(queued),
+                         [events.Death(2, constants.DAMAGETYPE_STAB)])
+
+    def test_nothing(self):
+        self.assertEqual(events.coalesce([]), [])
+
+if __name__=='__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+import unittest
+
+import constants
+import game
+import objects
+import utility
+
+class ExplosionTest(unittest.TestCase):
+    def setUp(self):
+        self.game = game.modes['ffa'](map_generator='depth_first',
+                                      vision='cone')
+
+    def test_blast_destroys_whole_colony(self):
+        g = self.game
+        centre = sorted(g.world)[len(g.world) // 2]
+        cells = [coord for coord in utility.cardinal_neighbourhood(centre)
+                 if coord in g.world]
+        cells.append(centre)
+
+        colony = objects.Slime(constants.ORIGIN_UNKNOWN,
+                               constants.SMALL_SLIME)
+        for coord in cells:
+            g._occupy_with_slime(colony, coord)
+        g.slimes.append(colony)
+
+        # Covers the centre and every cell around it
+        g._make_explosion(centre, 2)
+        g._tick_explosions(0.0)
+
+        for coord in cells:
+            slimed = [obj for obj in g.world[coord]
+                      if obj.type == constants.OBJ_SLIME]
+            self.assertEqual(slimed, [], coord)
+        self.assertEqual(colony.cells, set())
+
+class InputQueueTest(unittest.TestCase):
+    def setUp(self):
+        self.game = game.modes['ffa'](map_generator='depth_first',
+                                      vision='cone')
+        self.game.input_budget = 2
+        self.game.defer_flush = True
+        self.game.player_join(0, 'queued')
+
+    def queue(self, number, start=1):
+        look = constants.to_numerical_constant(constants.CMD_LOOK)
+        north = constants.to_numerical_constant(constants.UP)
+        for sequence in range(start, start + number):
+            self.game._queue_action(0, look, north, sequence)
+
+    def queued(self):
+        return len(self.game._inputs.get(0, ()))
+
+    def test_budget_per_period(self):
+        self.queue(6)
+        self.game.tick(0.0)
+        self.assertEqual(self.queued(), 4)
+
+        # However often the server goes round its loop
+        for i in range(10):
+            self.game.tick(0.0)
+        self.assertEqual(self.queued(), 4)
+
+        self.game.tick(constants.INPUT_PERIOD)
+        self.assertEqual(self.queued(), 2)
+        self.assertEqual(self.game.action_sequences[0], 4)
+
+    def test_dropped_acknowledged_by_last(self):
+        self.queue(constants.INPUT_QUEUE_LENGTH + 3)
+        self.assertEqual(self.game.stats['inputs_dropped'], 3)
+        self.assertEqual(self.game._inputs[0][-1][2],
+                         constants.INPUT_QUEUE_LENGTH + 3)
+
+        # An older action arriving late doesn't take the ack back
+        self.queue(1, start=1)
+        self.assertEqual(self.game._inputs[0][-1][2],
+                         constants.INPUT_QUEUE_LENGTH + 3)
+
+if __name__=='__main__':
+    unittest.main()
@@ -0,0 +1,74 @@
+import random
+import unittest
+
+import constants
+import navigation
+
+class DistanceFieldTest(unittest.TestCase):
+    def setUp(self):
+        self.random = random.Random(0)
+        self.size = 20
+        self.world = {}
+        for x in range(self.size):
+            for y in range(self.size):
+                self.world[(x, y)] = self.random_cell()
+        self.grid = navigation.NavigationGrid(self.world)
+
+    def random_cell(self):
+        if self.random.random() < 0.3:
+            return [(constants.OBJ_WALL, {})]
+        return [(constants.OBJ_EMPTY, {})]
+
+    def random_coords(self, number):
+        return [(self.random.randrange(self.size),
+                 self.random.randrange(self.size)) for i in range(number)]
+
+    def assertFresh(self, field):
+        fresh = navigation.DistanceField(self.grid, field.targets)
+        self.assertEqual(field.distances, fresh.distances)
+
+    def test_repair(self):
+        field = self.grid.distance_field(self.random_coords(3))
+
+        for i in range(200):
+            # Walls built and knocked down, a few at a time
+            changed = self.random_coords(self.random.randint(1, 4))
+            for coord in changed:
+                self.world[coord] = self.random_cell()
+            self.grid.update(self.world, changed)
+            self.assertFresh(field)
+
+    def test_unknown_cells(self):
+        targets = self.random_coords(2)
+        field = self.grid.distance_field(targets)
+
+        forgotten = self.random_coords(30)
+        for coord in forgotten:
+            self.world.pop(coord, None)
+        self.grid.update(self.world, forgotten)
+        self.assertFresh(field)
+
+    def test_moving_targets(self):
+        targets = self.random_coords(3)
+        field = self.grid.distance_field(targets, key='enemies')
+
+        for i in range(100):
+            # Each target wanders a step, or goes out of sight
+            moved = []
+            for x, y in targets:
+                if self.random.random() < 0.1:
+                    continue
+                dx, dy = self.random.choice(constants.DIFFS.values())
+                moved.append((x + dx, y + dy))
+            targets = moved or self.random_coords(1)
+
+            self.assertTrue(
+                self.grid.distance_field(targets, key='enemies') is field)
+            self.assertEqual(field.targets, frozenset(targets))
+            self.assertFresh(field)
+
+        # Only the one field, however many places they have been
+        self.assertEqual(len(self.grid._fields), 1)
+
+if __name__=='__main__':
+    unittest.main()
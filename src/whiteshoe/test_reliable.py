@@ -0,0 +1,198 @@
+import random
+import unittest
+
+import constants
+import packet_pb2
+import reliable
+
+class LossyLink(object):
+    """Carries serialized packets one way, dropping, duplicating and
+    delaying some of them"""
+    def __init__(self, rng, loss=0.2, duplicate=0.1, delay=0.1):
+        self.random = rng
+        self.loss = loss
+        self.duplicate = duplicate
+        self.delay = delay
+        self.in_flight = []
+        self.carried = []
+
+    def send(self, packet, now):
+        self.carried.append(packet.payload_type)
+        if self.random.random() < self.loss:
+            return
+        copies = 2 if self.random.random() < self.duplicate else 1
+        for i in range(copies):
+            arrives = now + self.random.uniform(0, self.delay)
+            self.in_flight.append((arrives, packet.SerializeToString()))
+
+    def arrived(self, now):
+        ready = [item for item in self.in_flight if item[0] <= now]
+        self.in_flight = [item for item in self.in_flight if item[0] > now]
+        return [packet_pb2.Packet.FromString(data)
+                for arrives, data in sorted(ready)]
+
+def make_packet(payload_type, packet_id):
+    p = packet_pb2.Packet()
+    p.packet_id = packet_id
+    p.payload_type = payload_type
+    return p
+
+class Conversation(object):
+    """Two channels talking over lossy links, with each end resending
+    its lost critical packets, as the server and client do"""
+    def __init__(self, seed=0, **link_options):
+        rng = random.Random(seed)
+        self.a = reliable.ReliableChannel()
+        self.b = reliable.ReliableChannel()
+        self.a_to_b = LossyLink(rng, **link_options)
+        self.b_to_a = LossyLink(rng, **link_options)
+        self.received = []
+        self.lost = []
+        self.now = 0.0
+
+    def send(self, packet):
+        self.a.stamp(packet, self.now)
+        self.a_to_b.send(packet, self.now)
+
+    def step(self, dt=0.01):
+        self.now += dt
+        now = self.now
+
+        for packet in self.a_to_b.arrived(now):
+            self.received.extend(
+                handled for handled in self.b.receive(packet, now)
+                if handled.payload_type != constants.KEEP_ALIVE)
+        for packet in self.b_to_a.arrived(now):
+            self.a.receive(packet, now)
+
+        for packet in self.a.lost(now):
+            self.lost.append(packet)
+            if reliable.is_critical(packet):
+                self.send(packet)
+
+        for channel, link in ((self.a, self.a_to_b), (self.b, self.b_to_a)):
+            if channel.ack_due(now):
+                keepalive = make_packet(constants.KEEP_ALIVE, 0)
+                channel.stamp(keepalive, now)
+                link.send(keepalive, now)
+
+    def settle(self, limit=60.0):
+        end = self.now + limit
+        while self.now < end:
+            self.step()
+            if (not self.a.sent and not self.a_to_b.in_flight and
+                not self.b_to_a.in_flight):
+                return
+        raise AssertionError("Conversation didn't settle")
+
+class SequenceDiffTest(unittest.TestCase):
+    def test_diff(self):
+        self.assertEqual(reliable.sequence_diff(5, 3), 2)
+        self.assertEqual(reliable.sequence_diff(3, 5), -2)
+        self.assertEqual(reliable.sequence_diff(2, 2**32 - 3), 5)
+        self.assertEqual(reliable.sequence_diff(2**32 - 3, 2), -5)
+
+class ReliableChannelTest(unittest.TestCase):
+    def send_critical(self, conversation, number):
+        for packet_id in range(number):
+            conversation.send(make_packet(constants.GAME_STATUS, packet_id))
+            conversation.step()
+        conversation.settle()
+        return [packet.packet_id for packet in conversation.received]
+
+    def test_critical_arrive_once_in_order(self):
+        conversation = Conversation(seed=1)
+        received = self.send_critical(conversation, 300)
+
+        self.assertEqual(received, range(300))
+        # It wasn't a good link
+        self.assertTrue(conversation.lost)
+        self.assertTrue(conversation.b.duplicates)
+
+    def test_latest_not_resent(self):
+        conversation = Conversation(seed=2)
+        for packet_id in range(300):
+            conversation.send(make_packet(constants.VISION_UPDATE, packet_id))
+            conversation.step()
+        conversation.settle()
+
+        # Lost updates are reported to the owner, but nothing is put
+        # on the link again
+        self.assertTrue(conversation.lost)
+        vision = [t for t in conversation.a_to_b.carried
+                  if t == constants.VISION_UPDATE]
+        self.assertEqual(len(vision), 300)
+
+        # Only the latest news is handled, so never an older update
+        received = [packet.packet_id for packet in conversation.received]
+        self.assertEqual(received, sorted(set(received)))
+        self.assertTrue(len(received) < 300)
+
+    def test_stale_after_missing_critical(self):
+        a = reliable.ReliableChannel()
+        b = reliable.ReliableChannel()
+
+        status = make_packet(constants.GAME_STATUS, 1)
+        a.stamp(status, 0.0)
+        vision = make_packet(constants.VISION_UPDATE, 2)
+        a.stamp(vision, 0.0)
+
+        # The vision update follows a status that hasn't arrived, so it
+        # can't be handled yet
+        self.assertEqual(b.receive(vision, 0.0), [])
+        self.assertEqual(b.stale, 1)
+        self.assertEqual([p.packet_id for p in b.receive(status, 0.0)], [1])
+
+    def test_wraparound(self):
+        conversation = Conversation(seed=3)
+        # The far end only sends acks, so it starts nearer the end
+        start = 2**32 - 100
+        conversation.a.sequence = start
+        conversation.a.reliable_sequence = start
+        conversation.b.delivered = start
+        conversation.b.sequence = 2**32 - 5
+
+        received = self.send_critical(conversation, 300)
+
+        self.assertEqual(received, range(300))
+        # Both ends have gone past 2**32 and started again
+        self.assertTrue(conversation.a.sequence < start)
+        self.assertTrue(conversation.b.sequence < start)
+        self.assertEqual(conversation.a.sent, {})
+
+    def test_duplicate_dropped(self):
+        a = reliable.ReliableChannel()
+        b = reliable.ReliableChannel()
+
+        packet = make_packet(constants.KEYVALUE, 1)
+        a.stamp(packet, 0.0)
+        self.assertEqual(len(b.receive(packet, 0.0)), 1)
+        self.assertEqual(b.receive(packet, 0.0), [])
+        self.assertEqual(b.duplicates, 1)
+
+    def test_acked_packets_not_lost(self):
+        a = reliable.ReliableChannel()
+        b = reliable.ReliableChannel()
+
+        # More packets than ACK_WINDOW, every other one arriving
+        for packet_id in range(constants.ACK_WINDOW * 2):
+            packet = make_packet(constants.GAME_STATUS, packet_id)
+            a.stamp(packet, 0.0)
+            if packet_id % 2 == 0:
+                b.receive(packet, 0.0)
+
+        reply = make_packet(constants.KEEP_ALIVE, 0)
+        b.stamp(reply, 0.0)
+        a.receive(reply, 0.0)
+
+        lost = a.lost(constants.RESEND_TIME)
+        lost_ids = [packet.packet_id for packet in lost]
+        # What arrived is acknowledged, as far back as the window goes
+        newest = constants.ACK_WINDOW * 2 - 2
+        oldest_acked = newest - constants.ACK_WINDOW
+        expected = [packet_id for packet_id in range(constants.ACK_WINDOW * 2)
+                    if packet_id % 2 or packet_id < oldest_acked]
+        self.assertEqual(lost_ids, expected)
+
+if __name__=='__main__':
+    unittest.main()
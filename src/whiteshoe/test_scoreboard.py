@@ -0,0 +1,107 @@
+import random
+import unittest
+
+import client
+import constants
+import game
+import packet_pb2
+import scoreboard
+
+def sorted_ranking(scores):
+    # Best first, ties broken by player_id, worked out from scratch
+    return sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+
+class ScoreboardTest(unittest.TestCase):
+    def test_ranking_stays_sorted(self):
+        rng = random.Random(0)
+        board = scoreboard.Scoreboard()
+        scores = {}
+
+        for i in range(1000):
+            player_id = rng.randrange(20)
+            choice = rng.random()
+            if choice < 0.1:
+                board.remove(player_id)
+                scores.pop(player_id, None)
+            elif choice < 0.5:
+                # A small range of scores, so there are plenty of ties
+                score = rng.randint(-3, 3)
+                board.set(player_id, score)
+                scores[player_id] = score
+            else:
+                delta = rng.choice((-1, 1))
+                board.add(player_id, delta)
+                scores[player_id] = scores.get(player_id, 0) + delta
+
+            expected = sorted_ranking(scores)
+            self.assertEqual(board.top(), expected)
+            self.assertEqual(board.top(3), expected[:3])
+            for rank, (player_id, score) in enumerate(expected, 1):
+                self.assertEqual(board.rank(player_id), rank)
+
+    def test_changes(self):
+        board = scoreboard.Scoreboard()
+        board.set(1, 5)
+        board.set(2, 5)
+        board.set(2, 5)
+        board.add(3, 0)
+        board.remove(1)
+        self.assertEqual(board.pop_changes(), [(2, 5), (3, 0)])
+        self.assertEqual(board.pop_changes(), [])
+
+class ScoreDeltasTest(unittest.TestCase):
+    """Scores from a game, followed by a client through the packed
+    score_deltas it's sent"""
+    def setUp(self):
+        self.game = game.modes['ffa'](map_generator='depth_first',
+                                      vision='cone')
+        self.network = client.ClientNetwork()
+        self.random = random.Random(1)
+        self.player_ids = []
+        for player_id in range(8):
+            self.join(player_id)
+
+    def deliver(self, packets):
+        for player_id, packet in packets:
+            if player_id != 0:
+                continue
+            packet = packet_pb2.Packet.FromString(packet.SerializeToString())
+            self.network.handlers[packet.payload_type](packet)
+
+    def join(self, player_id):
+        self.deliver(self.game.player_join(player_id, 'p%d' % player_id))
+        self.player_ids.append(player_id)
+
+    def assertFollowing(self):
+        expected = sorted_ranking(dict(self.game.scores.items()))
+        self.assertEqual(self.network.scoreboard.top(), expected)
+
+    def test_client_follows_game(self):
+        next_id = len(self.player_ids)
+        tied = False
+
+        for i in range(200):
+            if self.random.random() < 0.05:
+                # Someone leaves, and someone else takes their place
+                leaving = self.random.choice(self.player_ids[1:])
+                self.player_ids.remove(leaving)
+                self.deliver(self.game.player_leave(leaving))
+                self.assertFalse(leaving in self.network.scoreboard)
+                self.join(next_id)
+                next_id += 1
+            else:
+                victim, responsible = self.random.sample(self.player_ids, 2)
+                self.game._kill_player(victim, responsible,
+                                       constants.DAMAGETYPE_UNKNOWN)
+
+            self.deliver(self.game.tick(constants.SCORES_PERIOD))
+            self.assertFollowing()
+
+            scores = [score for player_id, score in self.game.scores.items()]
+            tied = tied or len(set(scores)) < len(scores)
+
+        # There were ties to sort out
+        self.assertTrue(tied)
+
+if __name__=='__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+import random
+import struct
+import unittest
+import zlib
+
+import utility
+
+class StreamTest(unittest.TestCase):
+    def setUp(self):
+        rng = random.Random(0)
+        # Small chunks, and large repetitive ones worth compressing
+        self.chunks = []
+        for i in range(50):
+            size = rng.choice((1, 10, 100, 1000, 5000))
+            self.chunks.append(''.join(chr(rng.randint(0, 3))
+                                       for j in range(size)))
+        self.chunks.append('')
+
+    def wrap(self, compressor=None):
+        return ''.join(utility.stream_wrap(chunk, compressor)
+                       for chunk in self.chunks)
+
+    def unwrap(self, stream, read_size):
+        # As the client does, a socket read at a time
+        decompressobj = zlib.decompressobj()
+        buffer = ''
+        unwrapped = []
+        for i in range(0, len(stream), read_size):
+            buffer += stream[i:i + read_size]
+            chunks, buffer = utility.stream_unwrap(buffer, decompressobj)
+            unwrapped.extend(chunks)
+        self.assertEqual(buffer, '')
+        return unwrapped
+
+    def sizes(self, stream):
+        sizes = []
+        while stream:
+            size = struct.unpack('>L', stream[:4])[0]
+            sizes.append(size)
+            stream = stream[4 + (size & ~(1 << 31)):]
+        return sizes
+
+    def test_uncompressed(self):
+        stream = self.wrap()
+        self.assertFalse([size for size in self.sizes(stream)
+                          if size & (1 << 31)])
+        self.assertEqual(self.unwrap(stream, len(stream)), self.chunks)
+
+    def test_compressed(self):
+        compressor = utility.StreamCompressor(threshold=100)
+        stream = self.wrap(compressor)
+
+        flagged = [bool(size & (1 << 31)) for size in self.sizes(stream)]
+        self.assertEqual(flagged, [len(chunk) >= 100 for chunk in self.chunks])
+        self.assertTrue(len(stream) < len(self.wrap()))
+        self.assertEqual(self.unwrap(stream, len(stream)), self.chunks)
+
+    def test_split_reads(self):
+        for compressor in (None, utility.StreamCompressor(threshold=100)):
+            stream = self.wrap(compressor)
+            # Sizes and chunks spread over several reads
+            for read_size in (1, 3, 4096):
+                self.assertEqual(self.unwrap(stream, read_size), self.chunks)
+
+if __name__=='__main__':
+    unittest.main()
@@ -0,0 +1,194 @@
+import unittest
+
+import client
+import constants
+import game
+import packet_pb2
+
+def normalise(known_world):
+    # The server's attributes are (key, value) pairs, the client's dicts
+    return dict((coord, [(obj_type, dict(attrs)) for obj_type, attrs in cell])
+                for coord, cell in known_world.items())
+
+class VisionSyncTest(unittest.TestCase):
+    """A game and one client, with vision updates passed between them by
+    hand, so that some can go missing"""
+    def setUp(self):
+        self.game = game.modes['ffa'](map_generator='depth_first',
+                                      vision='cone')
+        self.network = client.ClientNetwork()
+        self.player_id = 0
+
+        self.deliver(self.game.player_join(self.player_id, 'vision'))
+        self.ack()
+
+    def deliver(self, packets, drop=()):
+        """Hands the packets to the client, except the VISION_UPDATEs
+        with a vision_sequence in drop. Returns the sequences sent."""
+        sequences = set()
+        for player_id, packet in packets:
+            if player_id != self.player_id:
+                continue
+            packet = packet_pb2.Packet.FromString(packet.SerializeToString())
+            if packet.payload_type == constants.VISION_UPDATE:
+                sequences.add(packet.vision_sequence)
+                if packet.vision_sequence in drop:
+                    continue
+            self.network.handlers[packet.payload_type](packet)
+        return sequences
+
+    def ack(self):
+        # As carried by the client's next packet
+        self.game.vision_acked(self.player_id, self.network.vision_complete)
+
+    def act(self, cmd, arg, drop=False):
+        packets = self.game.player_action(
+            self.player_id, constants.to_numerical_constant(cmd),
+            constants.to_numerical_constant(arg))
+        history = self.game.vision_history[self.player_id]
+        if drop:
+            return self.deliver(packets, drop=(history.sequence,))
+        return self.deliver(packets)
+
+    def turn(self, drop=False):
+        # Looking somewhere else always changes something
+        coord, player = self.game._find_player(self.player_id)
+        directions = list(constants.DIRECTIONS)
+        arg = directions[(directions.index(player.direction) + 1) % 4]
+        return self.act(constants.CMD_LOOK, arg, drop=drop)
+
+    def assertInSync(self):
+        self.assertEqual(
+            normalise(self.network.known_world),
+            normalise(self.game.known_worlds[self.player_id]))
+
+    def test_joined_in_sync(self):
+        self.assertInSync()
+        self.assertTrue(self.network.vision_complete > 0)
+
+    def test_lost_update_carried_by_next(self):
+        history = self.game.vision_history[self.player_id]
+        baseline = history.baseline
+
+        lost = self.turn(drop=True)
+        self.assertTrue(lost)
+        self.assertNotEqual(
+            normalise(self.network.known_world),
+            normalise(self.game.known_worlds[self.player_id]))
+
+        # The next update goes from the acknowledged baseline, so it
+        # brings the lost changes with it
+        self.turn()
+        self.assertInSync()
+        self.assertEqual(self.network.vision_complete, history.sequence)
+
+        self.ack()
+        self.assertTrue(history.baseline > baseline)
+
+    def test_lost_update_resent(self):
+        self.turn(drop=True)
+        self.turn(drop=True)
+
+        self.deliver(self.game.resend_vision(self.player_id))
+        self.assertInSync()
+
+    def test_acked_update_not_resent(self):
+        self.turn()
+        self.ack()
+        history = self.game.vision_history[self.player_id]
+        self.assertEqual(history.outstanding(), set())
+        self.assertEqual(self.game.resend_vision(self.player_id), [])
+
+    def test_too_far_behind_resyncs(self):
+        for i in range(constants.VISION_HISTORY + 1):
+            self.turn(drop=True)
+
+        history = self.game.vision_history[self.player_id]
+        self.assertEqual(history.outstanding(), None)
+
+        packets = self.game.resend_vision(self.player_id)
+        self.assertTrue(packets[0][1].clear_all)
+        self.deliver(packets)
+        self.assertInSync()
+
+    def test_forgotten_cells(self):
+        known_before = set(self.game.known_worlds[self.player_id])
+
+        # Dying forgets everything that was known
+        self.game._kill_player(self.player_id, constants.ORIGIN_ENVIRONMENT,
+                               constants.DAMAGETYPE_UNKNOWN)
+        history = self.game.vision_history[self.player_id]
+        lost = history.sequence + 1
+        self.assertEqual(self.deliver(self.game.flush(), drop=(lost,)),
+                         set((lost,)))
+        self.assertTrue(set(self.network.known_world) & known_before)
+
+        # The forgetting was lost, so the next delta covers it
+        self.turn()
+        self.assertInSync()
+
+    def test_forget_then_fill_in_one_packet(self):
+        packet = packet_pb2.Packet()
+        packet.payload_type = constants.VISION_UPDATE
+        packet.objects.extend([1, 1, -2, -1,
+                               2, 2, -2, -1,
+                               1, 1, constants.OBJ_EMPTY, -1])
+
+        self.network.known_world[(2, 2)] = [(constants.OBJ_WALL, {})]
+        self.network._vision_update(packet)
+
+        self.assertEqual(self.network.known_world[(1, 1)],
+                         [(constants.OBJ_EMPTY, {})])
+        self.assertFalse((2, 2) in self.network.known_world)
+
+class VisionPartsTest(VisionSyncTest):
+    """The same, with every update split into many packets"""
+    def setUp(self):
+        self._size_limit = constants.PACKET_SIZE_LIMIT
+        constants.PACKET_SIZE_LIMIT = 40
+        VisionSyncTest.setUp(self)
+
+    def tearDown(self):
+        constants.PACKET_SIZE_LIMIT = self._size_limit
+
+    def vision_packets(self, packets):
+        return [packet for player_id, packet in packets
+                if player_id == self.player_id and
+                packet.payload_type == constants.VISION_UPDATE]
+
+    def test_incomplete_update_not_acked(self):
+        history = self.game.vision_history[self.player_id]
+        complete = self.network.vision_complete
+
+        # Everything changes when the player jumps somewhere else
+        self.game._kill_player(self.player_id, constants.ORIGIN_ENVIRONMENT,
+                               constants.DAMAGETYPE_UNKNOWN)
+        parts = self.vision_packets(self.game.flush())
+        self.assertTrue(len(parts) > 1)
+        self.assertEqual(set(p.vision_parts for p in parts),
+                         set((len(parts),)))
+
+        # All but the last part, so it can't be acked
+        self.deliver([(self.player_id, p) for p in parts[:-1]])
+        self.assertEqual(self.network.vision_complete, complete)
+        self.ack()
+        self.assertEqual(history.baseline, complete)
+
+        # The next update goes from the last complete one
+        self.turn()
+        self.assertEqual(self.network.vision_complete, history.sequence)
+        self.assertInSync()
+
+    def test_parts_out_of_order(self):
+        self.game._kill_player(self.player_id, constants.ORIGIN_ENVIRONMENT,
+                               constants.DAMAGETYPE_UNKNOWN)
+        parts = self.vision_packets(self.game.flush())
+        self.assertTrue(len(parts) > 1)
+
+        self.deliver([(self.player_id, p) for p in reversed(parts)])
+        self.assertEqual(self.network.vision_complete,
+                         self.game.vision_history[self.player_id].sequence)
+        self.assertInSync()
+
+if __name__=='__main__':
+    unittest.main()
@@ -6,8 +6,10 @@ import logging
 import random
 import re
 import struct
+import zlib
 
 import constants
+import objects
 
 logger = logging.getLogger(__name__)
 
@@ -155,6 +157,33 @@ class bidict(collections.MutableMapping):
     def __contains__(self, key):
         return key in self._items
 
+class SpatialHash(object):
+    """Things that each cover a number of cells, looked up by cell."""
+    def __init__(self):
+        self.cells = {}
+
+    def add(self, item, coords):
+        for coord in coords:
+            self.cells.setdefault(coord, []).append(item)
+
+    def remove(self, item, coords):
+        for coord in coords:
+            items = self.cells.get(coord)
+            if items is None or item not in items:
+                continue
+            items.remove(item)
+            if not items:
+                del self.cells[coord]
+
+    def __getitem__(self, coord):
+        return self.cells.get(coord, ())
+
+    def __len__(self):
+        return len(self.cells)
+
+    def items(self):
+        return self.cells.items()
+
 def grouper(n, iterable, fillvalue=None):
     "Collect data into fixed-length chunks or blocks"
     # grouper(3, 'ABCDEFG', 'x') --> ABC DEF Gxx
@@ -194,6 +223,14 @@ def bytes_to_human(bytes):
         fmt = "{0:.2f}{1}"
     return fmt.format(scaled, suffixes[value])
 
+def percentile(sorted_values, fraction):
+    # Nearest-rank percentile of an already sorted list, fraction in [0,1]
+    if not sorted_values:
+        return None
+    index = int(math.ceil(fraction * len(sorted_values))) - 1
+    index = min(max(index, 0), len(sorted_values) - 1)
+    return sorted_values[index]
+
 def dict_difference(old, new):
     changed = set()
     # So all keys that are not present/are present with the old
@@ -296,26 +333,50 @@ def ca_world_to_world(ca_world,inverse=False):
             is_wall = not is_wall
 
         if is_wall:
-            world[coord] = [(constants.OBJ_WALL, {})]
+            world[coord] = [objects.GameObject(constants.OBJ_WALL)]
         else:
-            world[coord] = [(constants.OBJ_EMPTY, {})]
+            world[coord] = [objects.GameObject(constants.OBJ_EMPTY)]
 
     return world
 
 _stream_fmt = '>L'
-
-def stream_wrap(data):
+# The top bit of a size says that the chunk is compressed
+_compressed_flag = 1 << 31
+
+class StreamCompressor(object):
+    """Compresses the chunks of one stream that are at least threshold
+    bytes long. The zlib context carries on from chunk to chunk, so
+    repeats of earlier chunks compress down to almost nothing; the other
+    end must decompress every compressed chunk, in order, with one
+    zlib.decompressobj()."""
+    def __init__(self, threshold=constants.COMPRESS_THRESHOLD,
+                 level=constants.COMPRESS_LEVEL):
+        self.threshold = threshold
+        self._compressobj = zlib.compressobj(level)
+
+    def compress(self, data):
+        # A sync flush ends the chunk on a byte boundary, with everything
+        # so far decompressable, without resetting the context
+        return (self._compressobj.compress(data) +
+                self._compressobj.flush(zlib.Z_SYNC_FLUSH))
+
+def stream_wrap(data, compressor=None):
     # Take binary data, and prepend a four byte integer size
     # and return the new data with the size prepended
     size = len(data)
 
+    if compressor is not None and size >= compressor.threshold:
+        data = compressor.compress(data)
+        size = len(data) | _compressed_flag
+
     size_bytes = struct.pack(_stream_fmt, size)
 
     return size_bytes + data
 
-def stream_unwrap(data):
+def stream_unwrap(data, decompressobj=None):
     # Given a stream of binary data, prepended with four bytes integer
-    # sizes, return a list of binary datas, and unconsumed data
+    # sizes, return a list of binary datas, and unconsumed data.
+    # Compressed chunks need the decompressobj for the stream.
 
     unpacked = []
 
@@ -325,13 +386,18 @@ def stream_unwrap(data):
         if len(data) < minimum_size:
             break
         next_chunk_size = struct.unpack(_stream_fmt, data[:minimum_size])[0]
+        compressed = bool(next_chunk_size & _compressed_flag)
+        next_chunk_size &= ~_compressed_flag
 
         if len(data) < minimum_size + next_chunk_size:
             break
         else:
             # Chop the leading size integer off
             data = data[minimum_size:]
-            unpacked.append(data[:next_chunk_size])
+            chunk = data[:next_chunk_size]
+            if compressed:
+                chunk = decompressobj.decompress(chunk)
+            unpacked.append(chunk)
 
             data = data[next_chunk_size:]
 
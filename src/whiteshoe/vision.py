@@ -48,7 +48,7 @@ def cone(world, coord, direction=None):
             v.add(coord)
             objects = world[coord]
             for o in objects:
-                if o[0] in constants.OPAQUE_OBJECTS:
+                if o.type in constants.OPAQUE_OBJECTS:
                     running = False
         return v
 
@@ -144,7 +144,7 @@ def rays(world, coord, direction=None):
         if previous_impedance is not None:
             return previous_impedance
         x, y = point
-        impeded = any(obj[0] in constants.OPAQUE_OBJECTS
+        impeded = any(obj.type in constants.OPAQUE_OBJECTS
                           for obj
                           in world.get(camera_to_world.apply(x, y), ()))
         impedances[point] = impeded
@@ -0,0 +1,111 @@
+import collections
+import multiprocessing
+import multiprocessing.sharedctypes
+
+import constants
+import objects
+import vision
+
+# The values in an opacity grid
+OFF_WORLD = 0
+CLEAR = 1
+OPAQUE = 2
+
+_OPAQUE_CELL = (objects.GameObject(constants.OBJ_WALL),)
+_CLEAR_CELL = ()
+
+class OpacityGrid(collections.Mapping):
+    """A read-only stand in for the world, for vision functions, that only
+    knows which cells are opaque. It reads from a flat array, which can
+    be in memory shared with other processes."""
+    def __init__(self, cells, width, height):
+        self.cells = cells
+        self.width = width
+        self.height = height
+        self._keys = None
+
+    def _value(self, coord):
+        x, y = coord
+        if 0 <= x < self.width and 0 <= y < self.height:
+            return self.cells[y * self.width + x]
+        return OFF_WORLD
+
+    def __getitem__(self, coord):
+        value = self._value(coord)
+        if value == OFF_WORLD:
+            raise KeyError(coord)
+        elif value == OPAQUE:
+            return _OPAQUE_CELL
+        else:
+            return _CLEAR_CELL
+
+    def __contains__(self, coord):
+        return self._value(coord) != OFF_WORLD
+
+    def __iter__(self):
+        # Which cells are in the world never changes
+        if self._keys is None:
+            width = self.width
+            self._keys = frozenset(
+                (i % width, i // width) for i in xrange(len(self.cells))
+                if self.cells[i] != OFF_WORLD)
+        return iter(self._keys)
+
+    def __len__(self):
+        return sum(1 for coord in self)
+
+class VisionPool(object):
+    """Works out what players can see in a pool of worker processes. The
+    workers share an opacity grid with this process, which is brought up
+    to date before each batch of work."""
+    def __init__(self, world, vision_name, processes=None):
+        self.width = max(x for x, y in world) + 1
+        self.height = max(y for x, y in world) + 1
+
+        self.cells = multiprocessing.sharedctypes.RawArray(
+            'b', self.width * self.height)
+        self.stale = set(world)
+        self.refresh(world)
+
+        self.pool = multiprocessing.Pool(
+            processes, initializer=_init_worker,
+            initargs=(self.cells, self.width, self.height, vision_name))
+
+    def mark(self, coord):
+        self.stale.add(coord)
+
+    def refresh(self, world):
+        cells = self.cells
+        width = self.width
+
+        for x, y in self.stale:
+            if any(obj.type in constants.OPAQUE_OBJECTS
+                   for obj in world[x, y]):
+                cells[y * width + x] = OPAQUE
+            else:
+                cells[y * width + x] = CLEAR
+
+        self.stale.clear()
+
+    def compute(self, world, requests):
+        """requests is a list of (coord, direction). Returns a list of
+        frozensets of visible coords, in the same order."""
+        self.refresh(world)
+        return self.pool.map(_worker_vision, requests)
+
+    def close(self):
+        self.pool.terminate()
+        self.pool.join()
+
+# Set in each worker process by _init_worker
+_worker_grid = None
+_worker_function = None
+
+def _init_worker(cells, width, height, vision_name):
+    global _worker_grid, _worker_function
+    _worker_grid = OpacityGrid(cells, width, height)
+    _worker_function = vision.functions[vision_name]
+
+def _worker_vision(request):
+    coord, direction = request
+    return frozenset(_worker_function(_worker_grid, coord, direction))